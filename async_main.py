@@ -0,0 +1,351 @@
+"""
+Асинхронный режим бота (AsyncTeleBot): те же сценарии, что и в main.py
+
+Запуск: python main.py --async
+"""
+import asyncio
+import logging
+from datetime import datetime
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import CallbackQuery, ReplyKeyboardRemove, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from config import TOKEN
+import telebot_calendar
+from async_sheets import AsyncGoogleSheets, get_cache_locations_async, run_blocking, setup
+import google_sheet
+from google_sheet import BookingResult
+from sheet_loader import parse_sheet_date
+from keyboards import create_markup_menu, button_to_menu
+import callback_router as cb
+from callback_router import CallbackRouter
+import clear_dict
+from clients import PHONES, chat_id_of, get_client_id
+from prefetcher import PREFETCHER
+from resilience import HANDLER_DEADLINE, SheetsUnavailable, deadline
+from send_queue import QUEUE, AsyncOutboundBot
+import metrics
+
+logger = logging.getLogger(__name__)
+bot = AsyncTeleBot(TOKEN)
+# Ответы обработчиков отправляются через общую с main.py очередь с ограничением скорости
+outbox = AsyncOutboundBot(bot, QUEUE)
+metrics.gauge('telegram_send_pending', 'Messages waiting in the Telegram send queue', lambda: QUEUE.pending)
+router = CallbackRouter()
+
+def create_client(chat_id) -> AsyncGoogleSheets:
+    """Создаёт объект AsyncGoogleSheets по chat_id"""
+    return clear_dict.SESSIONS.get_or_create(chat_id, AsyncGoogleSheets)
+
+@bot.message_handler(commands=['start'])
+async def check_phone_number(message):
+    """Запрашивает номер телефона у пользователя"""
+    if PHONES.get(message.chat.id) is None:
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+        button_phone = types.KeyboardButton(text="Отправить телефон 📞", request_contact=True)
+        markup.add(button_phone)
+        await outbox.send_message(message.chat.id, 'Для записи к психологу требуется номер телефона.',
+                                  reply_markup=markup)
+    else:
+        await menu(message)
+
+@bot.message_handler(content_types=['contact'])
+async def contact(message_contact):
+    """Сохраняет номер телефона пользователя"""
+    if message_contact.contact is not None:
+        PHONES.set(message_contact.chat.id, message_contact.contact.phone_number)
+        await outbox.send_message(message_contact.chat.id, 'Спасибо за доверие!',
+                                  reply_markup=ReplyKeyboardRemove())
+        await menu(message_contact)
+
+@bot.message_handler(content_types=['text'])
+async def any_word_before_number(message_any):
+    """Обработчик текстовых сообщений"""
+    await outbox.send_message(message_any.chat.id,
+                              text='Пользоваться ботом возможно только при наличии номера телефона!\n'
+                                   'Взаимодействие с ботом происходит кнопками.')
+
+async def menu(message):
+    """Главное меню"""
+    clear_dict.clear_unused_info(message.chat.id)
+    await outbox.send_message(message.chat.id, "Выберите пункт меню:",
+                              reply_markup=create_markup_menu())
+
+@bot.callback_query_handler(func=lambda call: True)
+async def dispatch_callback(call):
+    """Передаёт callback-запрос обработчику по префиксу (запросы к таблице ограничены дедлайном)"""
+    try:
+        with deadline(HANDLER_DEADLINE):
+            await router.dispatch_async(call)
+    except SheetsUnavailable as ex:
+        logger.warning('%s - таблица недоступна: %r', call.message.chat.id, ex)
+        await outbox.send_message(call.message.chat.id, 'Расписание временно недоступно, попробуйте позже 🙏')
+
+@router.fallback
+async def stale_button(call):
+    """Кнопка старого формата или неизвестные данные: ответ на нажатие и главное меню"""
+    await outbox.answer_callback_query(call.id, 'Кнопка устарела')
+    await go_to_menu(call)
+
+@router.route(cb.CANCEL_RECORD)
+async def cancel_record(call):
+    """Выбор записи для отмены"""
+    client = create_client(call.message.chat.id)
+    client_id = get_client_id(call.message.chat.id, call.from_user.username)
+    records = await client.get_record_async(client_id)
+    if len(records) != 0:
+        markup = InlineKeyboardMarkup(row_width=1)
+        markup.add(*[InlineKeyboardButton(text=' - '.join(x[:3]),
+                                         callback_data=cb.CANCEL.new(ind))
+                    for ind, x in enumerate(records)])
+        markup.add(*button_to_menu(return_callback=None, menu_text='В главное меню'))
+        await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                       message_id=call.message.message_id,
+                                       text='Какую запись вы хотите отменить?🙈',
+                                       reply_markup=markup)
+    else:
+        await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                       message_id=call.message.message_id,
+                                       text='Отменять пока нечего 🤷')
+        await check_phone_number(call.message)
+
+@router.route(cb.CANCEL)
+async def approve_cancel(call, index: int):
+    """Подтверждение отмены записи"""
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(*[InlineKeyboardButton(text='Подтверждаю', callback_data=cb.APPROVE_CANCEL.new(index)),
+                 InlineKeyboardButton(text='В главное меню', callback_data=cb.MENU.new())])
+    await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                   message_id=call.message.message_id,
+                                   text='Точно отменить?',
+                                   reply_markup=markup)
+
+@router.route(cb.APPROVE_CANCEL)
+async def set_cancel(call, index: int):
+    """Отмена записи"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        client_info = client.lst_records[index]
+        client.date_record, client.time_record, client.location, client.psychologist = client_info
+        client_id = get_client_id(call.message.chat.id, call.from_user.username)
+        if await client.set_time_async('', client_id):
+            await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                           message_id=call.message.message_id,
+                                           text='Запись отменена!')
+        else:
+            await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                           message_id=call.message.message_id,
+                                           text='Не смог отменить запись.')
+        await check_phone_number(call.message)
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.MY_RECORD)
+async def show_record(call):
+    """Показывает все записи клиента"""
+    client = create_client(call.message.chat.id)
+    client_id = get_client_id(call.message.chat.id, call.from_user.username)
+    records = await client.get_record_async(client_id)
+    rec = ''
+    if len(records) != 0:
+        rec += 'Ближайшие записи:\n\n'
+        for i in sorted(records, key=lambda x: (x[0], x[1], x[2])):
+            rec += '🪷' + ' - '.join(i) + '\n'
+    else:
+        rec = 'Актуальных записей не найдено 🔍'
+    await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                   message_id=call.message.message_id,
+                                   text=rec)
+    await check_phone_number(call.message)
+
+@router.route(cb.RECORD)
+async def choice_location(call):
+    """Выбор локации для записи"""
+    create_client(call.message.chat.id)
+    all_loc = await get_cache_locations_async()
+    markup = InlineKeyboardMarkup(row_width=3)
+    markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.LOCATION.new(x))
+                for x in all_loc.keys()])
+    markup.add(*button_to_menu(None))
+    await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                   message_id=call.message.message_id,
+                                   text="Выберите локацию:",
+                                   reply_markup=markup)
+
+@router.route(cb.LOCATION)
+async def choice_psychologist(call, location: str):
+    """Выбор психолога"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        client.location = location
+        dct = await get_cache_locations_async()
+        markup = InlineKeyboardMarkup(row_width=2)
+        markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.PSYCHOLOGIST.new(x))
+                    for x in dct[client.location]])
+        markup.add(InlineKeyboardButton(text='Любой психолог', callback_data=cb.PSYCHOLOGIST.new('ЛЮБОЙ')))
+        markup.add(*button_to_menu(cb.RECORD.new()))
+        await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                       message_id=call.message.message_id,
+                                       text="Выберите психолога:",
+                                       reply_markup=markup)
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.PSYCHOLOGIST)
+async def choice_date(call, psychologist: str):
+    """Выбор даты"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        if psychologist != 'ЛЮБОЙ':
+            client.psychologist = psychologist
+        else:
+            client.psychologist = None
+        year, month, lst = await client.get_first_month_days_async()
+        lst = [parse_sheet_date(x) for x in lst]
+        if len(lst) == 0:
+            location = client.location if client.location else 'ЛЮБОЙ'
+            markup = InlineKeyboardMarkup(row_width=2)
+            markup.add(*button_to_menu(cb.LOCATION.new(location)))
+            await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                           message_id=call.message.message_id,
+                                           text="Для выбранного психолога нет доступных дат!\n"
+                                                "Попробуйте другого психолога😉",
+                                           reply_markup=markup)
+        else:
+            client.lst_currant_date = lst
+            await outbox.edit_message_text(chat_id=call.from_user.id,
+                                           message_id=call.message.message_id,
+                                           text='Выберите доступную дату:\n ✅ - есть свободное время',
+                                           reply_markup=telebot_calendar.create_calendar(
+                                               name=cb.CALENDAR.prefix,
+                                               lst_current_date=lst, year=year, month=month))
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.CALENDAR)
+async def choice_time(call: CallbackQuery, action: str, year: int, month: int, day: str):
+    """Выбор времени"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        lst = client.lst_currant_date
+        if action == "IGNORE":
+            await outbox.answer_callback_query(callback_query_id=call.id, text='Тут ничего нет')
+        elif action == "DAY_EMPTY":
+            await outbox.answer_callback_query(callback_query_id=call.id, text='Свободного времени нет')
+        elif action == "DAY":
+            client.date_record = datetime(year, month, int(day)).strftime('%d.%m.%Y')
+            lst_times = await client.get_free_time_async()
+            client.dct_currant_time = lst_times
+            markup = InlineKeyboardMarkup(row_width=3)
+            markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.TIME.new(x))
+                        for x in lst_times])
+            psychologist = cb.PSYCHOLOGIST.new(client.psychologist if client.psychologist else 'ЛЮБОЙ')
+            markup.add(*button_to_menu(psychologist))
+            text = "Выберите время:" if len(lst_times) != 0 else "Для выбранной даты нет доступного времени!\n" \
+                                                                "Попробуйте другую дату😉"
+            await outbox.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+            await outbox.send_message(chat_id=call.from_user.id, text=text, reply_markup=markup)
+        elif action == "MENU":
+            await go_to_menu(call)
+        elif action == "RETURN":
+            await choice_psychologist(call, client.location)
+        else:
+            target = telebot_calendar.navigation_month(action, year, month)
+            if target is not None:
+                # Доступные дни месяца загружаются при переходе к нему
+                lst = [parse_sheet_date(x) for x in await client.get_month_days_async(*target)]
+                client.lst_currant_date = lst
+            markup = telebot_calendar.navigation_markup(cb.CALENDAR.prefix, action, year, month, lst)
+            if markup is None:
+                await outbox.answer_callback_query(callback_query_id=call.id, text="ERROR!")
+            else:
+                await outbox.edit_message_text(text=call.message.text,
+                                               chat_id=call.message.chat.id,
+                                               message_id=call.message.message_id,
+                                               reply_markup=markup)
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.TIME)
+async def approve_record(call, time: str):
+    """Подтверждение записи"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        client.time_record = time
+        date_object = datetime.strptime(client.date_record, '%d.%m.%Y')
+        name_calendar = cb.CALENDAR.new('DAY', date_object.year, date_object.month, date_object.day)
+        markup = InlineKeyboardMarkup(row_width=2)
+        markup.add(InlineKeyboardButton(text='Подтверждаю', callback_data=cb.APPROVE_RECORD.new()))
+        markup.add(*button_to_menu(name_calendar))
+        await outbox.edit_message_text(chat_id=call.message.chat.id,
+                                       message_id=call.message.message_id,
+                                       text=f'Проверьте данные записи:\n\n'
+                                            f'📍 Локация: {client.location}\n'
+                                            f'👤 Психолог: {client.psychologist if client.psychologist else "Любой"}\n'
+                                            f'📅 Дата: {client.date_record}\n'
+                                            f'🕓 Время: {client.time_record}',
+                                       reply_markup=markup)
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.APPROVE_RECORD)
+async def set_time(call):
+    """Установка времени записи"""
+    client = clear_dict.SESSIONS.get(call.from_user.id)
+    if client:
+        id_client = get_client_id(call.message.chat.id, call.from_user.username)
+        result = await client.set_time_async(id_client)
+        if result:
+            await outbox.edit_message_text(chat_id=call.from_user.id,
+                                           message_id=call.message.message_id,
+                                           text=f'Успешно записал вас!\n\n'
+                                                f'📍 Локация: {client.location}\n'
+                                                f'👤 Психолог: {client.psychologist if client.psychologist else "Любой"}\n'
+                                                f'📅 Дата: {client.date_record}\n'
+                                                f'🕓 Время: {client.time_record}')
+            await check_phone_number(call.message)
+        elif result is BookingResult.TAKEN:
+            await outbox.send_message(call.message.chat.id, 'Время кто-то забронировал...\nПопробуйте другое!')
+        else:
+            await outbox.send_message(call.message.chat.id, 'Выбранное время не найдено в расписании.\nПопробуйте другое!')
+    else:
+        await go_to_menu(call)
+
+@router.route(cb.MENU)
+async def go_to_menu(call):
+    """Возвращает в главное меню"""
+    await outbox.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    await check_phone_number(call.message)
+
+async def warm_up() -> None:
+    """Загружает локации и расписание параллельно с polling, затем запускает фоновое обновление"""
+    try:
+        await run_blocking(PREFETCHER.refresh_all)
+    except Exception:
+        logger.exception('Ошибка прогрева кэша')
+    PREFETCHER.start()
+
+# Сообщение клиенту, если запись из SQLite не попала в таблицу (STORAGE_ENGINE = 'sqlite')
+SYNC_CONFLICT_TEXT = ('К сожалению, запись на {date} в {time} не сохранилась: это время уже занято.\n'
+                      'Пожалуйста, выберите другое время 🙏')
+
+async def notify_sync_conflict(title: str, time_str: str, psychologist: str, client_record: str) -> None:
+    """Сообщает клиенту, что подтверждённая запись не попала в таблицу"""
+    chat_id = chat_id_of(client_record)
+    if chat_id is not None:
+        await outbox.send_message(chat_id, SYNC_CONFLICT_TEXT.format(date=title, time=time_str),
+                                  reply_markup=create_markup_menu())
+
+async def polling(warm=True) -> None:
+    """
+    Запускает асинхронный polling
+
+    :param warm: Прогревать кэш параллельно с polling
+    """
+    setup()
+    loop = asyncio.get_running_loop()
+    # Синхронизация SQLite идёт в своём потоке - уведомление отправляется в цикле событий
+    google_sheet.on_sync_conflict(lambda *args: asyncio.run_coroutine_threadsafe(notify_sync_conflict(*args), loop))
+    if warm:
+        # Ссылка на задачу держится до конца polling
+        warm_task = asyncio.create_task(warm_up())
+    await bot.infinity_polling()
@@ -0,0 +1,102 @@
+"""
+Асинхронный доступ к Google Sheets для AsyncTeleBot
+
+Запросы gspread выполняются в ограниченном пуле потоков, не блокируя цикл событий;
+ответы из памяти (индекс расписания, кэши) отдаются без перехода в поток.
+"""
+import asyncio
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import google_sheet
+from google_sheet import BookingResult, GoogleSheets, get_cache_locations
+from sheet_loader import parse_sheet_date
+
+# Максимум одновременных запросов к Google Sheets из асинхронного режима
+ASYNC_SHEETS_CONCURRENCY = 16
+
+_executor: ThreadPoolExecutor | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+def setup(concurrency=ASYNC_SHEETS_CONCURRENCY) -> None:
+    """
+    Создаёт пул потоков и пул HTTP-соединений на concurrency запросов
+
+    :param concurrency: Максимум одновременных запросов к Google Sheets
+    """
+    global _executor, _semaphore
+    _executor = ThreadPoolExecutor(concurrency, thread_name_prefix='sheets-async')
+    _semaphore = asyncio.Semaphore(concurrency)
+    google_sheet.configure_http_pool(concurrency)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Выполняет блокирующий вызов в пуле, ограничивая число одновременных вызовов.
+    Вызов видит контекст задачи (дедлайн и приоритет запросов).
+    """
+    if _executor is None:
+        setup()
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_executor, partial(context.run, fn, *args, **kwargs))
+
+
+def is_warm() -> bool:
+    """Локации и индекс расписания загружены - запросы отвечаются из памяти"""
+    return 'locations' in google_sheet.CACHE_WORKSHEETS and google_sheet.schedule_key() in google_sheet.CACHE_SCHEDULE
+
+
+async def get_cache_locations_async() -> dict:
+    """Асинхронный get_cache_locations"""
+    if 'locations' in google_sheet.CACHE_WORKSHEETS:
+        return get_cache_locations()
+    return await run_blocking(get_cache_locations)
+
+
+class AsyncGoogleSheets(GoogleSheets):
+    """GoogleSheets с асинхронными методами для AsyncTeleBot"""
+    __slots__ = ()
+
+    async def get_all_days_async(self) -> list:
+        """Асинхронный get_all_days"""
+        if is_warm():
+            return self.get_all_days()
+        return await run_blocking(self.get_all_days)
+
+    async def get_month_days_async(self, year: int, month: int) -> list:
+        """Асинхронный get_month_days"""
+        if is_warm() and google_sheet.is_month_loaded(year, month):
+            return self.get_month_days(year, month)
+        return await run_blocking(self.get_month_days, year, month)
+
+    async def get_first_month_days_async(self) -> tuple[int, int, list]:
+        """Асинхронный get_first_month_days"""
+        now = datetime.now(tz=google_sheet.tz)
+        year, month = google_sheet.next_month(now.year, now.month)
+        if is_warm() and google_sheet.is_month_loaded(now.year, now.month) and \
+                google_sheet.is_month_loaded(year, month):
+            return self.get_first_month_days()
+        return await run_blocking(self.get_first_month_days)
+
+    async def get_free_time_async(self) -> list:
+        """Асинхронный get_free_time"""
+        date_record = parse_sheet_date(self.date_record or '')
+        if is_warm() and self.date_record in google_sheet.SCHEDULE and \
+                (date_record is None or google_sheet.is_month_loaded(date_record.year, date_record.month)):
+            return self.get_free_time()
+        return await run_blocking(self.get_free_time)
+
+    async def set_time_async(self, client_record='', search_criteria='') -> BookingResult:
+        """Асинхронный set_time (запись всегда сверяется с таблицей)"""
+        return await run_blocking(self.set_time, client_record, search_criteria)
+
+    async def get_record_async(self, client_record: str, count_days=google_sheet.BOOKING_HORIZON_DAYS) -> list:
+        """Асинхронный get_record"""
+        if is_warm() and all(google_sheet.is_month_loaded(*x) for x in google_sheet.horizon_months(count_days)):
+            return self.get_record(client_record, count_days)
+        return await run_blocking(self.get_record, client_record, count_days)
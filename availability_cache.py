@@ -0,0 +1,102 @@
+"""
+Кэш доступных дат по (локация, психолог, месяц) без сериализации
+"""
+from threading import Lock
+
+from cachetools import TTLCache
+
+
+class _Any:
+    """Ключ 'любой психолог'"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'ANY'
+
+
+# Психолог не выбран (запись к любому психологу локации)
+ANY = _Any()
+
+
+class AvailabilityCache:
+    """
+    Доступные даты (названия листов, по возрастанию даты) по ключу (локация, психолог|ANY, месяц)
+
+    Месяц - (год, месяц) для календаря месяца или None для ближайших дней.
+
+    :param maxsize: Максимальное количество ключей
+    :param ttl: Время жизни записи в секундах
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+
+    @staticmethod
+    def key(location: str | None, psychologist: str | None, month: tuple[int, int] | None = None) -> tuple:
+        """Ключ кэша"""
+        return location, ANY if psychologist is None else psychologist, month
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, location: str | None, psychologist: str | None,
+            month: tuple[int, int] | None = None) -> list[str] | None:
+        """
+        Доступные даты из кэша
+
+        :param location: Название локации
+        :param psychologist: Имя психолога (None - любой)
+        :param month: (год, месяц) или None - ближайшие дни
+        :return: Копия списка дат или None, если ключа нет
+        """
+        with self._lock:
+            dates = self._cache.get(self.key(location, psychologist, month))
+        return None if dates is None else list(dates)
+
+    def put(self, location: str | None, psychologist: str | None, dates: list[str],
+            month: tuple[int, int] | None = None) -> None:
+        """
+        Сохраняет доступные даты
+
+        :param location: Название локации
+        :param psychologist: Имя психолога (None - любой)
+        :param dates: Доступные даты
+        :param month: (год, месяц) или None - ближайшие дни
+        """
+        with self._lock:
+            self._cache[self.key(location, psychologist, month)] = tuple(dates)
+
+    def keys_for(self, psychologist: str | None, locations: dict) -> list[tuple]:
+        """
+        Ключи, на которые влияет слот психолога: сам психолог и 'любой' в его локациях
+
+        :param psychologist: Имя психолога (None - все ключи)
+        :param locations: Словарь {локация: [психологи]}
+        """
+        with self._lock:
+            return [key for key in self._cache
+                    if psychologist is None or key[1] == psychologist or
+                    (key[1] is ANY and (key[0] is None or psychologist in locations.get(key[0], ())))]
+
+    def patch(self, key: tuple, title: str, available: bool, order) -> None:
+        """
+        Добавляет или убирает одну дату в записи кэша
+
+        :param key: Ключ кэша
+        :param title: Название листа (дата)
+        :param available: Есть ли на дату свободное время
+        :param order: Функция сортировки дат
+        """
+        with self._lock:
+            dates = self._cache.get(key)
+            if dates is None or (title in dates) == available:
+                return
+            if available:
+                self._cache[key] = tuple(sorted(dates + (title,), key=order))
+            else:
+                self._cache[key] = tuple(x for x in dates if x != title)
+
+    def clear(self) -> None:
+        """Сбрасывает кэш"""
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,3 @@
+"""
+Офлайн-бенчмарки с поддельной таблицей Google Sheets
+"""
@@ -0,0 +1,70 @@
+"""
+Сравнение выгрузки листов с датами: get_all_records() по листам против одного batchGet
+
+Запуск: python -m benchmarks.bench_batch_get
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from threading import Lock
+from time import perf_counter
+
+from benchmarks.fake_gspread import build_spreadsheet
+from sheet_catalogue import SheetCatalogue
+from sheet_loader import batch_get_records
+
+IGNOR_WORKSHEETS = ['Психологи']
+
+
+def date_titles(spreadsheet, count_days=7) -> list[str]:
+    """Листы с датами на ближайшие count_days дней (как их отбирает бот)"""
+    catalogue = SheetCatalogue(IGNOR_WORKSHEETS)
+    catalogue.update([x.title for x in spreadsheet.worksheets()])
+    return catalogue.next_days(date.today(), count_days)
+
+
+def load_per_sheet(spreadsheet, count_days=7) -> dict[str, list[dict]]:
+    """Прежний способ: отдельный get_all_records() на каждый лист под общим lock"""
+    lock = Lock()
+    titles = date_titles(spreadsheet, count_days)
+
+    def load(title):
+        with lock:
+            return title, spreadsheet.sheets[title].get_all_records()
+
+    with ThreadPoolExecutor(2) as executor:
+        return dict(executor.map(load, titles))
+
+
+def load_batch(spreadsheet, count_days=7) -> dict[str, list[dict]]:
+    """Новый способ: все листы одним запросом values:batchGet"""
+    titles = date_titles(spreadsheet, count_days)
+    return batch_get_records(spreadsheet, titles)
+
+
+def run(loader, latency: float, repeat: int) -> tuple[int, float]:
+    """
+    Выполняет загрузку repeat раз
+
+    :return: (запросов за одну загрузку, среднее время в секундах)
+    """
+    spreadsheet = build_spreadsheet(days=8, psychologists=5, slots=8, latency=latency)
+    start = perf_counter()
+    for _ in range(repeat):
+        loader(spreadsheet)
+    elapsed = (perf_counter() - start) / repeat
+    return spreadsheet.round_trips // repeat, elapsed
+
+
+def main(latency=0.2, repeat=5) -> None:
+    """Печатает количество запросов и время для обоих способов"""
+    reference = load_per_sheet(build_spreadsheet(days=8, psychologists=5, slots=8))
+    assert reference == load_batch(build_spreadsheet(days=8, psychologists=5, slots=8))
+    print(f'Задержка запроса: {latency} c, повторов: {repeat}')
+    for name, loader in (('get_all_records по листам', load_per_sheet),
+                         ('values:batchGet', load_batch)):
+        round_trips, elapsed = run(loader, latency, repeat)
+        print(f'{name:<28} запросов: {round_trips:>3}  время: {elapsed:.3f} c')
+
+
+if __name__ == '__main__':
+    main()
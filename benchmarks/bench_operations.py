@@ -0,0 +1,163 @@
+"""
+Основные операции бота на поддельной таблице: задержка p50/p99,
+запросы к API и выделенная память на одну операцию.
+Холодный вызов - с пустыми кэшами и индексом расписания, тёплый - из кэша.
+
+Запуск: python -m benchmarks.bench_operations [--days 14] [--psychologists 10] [--slots 12]
+        [--latency 0.05] [--quota 60] [--repeat 50]
+"""
+import argparse
+import tracemalloc
+from datetime import date, datetime, timedelta
+from statistics import quantiles
+from time import perf_counter
+
+import google_sheet as gs
+import telebot_calendar
+from benchmarks.fake_gspread import build_spreadsheet
+from schedule_index import ScheduleIndex
+from sheet_loader import DATE_FORMAT
+from sheets_quota import QUOTA
+
+# Квота планировщика, если квота таблицы не задана (запросы не ждут токенов)
+UNLIMITED_QUOTA = 10 ** 9
+
+
+def reset_caches() -> None:
+    """Пустые кэши и индекс расписания (как после запуска бота)"""
+    gs.CACHE_WORKSHEETS.clear()
+    gs.CACHE_SCHEDULE.clear()
+    gs.CACHE_DAYS.clear()
+    gs.CACHE_MONTHS.clear()
+    gs.SCHEDULE = ScheduleIndex()
+    telebot_calendar._render_calendar.cache_clear()
+
+
+def make_session(location: str, day: str | None = None) -> gs.GoogleSheets:
+    """Сессия пользователя, выбравшего локацию, любого психолога и дату day"""
+    session = gs.GoogleSheets('bench')
+    session.location = location
+    session.date_record = day
+    return session
+
+
+def operations(location: str, day: str) -> list[tuple]:
+    """
+    Измеряемые операции
+
+    :param location: Локация пользователя
+    :param day: Дата записи (лист таблицы)
+    :return: Список (название, подготовка, операция, очистка): подготовка возвращает аргументы
+        операции, подготовка и очистка не замеряются
+    """
+    session = make_session(location, day)
+    booked = []
+
+    def book() -> tuple:
+        session.psychologist = None
+        session.time_record = session.get_free_time()[0]
+        booked.append(f'id: bench-{len(booked)}\n@bench\n')
+        return booked[-1],
+
+    def cancel() -> None:
+        session.set_time('', booked[-1])
+
+    def calendar_days() -> tuple:
+        return [datetime.strptime(x, DATE_FORMAT).date() for x in session.get_all_days()],
+
+    def calendar(days: list) -> str:
+        return telebot_calendar.create_calendar(days, name='CALENDAR').to_json()
+
+    day_date = datetime.strptime(day, DATE_FORMAT)
+    next_month = gs.next_month(day_date.year, day_date.month)
+    record = 'id: 0\n@user\n'
+    return [
+        ('get_cache_locations', None, gs.get_cache_locations, None),
+        ('get_all_days', None, session.get_all_days, None),
+        ('get_month_days', None, lambda: session.get_month_days(*next_month), None),
+        ('get_free_time', None, session.get_free_time, None),
+        ('get_record', None, lambda: session.get_record(record), None),
+        ('create_calendar', calendar_days, calendar, None),
+        ('set_time', book, session.set_time, cancel),
+    ]
+
+
+def measure(prepare, operation, cleanup, cold: bool, repeat: int, spreadsheet) -> dict:
+    """
+    Выполняет операцию repeat раз (и ещё раз для прогрева и под tracemalloc)
+
+    :return: Задержки p50/p99 в секундах, запросы к API на операцию и пик памяти в КиБ
+    """
+    timings = []
+    round_trips = 0
+    peak = 0
+    for i in range(repeat + 2):
+        if cold:
+            reset_caches()
+        args = () if prepare is None else prepare()
+        traced = i == repeat + 1
+        if traced:
+            # Замер памяти отдельным вызовом: tracemalloc искажает время
+            tracemalloc.start()
+        before = spreadsheet.round_trips
+        start = perf_counter()
+        operation(*args)
+        elapsed = perf_counter() - start
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif i:
+            # Первый вызов прогревает интерпретатор
+            timings.append(elapsed)
+            round_trips += spreadsheet.round_trips - before
+        if cleanup is not None:
+            cleanup()
+    percentiles = quantiles(timings, n=100, method='inclusive')
+    return {'p50': percentiles[49], 'p99': percentiles[98], 'round_trips': round_trips / repeat,
+            'memory_kib': peak / 1024}
+
+
+def main(days=14, psychologists=10, slots=12, latency=0.0, quota=0, repeat=50) -> dict:
+    """
+    Печатает и возвращает результаты всех операций
+
+    :param days: Листов с датами
+    :param psychologists: Психологов
+    :param slots: Слотов у психолога в день
+    :param latency: Задержка запроса к таблице в секундах
+    :param quota: Квота чтений и записей в минуту (0 - без ограничения)
+    :param repeat: Повторов каждой операции
+    """
+    spreadsheet = build_spreadsheet(days=days, psychologists=psychologists, slots=slots,
+                                    latency=latency, quota=quota)
+    gs.use_spreadsheet(spreadsheet)
+    QUOTA.configure(quota or UNLIMITED_QUOTA, quota or UNLIMITED_QUOTA)
+    reset_caches()
+    location = next(iter(gs.get_cache_locations()))
+    day = (date.today() + timedelta(days=1)).strftime(DATE_FORMAT)
+
+    print(f'Листов: {days}, психологов: {psychologists}, слотов: {slots}, '
+          f'задержка: {latency} c, квота: {quota or "нет"}, повторов: {repeat}')
+    print(f'{"операция":<22}{"кэш":<10}{"p50, мс":>10}{"p99, мс":>10}{"запросов":>10}{"память, КиБ":>13}')
+    results = {}
+    for name, prepare, operation, cleanup in operations(location, day):
+        for cold in (True, False):
+            state = 'холодный' if cold else 'тёплый'
+            result = measure(prepare, operation, cleanup, cold, repeat, spreadsheet)
+            results[name, state] = result
+            print(f'{name:<22}{state:<10}{result["p50"] * 1000:>10.3f}{result["p99"] * 1000:>10.3f}'
+                  f'{result["round_trips"]:>10.2f}{result["memory_kib"]:>13.1f}')
+    if spreadsheet.rejected:
+        print(f'Отклонено по квоте (429): {spreadsheet.rejected}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк операций бота на поддельной таблице')
+    parser.add_argument('--days', type=int, default=14, help='листов с датами')
+    parser.add_argument('--psychologists', type=int, default=10, help='психологов')
+    parser.add_argument('--slots', type=int, default=12, help='слотов у психолога в день')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка запроса в секундах')
+    parser.add_argument('--quota', type=int, default=0, help='квота запросов в минуту (0 - без ограничения)')
+    parser.add_argument('--repeat', type=int, default=50, help='повторов каждой операции')
+    main(**vars(parser.parse_args()))
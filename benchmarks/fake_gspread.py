@@ -0,0 +1,206 @@
+"""
+Поддельная таблица gspread в памяти процесса с задержкой сетевых запросов
+"""
+from collections import deque
+from datetime import date, timedelta
+from itertools import count
+from threading import Lock
+from time import monotonic, sleep
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+from sheet_loader import DATE_FORMAT
+
+HEADER = ['Время', 'Психолог', 'Клиент']
+# Запросы, расходующие квоту записи (остальные - квоту чтения)
+WRITE_REQUESTS = ('update_cell', 'values_update', 'copy_to', 'batch_update', 'del_worksheet')
+# Таблицы по id (для копирования листов между таблицами)
+SPREADSHEETS = {}
+_ids = count(1)
+
+
+class FakeResponse:
+    """Ответ API для gspread.exceptions.APIError"""
+    def __init__(self, status_code: int, message: str, status='RESOURCE_EXHAUSTED'):
+        self.status_code = status_code
+        self.text = message
+        self._json = {'error': {'code': status_code, 'message': message, 'status': status}}
+
+    def json(self) -> dict:
+        return self._json
+
+
+class FakeWorksheet:
+    """Лист поддельной таблицы"""
+    def __init__(self, spreadsheet, title: str, values: list[list]):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = values
+        self.id = next(_ids)
+
+    def get_all_records(self) -> list[dict]:
+        """Аналог gspread Worksheet.get_all_records()"""
+        self.spreadsheet.request('get_all_records')
+        header = self.values[0]
+        return [dict(zip(header, row)) for row in self.values[1:]]
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        """Аналог gspread Worksheet.update_cell()"""
+        self.spreadsheet.request('update_cell')
+        self.values[row - 1][col - 1] = value
+
+    def copy_to(self, spreadsheet_id: str) -> dict:
+        """Аналог gspread Worksheet.copy_to(): копия 'Copy of ...' в таблице spreadsheet_id"""
+        self.spreadsheet.request('copy_to')
+        copy = SPREADSHEETS[spreadsheet_id].add_worksheet(f'Copy of {self.title}',
+                                                          [list(row) for row in self.values])
+        return {'sheetId': copy.id, 'title': copy.title}
+
+
+class FakeSpreadsheet:
+    """
+    Таблица в памяти, считающая запросы и имитирующая задержку сети и квоты API
+
+    :param latency: Задержка одного запроса в секундах
+    :param quota: Квота чтений и квота записей в минуту (0 - без ограничения),
+        сверх квоты запрос завершается ошибкой 429
+    """
+    def __init__(self, latency=0.0, quota=0):
+        self.latency = latency
+        self.quota = quota
+        self.id = f'fake-{next(_ids)}'
+        SPREADSHEETS[self.id] = self
+        self.sheets = {}
+        self.calls = {}
+        self.rejected = 0
+        # Время запросов за последнюю минуту по видам квоты
+        self._window = {'read': deque(), 'write': deque()}
+        self._lock = Lock()
+
+    @property
+    def round_trips(self) -> int:
+        """Общее количество запросов к API"""
+        return sum(self.calls.values())
+
+    def reset_calls(self) -> None:
+        """Обнуляет счётчики запросов"""
+        with self._lock:
+            self.calls.clear()
+
+    def request(self, name: str) -> None:
+        """Учитывает запрос, проверяет квоту и ждёт задержку сети"""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.quota:
+                window = self._window['write' if name in WRITE_REQUESTS else 'read']
+                now = monotonic()
+                while window and window[0] <= now - 60:
+                    window.popleft()
+                if len(window) >= self.quota:
+                    self.rejected += 1
+                    raise gspread.exceptions.APIError(FakeResponse(429, 'Quota exceeded'))
+                window.append(now)
+        if self.latency:
+            sleep(self.latency)
+
+    def add_worksheet(self, title: str, values: list[list]) -> FakeWorksheet:
+        """Добавляет лист без учёта запроса"""
+        ws = FakeWorksheet(self, title, values)
+        self.sheets[title] = ws
+        return ws
+
+    def worksheets(self) -> list[FakeWorksheet]:
+        """Аналог gspread Spreadsheet.worksheets()"""
+        self.request('worksheets')
+        return list(self.sheets.values())
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        """Аналог gspread Spreadsheet.worksheet()"""
+        self.request('worksheet')
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def _parse_range(self, rng: str) -> tuple[list[list], dict]:
+        """Лист и границы (с нуля, конец не включается) диапазона 'лист'!A1:C1"""
+        title, _, cells = rng.rpartition('!')
+        return self._sheet(title).values, a1_range_to_grid_range(cells)
+
+    def _sheet(self, title: str) -> FakeWorksheet:
+        """Лист по названию из диапазона (как API, ошибка 400 для несуществующего листа)"""
+        title = title.strip("'").replace("''", "'")
+        if title not in self.sheets:
+            raise gspread.exceptions.APIError(
+                FakeResponse(400, f'Unable to parse range: {title}', 'INVALID_ARGUMENT'))
+        return self.sheets[title]
+
+    def batch_update(self, body: dict) -> dict:
+        """Аналог gspread Spreadsheet.batch_update() (только переименование листов)"""
+        self.request('batch_update')
+        by_id = {ws.id: ws for ws in self.sheets.values()}
+        for request in body['requests']:
+            properties = request['updateSheetProperties']['properties']
+            ws = by_id[properties['sheetId']]
+            del self.sheets[ws.title]
+            ws.title = properties['title']
+            self.sheets[ws.title] = ws
+        return {'replies': [{} for _ in body['requests']]}
+
+    def del_worksheet(self, worksheet: FakeWorksheet) -> None:
+        """Аналог gspread Spreadsheet.del_worksheet()"""
+        self.request('del_worksheet')
+        del self.sheets[worksheet.title]
+
+    def values_get(self, rng: str, params=None) -> dict:
+        """Аналог gspread Spreadsheet.values_get()"""
+        self.request('values_get')
+        values, grid = self._parse_range(rng)
+        rows = values[grid['startRowIndex']:grid['endRowIndex']]
+        return {'range': rng, 'values': [row[grid['startColumnIndex']:grid['endColumnIndex']] for row in rows]}
+
+    def values_update(self, rng: str, params=None, body=None) -> dict:
+        """Аналог gspread Spreadsheet.values_update()"""
+        self.request('values_update')
+        values, grid = self._parse_range(rng)
+        for i, row in enumerate(body['values']):
+            target = values[grid['startRowIndex'] + i]
+            for j, value in enumerate(row):
+                target[grid['startColumnIndex'] + j] = value
+        return {'updatedRange': rng}
+
+    def values_batch_get(self, ranges: list[str], params=None) -> dict:
+        """Аналог gspread Spreadsheet.values_batch_get()"""
+        self.request('values_batch_get')
+        value_ranges = []
+        for rng in ranges:
+            value_ranges.append({'range': rng, 'values': self._sheet(rng).values})
+        return {'valueRanges': value_ranges}
+
+
+def build_spreadsheet(days=8, psychologists=5, slots=8, latency=0.0, start: date = None,
+                      quota=0) -> FakeSpreadsheet:
+    """
+    Создаёт таблицу с листом 'Психологи' и листами с датами
+
+    :param days: Количество листов с датами
+    :param psychologists: Количество психологов
+    :param slots: Количество слотов у психолога в день
+    :param latency: Задержка одного запроса в секундах
+    :param start: Первая дата (по умолчанию - сегодня)
+    :param quota: Квота запросов каждого вида в минуту (0 - без ограничения)
+    """
+    start = start or date.today()
+    spreadsheet = FakeSpreadsheet(latency, quota)
+    names = [f'Психолог {i}' for i in range(psychologists)]
+    spreadsheet.add_worksheet('Психологи', [['Локация', 'Психолог']] +
+                              [[f'Локация {i % 3}', name] for i, name in enumerate(names)])
+    for day in range(days):
+        title = (start + timedelta(days=day)).strftime(DATE_FORMAT)
+        rows = [list(HEADER)]
+        for name in names:
+            for slot in range(slots):
+                client = f'id: {slot}\n@user\n' if slot % 3 == 0 else ''
+                rows.append([f'{10 + slot:02d}:00', name, client])
+        spreadsheet.add_worksheet(title, rows)
+    return spreadsheet
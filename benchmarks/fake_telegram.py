@@ -0,0 +1,101 @@
+"""
+Поддельный Telegram Bot API в памяти процесса: запросы TeleBot не уходят в сеть,
+а записываются по чатам с имитацией задержки сети
+"""
+import json
+from itertools import count
+from threading import Condition
+from time import monotonic, sleep
+
+from telebot import apihelper
+
+
+class FakeResponse:
+    """Ответ API для telebot.apihelper._check_result"""
+    status_code = 200
+
+    def __init__(self, result):
+        self._json = {'ok': True, 'result': result}
+        self.text = json.dumps(self._json)
+
+    def json(self) -> dict:
+        return self._json
+
+
+class FakeTelegram:
+    """
+    Bot API, отвечающий успехом на любой запрос
+
+    :param latency: Задержка одного запроса в секундах
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        # chat_id -> список запросов {'method', 'params', 'message_id'}
+        self.chats: dict[int, list[dict]] = {}
+        self._message_ids = count(1)
+        self._cond = Condition()
+
+    def install(self) -> None:
+        """Направляет запросы TeleBot в эту заглушку"""
+        apihelper.CUSTOM_REQUEST_SENDER = self
+
+    @staticmethod
+    def uninstall() -> None:
+        """Возвращает отправку запросов в сеть"""
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None) -> FakeResponse:
+        """Аналог requests.Session.request для apihelper.CUSTOM_REQUEST_SENDER"""
+        name = url.rsplit('/', 1)[-1]
+        params = dict(params or {})
+        if self.latency:
+            sleep(self.latency)
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if name == 'sendMessage':
+            message_id = next(self._message_ids)
+        else:
+            message_id = int(params.get('message_id', 0))
+        with self._cond:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if chat_id is not None:
+                self.chats.setdefault(chat_id, []).append(
+                    {'method': name, 'params': params, 'message_id': message_id, 'time': monotonic()})
+            self._cond.notify_all()
+        if name in ('sendMessage', 'editMessageText'):
+            return FakeResponse({'message_id': message_id, 'date': 0, 'text': params.get('text', ''),
+                                 'chat': {'id': chat_id, 'type': 'private'}})
+        return FakeResponse(True)
+
+    def sent(self, chat_id: int) -> int:
+        """Количество запросов в чат"""
+        with self._cond:
+            return len(self.chats.get(chat_id, ()))
+
+    def wait_reply(self, chat_id: int, since: int, timeout: float) -> dict | None:
+        """
+        Ждёт сообщение в чат (отправку или изменение текста)
+
+        :param chat_id: Чат
+        :param since: Количество запросов в чат до действия пользователя (см. sent())
+        :param timeout: Максимальное ожидание в секундах
+        :return: Запрос {'method', 'params', 'message_id', 'time'} или None по таймауту
+        """
+        def find():
+            for request in self.chats.get(chat_id, ())[since:]:
+                if 'text' in request['params']:
+                    return request
+            return None
+
+        with self._cond:
+            self._cond.wait_for(lambda: find() is not None, timeout)
+            return find()
+
+
+def buttons(request: dict) -> list[str]:
+    """Callback-данные кнопок сообщения"""
+    markup = request['params'].get('reply_markup')
+    if not markup:
+        return []
+    keyboard = json.loads(markup).get('inline_keyboard', [])
+    return [button['callback_data'] for row in keyboard for button in row if 'callback_data' in button]
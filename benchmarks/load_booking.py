@@ -0,0 +1,301 @@
+"""
+Нагрузочный тест: N пользователей одновременно проходят запись через обработчики main.py
+(/start -> локация -> психолог -> дата -> время -> подтверждение) с поддельными
+Telegram API и таблицей. Печатает пропускную способность, задержки шагов
+и проверяет таблицу на двойные и потерянные записи.
+
+Задержка обработчика - время обработки обновления, задержка ответа - до получения
+пользователем сообщения (включая очередь отправки).
+
+Запуск: python -m benchmarks.load_booking [--users 50] [--pick first|random] [--attempts 3]
+        [--days 7] [--psychologists 10] [--slots 12] [--latency 0.05] [--quota 60]
+        [--telegram-latency 0.05] [--telegram-limits]
+"""
+import argparse
+import importlib.util
+import random
+import sys
+import tempfile
+import types
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from os import path
+from statistics import quantiles
+from threading import Barrier, Lock
+from time import perf_counter
+
+from telebot.types import Update
+
+import clients
+import google_sheet as gs
+from benchmarks.bench_operations import UNLIMITED_QUOTA, reset_caches
+from benchmarks.fake_gspread import build_spreadsheet
+from benchmarks.fake_telegram import FakeTelegram, buttons
+from send_queue import OutboundBot, SendQueue
+from sheets_quota import QUOTA
+
+# Шаги разговора в порядке прохождения
+STEPS = ('start', 'record', 'location', 'psychologist', 'day', 'time', 'approve')
+# Ожидание ответа бота на шаг в секундах
+REPLY_TIMEOUT = 30
+# Первый chat_id пользователей (не пересекается с клиентами таблицы)
+FIRST_CHAT_ID = 1_000_000
+
+
+def import_bot():
+    """Импортирует main.py; без config.py (токен не нужен заглушке) подставляет фиктивный"""
+    if importlib.util.find_spec('config') is None:
+        sys.modules['config'] = types.SimpleNamespace(TOKEN='0:offline')
+    import main
+    return main
+
+
+class User:
+    """
+    Пользователь Telegram, нажимающий кнопки из ответов бота
+
+    :param bot: Модуль main
+    :param telegram: Поддельный Telegram API
+    :param chat_id: id пользователя (он же id чата)
+    :param rng: Генератор выбора кнопок (None - всегда первая кнопка)
+    """
+    _update_ids = count(1)
+
+    def __init__(self, bot, telegram: FakeTelegram, chat_id: int, rng: random.Random | None):
+        self.bot = bot
+        self.telegram = telegram
+        self.chat_id = chat_id
+        self.rng = rng
+        self.reply = None
+        # Шаг -> [(задержка обработчика, задержка ответа)]
+        self.timings: dict[str, list[tuple[float, float]]] = {}
+
+    def _user(self) -> dict:
+        return {'id': self.chat_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{self.chat_id}'}
+
+    def _chat(self) -> dict:
+        return {'id': self.chat_id, 'type': 'private'}
+
+    def _send(self, step: str, update: dict) -> dict | None:
+        """Передаёт обновление обработчикам и ждёт ответ бота"""
+        since = self.telegram.sent(self.chat_id)
+        update['update_id'] = next(self._update_ids)
+        start = perf_counter()
+        self.bot.bot.process_new_updates([Update.de_json(update)])
+        handled = perf_counter() - start
+        self.reply = self.telegram.wait_reply(self.chat_id, since, REPLY_TIMEOUT)
+        if self.reply is not None:
+            self.timings.setdefault(step, []).append((handled, perf_counter() - start))
+        return self.reply
+
+    def start(self) -> dict | None:
+        """Команда /start"""
+        message = {'message_id': 0, 'date': 0, 'chat': self._chat(), 'from': self._user(), 'text': '/start',
+                   'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}
+        return self._send('start', {'message': message})
+
+    def press(self, step: str, data: str) -> dict | None:
+        """Нажатие кнопки с callback-данными data в последнем сообщении бота"""
+        message = {'message_id': self.reply['message_id'], 'date': 0, 'chat': self._chat(),
+                   'text': self.reply['params'].get('text', '')}
+        callback = {'id': str(next(self._update_ids)), 'from': self._user(), 'chat_instance': str(self.chat_id),
+                    'data': data, 'message': message}
+        return self._send(step, {'callback_query': callback})
+
+    def choose(self, prefix: str) -> str | None:
+        """Кнопка с префиксом prefix в последнем сообщении бота"""
+        options = [x for x in buttons(self.reply) if x.startswith(prefix)]
+        if not options:
+            return None
+        return options[0] if self.rng is None else self.rng.choice(options)
+
+    def book(self) -> str:
+        """
+        Проходит запись от главного меню до подтверждения
+
+        :return: 'booked', 'taken', 'not_found', 'no_dates', 'no_times' или 'timeout'
+        """
+        steps = (('record', 'RECORD'), ('location', 'LOCATION:'), ('psychologist', 'PSYCHOLOGIST:'))
+        for step, prefix in steps:
+            data = self.choose(prefix)
+            if data is None or self.press(step, data) is None:
+                return 'timeout'
+        # Доступные даты могут быть в следующем месяце
+        day = self.choose('CALENDAR:DAY:')
+        for _ in range(2):
+            if day is not None:
+                break
+            data = self.choose('CALENDAR:NEXT-MONTH:')
+            if data is None:
+                return 'no_dates'
+            if self.press('calendar', data) is None:
+                return 'timeout'
+            day = self.choose('CALENDAR:DAY:')
+        if day is None:
+            return 'no_dates'
+        if self.press('day', day) is None:
+            return 'timeout'
+        time = self.choose('TIME:')
+        if time is None:
+            return 'no_times'
+        if self.press('time', time) is None or self.press('approve', 'APP_REC') is None:
+            return 'timeout'
+        text = self.reply['params']['text']
+        if text.startswith('Успешно'):
+            return 'booked'
+        return 'taken' if 'забронировал' in text else 'not_found'
+
+
+def booked_slots(spreadsheet) -> dict[str, list[tuple]]:
+    """Занятые слоты таблицы: клиент -> [(лист, строка)]"""
+    result = {}
+    for title, sheet in spreadsheet.sheets.items():
+        for row, values in enumerate(sheet.values[1:], start=2):
+            if len(values) > 2 and values[2] and 'Время' in sheet.values[0]:
+                result.setdefault(values[2], []).append((title, row))
+    return result
+
+
+def percentile(values: list[float], p: int) -> float:
+    """Перцентиль p (1-99) значений"""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def main(users=50, pick='first', attempts=3, days=7, psychologists=10, slots=12, latency=0.0, quota=0,
+         telegram_latency=0.0, telegram_limits=False, seed=1) -> dict:
+    """
+    Запускает нагрузочный тест и печатает результаты
+
+    :param users: Количество одновременных пользователей
+    :param pick: 'first' - все выбирают первые кнопки (борьба за слоты), 'random' - случайные
+    :param attempts: Попыток записи пользователя, если время успели занять
+    :param days: Листов с датами
+    :param psychologists: Психологов
+    :param slots: Слотов у психолога в день
+    :param latency: Задержка запроса к таблице в секундах
+    :param quota: Квота чтений и записей таблицы в минуту (0 - без ограничения)
+    :param telegram_latency: Задержка запроса к Telegram API в секундах
+    :param telegram_limits: Оставить ограничения скорости отправки Telegram
+    :param seed: Начальное значение генератора при pick='random'
+    """
+    bot = import_bot()
+    telegram = FakeTelegram(telegram_latency)
+    telegram.install()
+    # Обработчики выполняются в потоке пользователя
+    bot.bot.threaded = False
+    if not telegram_limits:
+        unlimited = 10 ** 6
+        bot.outbox = OutboundBot(bot.bot, SendQueue(workers=16, global_per_second=unlimited,
+                                                     chat_per_second=unlimited, chat_burst=unlimited))
+    spreadsheet = build_spreadsheet(days=days, psychologists=psychologists, slots=slots,
+                                    latency=latency, quota=quota)
+    gs.use_spreadsheet(spreadsheet)
+    QUOTA.configure(quota or UNLIMITED_QUOTA, quota or UNLIMITED_QUOTA)
+    reset_caches()
+    # Телефоны пользователей во временной базе
+    phones = clients.PhoneRegistry(path.join(tempfile.mkdtemp(), 'clients.sqlite3'))
+    clients.PHONES = bot.PHONES = phones
+    chat_ids = [FIRST_CHAT_ID + i for i in range(users)]
+    for chat_id in chat_ids:
+        phones.set(chat_id, f'+7900{chat_id}')
+    existing = booked_slots(spreadsheet)
+
+    outcomes: dict[int, str] = {}
+    errors = []
+    lock = Lock()
+    barrier = Barrier(users)
+    seeds = random.Random(seed)
+    rngs = {chat_id: None if pick == 'first' else random.Random(seeds.random()) for chat_id in chat_ids}
+
+    def run(chat_id: int) -> User:
+        user = User(bot, telegram, chat_id, rngs[chat_id])
+        barrier.wait()
+        try:
+            outcome = 'timeout' if user.start() is None else 'taken'
+            for _ in range(attempts):
+                if outcome != 'taken':
+                    break
+                outcome = user.book()
+                if outcome == 'taken' and user.start() is None:
+                    outcome = 'timeout'
+        except Exception as ex:
+            outcome = 'error'
+            with lock:
+                errors.append(repr(ex))
+        with lock:
+            outcomes[chat_id] = outcome
+        return user
+
+    start = perf_counter()
+    with ThreadPoolExecutor(users) as executor:
+        simulated = list(executor.map(run, chat_ids))
+    elapsed = perf_counter() - start
+    telegram.uninstall()
+
+    # Проверка таблицы: каждый записанный пользователь - ровно в одном слоте,
+    # чужие и прежние записи не перезаписаны
+    after = booked_slots(spreadsheet)
+    ids = {chat_id: f'id: {chat_id}\n' for chat_id in chat_ids}
+    in_sheet = {chat_id: [slot for client, slots in after.items() if client.startswith(prefix) for slot in slots]
+                for chat_id, prefix in ids.items()}
+    confirmed = [x for x in chat_ids if outcomes[x] == 'booked']
+    report = {
+        'users': users,
+        'seconds': elapsed,
+        'updates': sum(len(x) for user in simulated for x in user.timings.values()),
+        'outcomes': {x: list(outcomes.values()).count(x) for x in sorted(set(outcomes.values()))},
+        # Подтверждено пользователю, но записи в таблице нет
+        'lost': sum(1 for x in confirmed if not in_sheet[x]),
+        # Пользователь в нескольких слотах или прежняя запись перезаписана
+        'double': sum(1 for x in chat_ids if len(in_sheet[x]) > 1)
+        + sum(1 for client, slots in existing.items() if after.get(client) != slots),
+        # Записан в таблицу, но пользователю сообщили об ошибке
+        'phantom': sum(1 for x in chat_ids if in_sheet[x] and outcomes[x] != 'booked'),
+        'errors': errors[:5],
+        'steps': {},
+    }
+    for step in STEPS + ('calendar',):
+        values = [x for user in simulated for x in user.timings.get(step, ())]
+        if values:
+            handled = [x[0] for x in values]
+            replied = [x[1] for x in values]
+            report['steps'][step] = {'count': len(values), 'handler_p50': percentile(handled, 50),
+                                     'handler_p99': percentile(handled, 99), 'reply_p50': percentile(replied, 50),
+                                     'reply_p99': percentile(replied, 99)}
+
+    print(f'Пользователей: {users}, выбор: {pick}, попыток: {attempts}, листов: {days}, '
+          f'психологов: {psychologists}, слотов: {slots}, задержка таблицы: {latency} c, '
+          f'квота: {quota or "нет"}, задержка Telegram: {telegram_latency} c')
+    print(f'Время: {elapsed:.2f} c, разговоров в секунду: {users / elapsed:.1f}, '
+          f'обновлений в секунду: {report["updates"] / elapsed:.1f}')
+    print(f'{"шаг":<14}{"кол-во":>8}{"обраб. p50":>12}{"обраб. p99":>12}{"ответ p50":>12}{"ответ p99":>12}  мс')
+    for step, x in report['steps'].items():
+        print(f'{step:<14}{x["count"]:>8}{x["handler_p50"] * 1000:>12.2f}{x["handler_p99"] * 1000:>12.2f}'
+              f'{x["reply_p50"] * 1000:>12.2f}{x["reply_p99"] * 1000:>12.2f}')
+    print('Итоги:', ', '.join(f'{k}: {v}' for k, v in report['outcomes'].items()))
+    print(f'Двойные записи: {report["double"]}, потерянные: {report["lost"]}, '
+          f'записаны без подтверждения: {report["phantom"]}')
+    if spreadsheet.rejected:
+        print(f'Отклонено таблицей по квоте (429): {spreadsheet.rejected}')
+    for error in errors[:5]:
+        print('Ошибка:', error)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест записи через обработчики main.py')
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--pick', choices=('first', 'random'), default='first',
+                        help='first - все выбирают первые кнопки, random - случайные')
+    parser.add_argument('--attempts', type=int, default=3, help='попыток записи, если время заняли')
+    parser.add_argument('--days', type=int, default=7, help='листов с датами')
+    parser.add_argument('--psychologists', type=int, default=10, help='психологов')
+    parser.add_argument('--slots', type=int, default=12, help='слотов у психолога в день')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка запроса к таблице в секундах')
+    parser.add_argument('--quota', type=int, default=0, help='квота таблицы в минуту (0 - без ограничения)')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка Telegram API в секундах')
+    parser.add_argument('--telegram-limits', action='store_true', help='ограничения скорости отправки Telegram')
+    parser.add_argument('--seed', type=int, default=1, help='начальное значение генератора')
+    main(**vars(parser.parse_args()))
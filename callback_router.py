@@ -0,0 +1,209 @@
+"""
+Маршрутизация callback-запросов по префиксу
+
+Callback-данные имеют вид PREFIX:часть:часть (CallbackCodec), обработчик
+выбирается по префиксу из словаря, данные разбираются и приводятся к типам один раз.
+"""
+import logging
+from threading import Lock
+from time import perf_counter
+
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS
+from telebot_calendar import CallbackData
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackCodec(CallbackData):
+    """
+    Callback-данные с типизированными частями.
+    Последняя часть может содержать разделитель (например, время '10:00').
+
+    :param prefix: Префикс маршрута
+    :param sep: Разделитель
+    :param parts: Части и их типы (name=int)
+    """
+
+    def __init__(self, prefix: str, sep=":", **parts: type):
+        super().__init__(prefix, *(parts or ("_",)), sep=sep)
+        self._part_names = tuple(parts)
+        self._part_types = tuple(parts.values())
+
+    def new(self, *args) -> str:
+        """
+        Callback-данные из значений частей
+
+        :param args: Значения частей по порядку
+        :return: Строка callback-данных
+        """
+        if len(args) != len(self._part_names):
+            raise TypeError(f"{self.prefix}: expected {len(self._part_names)} parts, got {len(args)}")
+        values = [str(x) for x in args]
+        if any(self.sep in x for x in values[:-1]):
+            raise ValueError(f"Symbol {self.sep!r} can be used only in the last part")
+        callback_data = self.sep.join([self.prefix, *values])
+        if len(callback_data.encode()) > 64:
+            raise ValueError("Resulted callback data is too long!")
+        return callback_data
+
+    def parse(self, callback_data: str) -> dict:
+        """
+        Разбирает callback-данные этого префикса
+
+        :param callback_data: Строка callback-данных
+        :return: Словарь {часть: значение нужного типа}
+        """
+        prefix, *values = callback_data.split(self.sep, len(self._part_names))
+        if prefix != self.prefix:
+            raise ValueError("Passed callback data can't be parsed with that prefix.")
+        if len(values) != len(self._part_names):
+            raise ValueError("Invalid parts count!")
+        return {name: cast(value) for name, cast, value in zip(self._part_names, self._part_types, values)}
+
+
+# Callback-данные бота
+RECORD = CallbackCodec('RECORD')
+CANCEL_RECORD = CallbackCodec('CANCEL_RECORD')
+MY_RECORD = CallbackCodec('MY_RECORD')
+MENU = CallbackCodec('MENU')
+CANCEL = CallbackCodec('CANCEL', index=int)
+APPROVE_CANCEL = CallbackCodec('APPROVE', index=int)
+LOCATION = CallbackCodec('LOCATION', location=str)
+PSYCHOLOGIST = CallbackCodec('PSYCHOLOGIST', psychologist=str)
+# Совпадает с форматом telebot_calendar.create_calendar(name=CALENDAR.prefix)
+CALENDAR = CallbackCodec('CALENDAR', action=str, year=int, month=int, day=str)
+TIME = CallbackCodec('TIME', time=str)
+APPROVE_RECORD = CallbackCodec('APP_REC')
+
+
+class Route:
+    """Маршрут: кодек, обработчик и счётчики задержки (обработчики вызываются из нескольких потоков)"""
+    __slots__ = ('codec', 'handler', 'calls', 'errors', 'total_time', 'max_time', '_lock')
+
+    def __init__(self, codec: CallbackCodec, handler):
+        self.codec = codec
+        self.handler = handler
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._lock = Lock()
+
+    def observe(self, elapsed: float, failed: bool) -> None:
+        """Учитывает один вызов обработчика"""
+        HANDLER_SECONDS.observe(elapsed, route=self.codec.prefix)
+        if failed:
+            HANDLER_ERRORS.inc(route=self.codec.prefix)
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+
+    def stats(self) -> dict:
+        """Вызовы, ошибки, средняя и максимальная задержка в секундах"""
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors,
+                    'avg_time': self.total_time / self.calls if self.calls else 0.0,
+                    'max_time': self.max_time}
+
+
+class CallbackRouter:
+    """
+    Диспетчер callback-запросов: обработчик вызывается как handler(call, **части)
+
+    :param sep: Разделитель префикса и частей
+    """
+
+    def __init__(self, sep=":"):
+        self.sep = sep
+        self._routes: dict[str, Route] = {}
+        self._fallback = None
+        self.unknown = 0
+        self._lock = Lock()
+
+    def route(self, codec: CallbackCodec):
+        """Декоратор регистрации обработчика для префикса codec"""
+        if codec.prefix in self._routes:
+            raise ValueError(f"Route {codec.prefix!r} is already registered")
+
+        def decorator(handler):
+            self._routes[codec.prefix] = Route(codec, handler)
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        """
+        Декоратор обработчика нераспознанных данных handler(call)
+        (например, кнопки старого формата в уже отправленных сообщениях)
+        """
+        self._fallback = handler
+        return handler
+
+    def _unknown(self, call):
+        """Учитывает нераспознанные данные и возвращает обработчик для них (или None)"""
+        with self._lock:
+            self.unknown += 1
+        logger.warning('%s - неизвестные callback-данные %r', call.from_user.id, call.data)
+        return self._fallback
+
+    def resolve(self, callback_data: str) -> tuple[Route, dict] | None:
+        """
+        Маршрут и разобранные части
+
+        :param callback_data: Строка callback-данных
+        :return: (маршрут, части) или None, если данные не распознаны
+        """
+        route = self._routes.get(callback_data.split(self.sep, 1)[0])
+        if route is None:
+            return None
+        try:
+            return route, route.codec.parse(callback_data)
+        except ValueError:
+            return None
+
+    def dispatch(self, call) -> bool:
+        """
+        Вызывает обработчик callback-запроса
+
+        :param call: CallbackQuery
+        :return: False, если маршрут не найден (вызывается обработчик fallback)
+        """
+        resolved = self.resolve(call.data or '')
+        if resolved is None:
+            handler = self._unknown(call)
+            if handler is not None:
+                handler(call)
+            return False
+        route, payload = resolved
+        start = perf_counter()
+        failed = True
+        try:
+            route.handler(call, **payload)
+            failed = False
+        finally:
+            route.observe(perf_counter() - start, failed)
+        return True
+
+    async def dispatch_async(self, call) -> bool:
+        """Асинхронный dispatch для обработчиков-корутин"""
+        resolved = self.resolve(call.data or '')
+        if resolved is None:
+            handler = self._unknown(call)
+            if handler is not None:
+                await handler(call)
+            return False
+        route, payload = resolved
+        start = perf_counter()
+        failed = True
+        try:
+            await route.handler(call, **payload)
+            failed = False
+        finally:
+            route.observe(perf_counter() - start, failed)
+        return True
+
+    def stats(self) -> dict:
+        """Счётчики по маршрутам: вызовы, ошибки, средняя и максимальная задержка в секундах"""
+        return {prefix: x.stats() for prefix, x in self._routes.items()}
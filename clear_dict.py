@@ -1,18 +1,137 @@
 """
 Хранение информации о пользователе и отчистка
 """
-from datetime import datetime, timedelta
+import heapq
 from threading import Lock, Thread
-from time import sleep
+from time import monotonic, sleep
 
-# хранит объекты GoogleSheet по ключу id
-CLIENT_DICT = {}
-# хранит название календаря по ключу id
-CALENDAR_DICT = {}
-# хранит время создания объекта GoogleSheet
-TIMER_DICT = {}
-# Lock для синхронизации доступа к словарям
-lock = Lock()
+import metrics
+
+# Время неактивности, после которого сессия удаляется (в минутах)
+SESSION_TTL_MINUTES = 60
+# Максимальное количество сессий в памяти
+MAX_SESSIONS = 10000
+# Периодичность отчистки в секундах
+SWEEP_PERIOD_SECONDS = 60
+
+
+class SessionStore:
+    """
+    Сессии пользователей по chat_id с удалением неактивных.
+    Сессия - объект со слотом last_active (GoogleSheets).
+    Каждой сессии соответствует одна запись кучи (срок, chat_id), поэтому
+    отчистка разбирает только записи с наступившим сроком.
+
+    :param ttl: Время неактивности в секундах
+    :param max_sessions: Максимальное количество сессий
+    """
+    def __init__(self, ttl: float, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._heap: list[tuple[float, int]] = []
+        # Срок действующей записи кучи для каждой сессии
+        self._due = {}
+        self._lock = Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id):
+        """
+        Сессия пользователя с отметкой активности
+
+        :param chat_id: id пользователя
+        :return: Сессия или None
+        """
+        session = self._sessions.get(chat_id)
+        if session is not None:
+            session.last_active = monotonic()
+        return session
+
+    def get_or_create(self, chat_id, factory):
+        """
+        Сессия пользователя, при отсутствии создаётся factory(chat_id)
+
+        :param chat_id: id пользователя
+        :param factory: Конструктор сессии
+        """
+        session = self.get(chat_id)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                while len(self._sessions) >= self.max_sessions and self._evict_oldest():
+                    pass
+                session = factory(chat_id)
+                session.last_active = monotonic()
+                self._sessions[chat_id] = session
+                self._push(chat_id, session.last_active + self.ttl)
+        return session
+
+    def remove(self, chat_id) -> None:
+        """Удаляет сессию (запись кучи удалится при разборе)"""
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+            self._due.pop(chat_id, None)
+
+    def _push(self, chat_id, due: float) -> None:
+        """Ставит срок сессии в кучу (под self._lock)"""
+        self._due[chat_id] = due
+        heapq.heappush(self._heap, (due, chat_id))
+
+    def _pop_due(self, deadline: float):
+        """
+        Разбирает вершину кучи: просроченную к deadline сессию удаляет,
+        активную возвращает в кучу с новым сроком (под self._lock)
+
+        :return: chat_id удалённой сессии или None
+        """
+        due, chat_id = heapq.heappop(self._heap)
+        if self._due.get(chat_id) != due:
+            # Устаревшая запись удалённой сессии
+            return None
+        session = self._sessions[chat_id]
+        expires = session.last_active + self.ttl
+        if expires <= deadline:
+            del self._sessions[chat_id]
+            del self._due[chat_id]
+            return chat_id
+        self._push(chat_id, expires)
+        return None
+
+    def _evict_oldest(self) -> bool:
+        """Удаляет наименее активную сессию (под self._lock)"""
+        while self._heap:
+            due, chat_id = self._heap[0]
+            if self._pop_due(due) is not None:
+                self.evicted += 1
+                return True
+        return False
+
+    def sweep(self, now: float | None = None) -> int:
+        """
+        Удаляет сессии, неактивные дольше ttl
+
+        :param now: Текущее время monotonic()
+        :return: Количество удалённых сессий
+        """
+        now = monotonic() if now is None else now
+        removed = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                if self._pop_due(now) is not None:
+                    removed += 1
+        self.expired += removed
+        return removed
+
+
+# Сессии пользователей (GoogleSheets) по ключу id
+SESSIONS = SessionStore(SESSION_TTL_MINUTES * 60, MAX_SESSIONS)
+metrics.gauge('sessions', 'Active user sessions', SESSIONS.__len__)
 
 
 def clear_unused_info(chat_id) -> None:
@@ -22,52 +141,43 @@ def clear_unused_info(chat_id) -> None:
 
         :param chat_id: id пользователя
         """
-    if CLIENT_DICT.get(chat_id):
-        client = CLIENT_DICT[chat_id]
+    client = SESSIONS.get(chat_id)
+    if client:
         client.lst_currant_date = None
         client.dct_currant_time = None
         # client.lst_records = None
-        client.name_service = None
-        client.name_master = None
+        client.location = None
+        client.psychologist = None
         client.date_record = None
         client.time_record = None
 
-    if CALENDAR_DICT.get(chat_id):
-        del CALENDAR_DICT[chat_id]
-
 
 def clear_all_dict(chat_id) -> None:
     """
-    Отчищает все словари по chat_id
+    Удаляет сессию по chat_id
 
     :param chat_id: id пользователя
     """
-    if CLIENT_DICT.get(chat_id):
-        del CLIENT_DICT[chat_id]
-    if CALENDAR_DICT.get(chat_id):
-        del CALENDAR_DICT[chat_id]
-    if TIMER_DICT.get(chat_id):
-        del TIMER_DICT[chat_id]
+    SESSIONS.remove(chat_id)
 
 
-def clear_client_dict(period_clear_minutes=60) -> None:
+def clear_client_dict(period_seconds=SWEEP_PERIOD_SECONDS) -> None:
     """
-    Отчищает все неактивные элементы словарей
+    Отчищает неактивные сессии
 
-    :param period_clear_minutes: периодичность отчистки в минутах
+    :param period_seconds: периодичность отчистки в секундах
     """
     while True:
-        sleep(period_clear_minutes * 60)
-        at_now = datetime.now()
-        lst_to_del = []
-        with lock:
-            for key, val in TIMER_DICT.items():
-                if val + timedelta(minutes=period_clear_minutes) >= at_now:
-                    lst_to_del.append(key)
-            for chat_id in lst_to_del:
-                clear_all_dict(chat_id)
-
-
-clear_thread = Thread(target=clear_client_dict)
-clear_thread.daemon = True
-clear_thread.start()
+        sleep(period_seconds)
+        SESSIONS.sweep()
+
+
+_sweeper: Thread | None = None
+
+
+def start_sweeper() -> None:
+    """Запускает отчистку неактивных сессий в фоновом потоке"""
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = Thread(target=clear_client_dict, daemon=True)
+        _sweeper.start()
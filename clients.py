@@ -0,0 +1,118 @@
+"""
+Телефоны и строки записи клиентов
+"""
+import sqlite3
+from threading import Lock
+
+from cachetools import LRUCache
+
+# Файл базы телефонов клиентов
+CLIENTS_DB_PATH = 'clients.sqlite3'
+# Размер LRU-кэша телефонов и строк записи клиентов
+CLIENT_CACHE_SIZE = 10000
+# Телефоны, добавляемые при создании базы
+SEED_PHONES = {467168798: '+79522600066', 288041146: '+79215528067'}
+
+_MISSING = object()
+
+
+class PhoneRegistry:
+    """
+    Постоянное хранилище телефонов клиентов (SQLite, ключ - chat_id)
+    с LRU-кэшем. База открывается при первом обращении, таблица не загружается целиком.
+
+    :param path: Путь к файлу базы
+    :param cache_size: Размер LRU-кэша
+    """
+    def __init__(self, path: str, cache_size=CLIENT_CACHE_SIZE):
+        self.path = path
+        self._conn = None
+        self._lock = Lock()
+        self._phones = LRUCache(maxsize=cache_size)
+        # chat_id -> (username, строка записи клиента)
+        self._identities = LRUCache(maxsize=cache_size)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает базу (под self._lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS phones (chat_id INTEGER PRIMARY KEY, phone TEXT NOT NULL)')
+            self._conn.executemany('INSERT OR IGNORE INTO phones (chat_id, phone) VALUES (?, ?)',
+                                   SEED_PHONES.items())
+            self._conn.commit()
+        return self._conn
+
+    def get(self, chat_id: int) -> str | None:
+        """
+        Телефон клиента
+
+        :param chat_id: id пользователя
+        :return: Телефон ('' - отказался сообщить) или None, если телефона нет
+        """
+        with self._lock:
+            phone = self._phones.get(chat_id, _MISSING)
+            if phone is _MISSING:
+                row = self._connect().execute('SELECT phone FROM phones WHERE chat_id = ?', (chat_id,)).fetchone()
+                phone = row[0] if row else None
+                self._phones[chat_id] = phone
+        return phone
+
+    def set(self, chat_id: int, phone: str) -> None:
+        """
+        Сохраняет телефон клиента
+
+        :param chat_id: id пользователя
+        :param phone: Телефон
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO phones (chat_id, phone) VALUES (?, ?)', (chat_id, phone))
+            conn.commit()
+            self._phones[chat_id] = phone
+            self._identities.pop(chat_id, None)
+
+    def identity(self, chat_id: int, username) -> str:
+        """
+        Строка записи клиента (значение колонки 'Клиент'), кэшируется
+
+        :param chat_id: id пользователя
+        :param username: username пользователя в Telegram
+        """
+        with self._lock:
+            cached = self._identities.get(chat_id)
+        if cached is not None and cached[0] == username:
+            return cached[1]
+        phone = self.get(chat_id)
+        id_client = f"id: {str(chat_id)}\n@{str(username)}\n"
+        if phone is not None:
+            if phone != '':
+                id_client += 'tel: ' + phone
+            else:
+                id_client += 'tel: None'
+        with self._lock:
+            self._identities[chat_id] = (username, id_client)
+        return id_client
+
+
+PHONES = PhoneRegistry(CLIENTS_DB_PATH)
+
+
+def chat_id_of(client_record: str) -> int | None:
+    """
+    id пользователя из строки записи клиента (PhoneRegistry.identity)
+
+    :param client_record: Значение колонки 'Клиент'
+    :return: id или None, если строка записана не ботом
+    """
+    first = client_record.strip().split('\n', 1)[0]
+    if not first.startswith('id:'):
+        return None
+    try:
+        return int(first[3:].strip())
+    except ValueError:
+        return None
+
+
+def get_client_id(client_id, client_username) -> str:
+    """Создаёт строку записи пользователя"""
+    return PHONES.identity(client_id, client_username)
@@ -1,16 +1,28 @@
 """
 Взаимодействие с Google Sheets для записи к психологам
 """
-from datetime import datetime, timedelta
-from time import time
+import calendar
+import logging
+from datetime import date, datetime, timedelta
+from enum import Enum
 from threading import Lock
-import json
-from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.service_account import Credentials
-from retrying import retry
-from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
 import gspread
 from pytz import timezone
+from gspread.exceptions import APIError
+from sheet_loader import parse_sheet_date
+from sheet_catalogue import SheetCatalogue
+from availability_cache import ANY, AvailabilityCache
+from schedule_index import ScheduleIndex, Slot
+from storage import ScheduleStorage, SheetsStorage, SQLiteStorage, StorageSync
+from sheets_pool import FLIGHTS, get_executor
+from sheets_quota import PRIORITY_BACKGROUND, priority
+from metrics import cache_lookup
+from swr_cache import RevalidatingCache
+from resilience import resilient
+
+logger = logging.getLogger(__name__)
 
 myscope = ["https://www.googleapis.com/auth/spreadsheets",
            "https://www.googleapis.com/auth/drive"]
@@ -18,10 +30,9 @@ myscope = ["https://www.googleapis.com/auth/spreadsheets",
 # Временная зона
 tz = timezone("Europe/Moscow")
 # Название файла JSON ключа (замените на ваше имя файла)
-creds = Credentials.from_service_account_file('psychology.json', scopes=myscope)
-client_main = gspread.Client(creds)
+CREDENTIALS_FILE = 'psychology.json'
 # Название таблицы (ID из URL)
-sh = client_main.open_by_key('15viMBxMIO_J0JQ9COrN5lxbsf3bmzdcMRlyqtI54Yck')
+SPREADSHEET_KEY = '15viMBxMIO_J0JQ9COrN5lxbsf3bmzdcMRlyqtI54Yck'
 # Страницы таблицы, которые должны игнорироваться
 IGNOR_WORKSHEETS = ['Психологи']
 # Страница таблицы с психологами и локациями
@@ -30,97 +41,476 @@ NAME_SHEET_PSYCHOLOGISTS = 'Психологи'
 NAME_COL_LOCATION = 'Локация'
 NAME_COL_PSYCHOLOGIST = 'Психолог'
 
-# Кэш листов с TTL 12 часов
-CACHE_WORKSHEETS = TTLCache(maxsize=2, ttl=12 * 60 * 60)
-# Кэш доступных дат для локации-психолога с TTL 15 минут
-CACHE_DAYS = TTLCache(maxsize=6, ttl=15 * 60)
-# Lock для синхронизации доступа
-lock = Lock()
+# Хранилище расписания: 'sheets' - Google Sheets,
+# 'sqlite' - локальная копия SQLite с синхронизацией с Google Sheets
+STORAGE_ENGINE = 'sheets'
+SQLITE_PATH = 'schedule.sqlite3'
+# Период синхронизации SQLite с Google Sheets в секундах
+SQLITE_SYNC_PERIOD = 60
+
+# Кэш листов и локаций с TTL 12 часов; устаревшие ещё сутки отдаются, пока обновляются в фоне
+CACHE_WORKSHEETS_TTL = 12 * 60 * 60
+CACHE_WORKSHEETS_GRACE = 24 * 60 * 60
+CACHE_WORKSHEETS = RevalidatingCache(ttl=CACHE_WORKSHEETS_TTL, grace=CACHE_WORKSHEETS_GRACE, name='worksheets')
+# Список листов перечитывается фоновым обновлением и при запросе неизвестной даты
+# не чаще раза в период (секунды), чтобы новые и удалённые листы попадали в каталог
+SHEET_NAMES_RECHECK_PERIOD = 5 * 60
+# Архивная таблица для листов прошедших дат ('' - не архивировать)
+# и сколько дней листы прошедших дат остаются в рабочей таблице
+ARCHIVE_SPREADSHEET_KEY = ''
+ARCHIVE_AFTER_DAYS = 30
+# Сколько дней вперёд можно записаться (листы дальше не загружаются)
+BOOKING_HORIZON_DAYS = 90
+# Кэш листов месяца (загружаются при переходе к месяцу в календаре) с TTL 5 минут;
+# устаревшие ещё 30 минут отдаются, пока обновляются в фоне
+CACHE_MONTH_TTL = 5 * 60
+CACHE_MONTH_GRACE = 30 * 60
+CACHE_MONTHS = RevalidatingCache(ttl=CACHE_MONTH_TTL, grace=CACHE_MONTH_GRACE, name='months')
+# Размер и TTL кэша доступных дат (ключ - локация, психолог/любой и месяц)
+CACHE_DAYS_MAXSIZE = 256
+CACHE_DAYS_TTL = 15 * 60
+# Ближайшие дни, для которых кэшируются доступные даты без месяца (get_all_days)
+NEAR_DAYS = 7
+# Кэш доступных дат для локации-психолога
+CACHE_DAYS = AvailabilityCache(maxsize=CACHE_DAYS_MAXSIZE, ttl=CACHE_DAYS_TTL)
+# Кэш индекса расписания по горизонту в днях (одна выгрузка batchGet) с TTL 1 минута;
+# устаревший индекс ещё 10 минут отдаётся, пока обновляется в фоне
+CACHE_SCHEDULE_TTL = 60
+CACHE_SCHEDULE_GRACE = 10 * 60
+CACHE_SCHEDULE = RevalidatingCache(ttl=CACHE_SCHEDULE_TTL, grace=CACHE_SCHEDULE_GRACE, name='schedule')
+# Индекс слотов листов с датами
+SCHEDULE = ScheduleIndex()
+# Листы с датами, отсортированные по дате (перестраивается при изменении списка листов)
+CATALOGUE = SheetCatalogue(IGNOR_WORKSHEETS)
+
+_client: gspread.Client | None = None
+_spreadsheet: gspread.Spreadsheet | None = None
+_http_pool_size: int | None = None
+_init_lock = Lock()
+_storage: ScheduleStorage | None = None
+# Последние загруженные листы и локации (ответ, пока таблица недоступна)
+_last_loaded: dict[str, object] = {}
+# Уведомление о записи, которую синхронизация SQLite не смогла перенести в таблицу
+_sync_conflict_handler = None
+
+def _mount_http_pool(client: gspread.Client) -> None:
+    """Пул HTTP-соединений клиента на _http_pool_size одновременных запросов"""
+    if _http_pool_size is not None and client.session is not None:
+        client.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=_http_pool_size))
 
-def serialize_dict(dct: dict) -> str:
-    """Сериализатор JSON"""
-    return json.dumps(dct)
+def get_client() -> gspread.Client:
+    """Клиент Google Sheets (ключ читается при первом обращении)"""
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=myscope)
+                client = gspread.Client(creds)
+                _mount_http_pool(client)
+                _client = client
+    return _client
 
-def deserialize_dict(json_str: str) -> dict:
-    """Десериализатор JSON"""
-    return json.loads(json_str)
+def get_spreadsheet() -> gspread.Spreadsheet:
+    """Таблица SPREADSHEET_KEY (открывается при первом обращении)"""
+    global _spreadsheet
+    if _spreadsheet is None:
+        client = get_client()
+        with _init_lock:
+            if _spreadsheet is None:
+                _spreadsheet = client.open_by_key(SPREADSHEET_KEY)
+    return _spreadsheet
+
+def use_spreadsheet(spreadsheet) -> None:
+    """
+    Подменяет таблицу (например, на benchmarks.fake_gspread) без чтения ключа
+
+    :param spreadsheet: Объект с интерфейсом gspread.Spreadsheet
+    """
+    global _spreadsheet, _storage
+    _spreadsheet = spreadsheet
+    _storage = None
+    _last_loaded.clear()
+    CATALOGUE.update([])
+
+def on_sync_conflict(handler) -> None:
+    """
+    Задаёт уведомление о записи, которую таблица не приняла при синхронизации SQLite
+    (клиент уже получил подтверждение)
+
+    :param handler: Функция handler(title, time, psychologist, client)
+    """
+    global _sync_conflict_handler
+    _sync_conflict_handler = handler
+
+def _notify_sync_conflict(*args) -> None:
+    if _sync_conflict_handler is not None:
+        _sync_conflict_handler(*args)
+
+def configure_http_pool(pool_size: int) -> None:
+    """
+    Задаёт размер пула HTTP-соединений к API (переиспользуются всеми потоками)
 
-def get_cache_days(location_name: str, psychologist_name: str) -> list | None:
+    :param pool_size: Максимум одновременных запросов
+    """
+    global _http_pool_size
+    _http_pool_size = pool_size
+    if _client is not None:
+        _mount_http_pool(_client)
+
+def get_storage() -> ScheduleStorage:
+    """
+    Хранилище расписания по STORAGE_ENGINE (создаётся при первом обращении).
+    Для SQLite при создании выполняется синхронизация и запускается фоновая.
+    """
+    global _storage
+    if _storage is None:
+        remote = SheetsStorage(get_spreadsheet())
+        if STORAGE_ENGINE == 'sqlite':
+            local = SQLiteStorage(SQLITE_PATH)
+            sync = StorageSync(local, remote, NAME_SHEET_PSYCHOLOGISTS, IGNOR_WORKSHEETS, SQLITE_SYNC_PERIOD,
+                               on_conflict=_notify_sync_conflict, tz=tz)
+            sync.sync_once()
+            sync.start()
+            _storage = local
+        else:
+            _storage = remote
+    return _storage
+
+def get_cache_days(location_name: str, psychologist_name: str | None,
+                   month: tuple[int, int] | None = None) -> list | None:
     """
     Запрашивает свободные даты из кэша
 
     :param location_name: Название локации
-    :param psychologist_name: Имя психолога
+    :param psychologist_name: Имя психолога (None - любой)
+    :param month: (год, месяц) или None - ближайшие дни
     """
-    if location_name in CACHE_DAYS:
-        cached_value = CACHE_DAYS[location_name]
-        cached_dict = deserialize_dict(cached_value)
-        if psychologist_name in cached_dict:
-            return cached_dict[psychologist_name]
-    return None
+    result = CACHE_DAYS.get(location_name, psychologist_name, month)
+    cache_lookup('days', result is not None)
+    return result
 
-def update_cache_days(location_name: str, psychologist_name: str, available_dates: list) -> None:
+def update_cache_days(location_name: str, psychologist_name: str | None, available_dates: list,
+                      month: tuple[int, int] | None = None) -> None:
     """
     Обновляет свободные даты в кэше
 
     :param location_name: Название локации
-    :param psychologist_name: Имя психолога
+    :param psychologist_name: Имя психолога (None - любой)
     :param available_dates: Доступные даты
+    :param month: (год, месяц) или None - ближайшие дни
+    """
+    CACHE_DAYS.put(location_name, psychologist_name, available_dates, month)
+
+def patch_cache_days(title: str, psychologist_name: str | None = None) -> None:
+    """
+    Пересчитывает дату title в записях кэша, затронутых изменением слота психолога
+
+    :param title: Название листа (дата)
+    :param psychologist_name: Имя психолога, у которого изменился слот (None - лист перестроен целиком)
+    """
+    locations = get_cache_locations()
+    now = datetime.now(tz=tz)
+    date_sheet = parse_sheet_date(title)
+    for key in CACHE_DAYS.keys_for(psychologist_name, locations):
+        location, psychologist, month = key
+        if month is not None and month != (date_sheet.year, date_sheet.month):
+            continue
+        if month is None and not now.date() <= date_sheet <= now.date() + timedelta(days=NEAR_DAYS):
+            # Дата вне ближайших дней, которые хранит ключ без месяца
+            continue
+        if psychologist is ANY:
+            psychologists = None if location is None else locations.get(location, [])
+        else:
+            psychologists = [psychologist]
+        CACHE_DAYS.patch(key, title, SCHEDULE.has_free(title, psychologists, now), parse_sheet_date)
+
+@resilient('get_sheet_names', stale=lambda: _last_loaded.get('worksheets'))
+def get_sheet_names() -> list[str]:
+    """
+    Запрашивает все имена листов таблицы (устаревший список отдаётся сразу и обновляется в фоне)
     """
-    if psychologist_name is None:
-        psychologist_name = 'null'
-    if location_name in CACHE_DAYS:
-        cached_value = CACHE_DAYS[location_name]
-        cached_dict = deserialize_dict(cached_value)
-        if psychologist_name not in cached_dict:
-            cached_dict[psychologist_name] = available_dates
-            cache_value = serialize_dict(cached_dict)
-            CACHE_DAYS[location_name] = cache_value
-    else:
-        cache_value = serialize_dict({psychologist_name: available_dates})
-        CACHE_DAYS[location_name] = cache_value
-
-@retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
-def get_sheet_names() -> list:
-    """
-    Запрашивает все имена листов таблицы
-    """
-    if 'worksheets' in CACHE_WORKSHEETS:
-        return CACHE_WORKSHEETS['worksheets']
-    with lock:
-        worksheets = sh.worksheets()
-    CACHE_WORKSHEETS['worksheets'] = worksheets
+    return CACHE_WORKSHEETS.get('worksheets', _load_sheet_names)
+
+def _load_sheet_names() -> list[str]:
+    """Загружает имена листов"""
+    worksheets = FLIGHTS.do(('worksheets',), get_storage().titles)
+    _last_loaded['worksheets'] = worksheets
+    return worksheets
+
+def refresh_sheet_names() -> list[str]:
+    """Перечитывает имена листов, минуя кэш, и обновляет каталог дат"""
+    worksheets = _load_sheet_names()
+    CACHE_WORKSHEETS.put('worksheets', worksheets)
+    CATALOGUE.update(worksheets)
     return worksheets
 
-@retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
+def recheck_sheet_names() -> bool:
+    """
+    Перечитывает имена листов, если они загружены раньше SHEET_NAMES_RECHECK_PERIOD секунд назад
+
+    :return: True, если имена перечитаны
+    """
+    age = CACHE_WORKSHEETS.age('worksheets')
+    if age is not None and age < SHEET_NAMES_RECHECK_PERIOD:
+        return False
+    refresh_sheet_names()
+    return True
+
+def get_catalogue() -> SheetCatalogue:
+    """Каталог листов с датами по текущему списку листов"""
+    CATALOGUE.update(get_sheet_names())
+    return CATALOGUE
+
+@resilient('get_cache_locations', stale=lambda: _last_loaded.get('locations'))
 def get_cache_locations() -> dict:
     """
     Запрашивает все локации и психологов из листа 'Психологи'
+    (устаревшие отдаются сразу и обновляются в фоне)
     """
-    if 'locations' in CACHE_WORKSHEETS:
-        return CACHE_WORKSHEETS['locations']
+    # Одновременные запросы при пустом кэше ждут одну загрузку
+    return CACHE_WORKSHEETS.get('locations', FLIGHTS.do, ('locations', NAME_SHEET_PSYCHOLOGISTS), _load_locations)
+
+def _load_locations() -> dict:
+    """Загружает лист 'Психологи'"""
     dct = {}
-    with lock:
-        ws = sh.worksheet(NAME_SHEET_PSYCHOLOGISTS)
-    for i in ws.get_all_records():
+    for i in get_storage().read_locations(NAME_SHEET_PSYCHOLOGISTS):
         location = i[NAME_COL_LOCATION].strip()
         psychologist = i[NAME_COL_PSYCHOLOGIST].strip()
         dct[location] = dct.get(location, [])
         dct[location].append(psychologist)
-    CACHE_WORKSHEETS['locations'] = dct
+    _last_loaded['locations'] = dct
     return dct
 
-def time_score(func):
-    """Декоратор для трекинга времени выполнения функции"""
-    def wrapper(*args, **kwargs):
-        start = time()
-        res = func(*args, **kwargs)
-        print(f"---{func.__name__} = %s seconds ---" % round(time() - start, 2))
-        return res
-    return wrapper
+def location_of(psychologist_name: str, default: str | None = None) -> str:
+    """
+    Локация психолога по листу 'Психологи'
+
+    :param psychologist_name: Имя психолога
+    :param default: Значение, если психолог не найден
+    """
+    for location, psychologists in get_cache_locations().items():
+        if psychologist_name in psychologists:
+            return location
+    return default or ''
+
+@resilient('get_schedule', stale=lambda count_days=7: SCHEDULE if SCHEDULE.titles() else None)
+def get_schedule(count_days=7) -> ScheduleIndex:
+    """
+    Обновляет индекс расписания выгрузкой всех листов с датами
+    на ближайшие count_days дней одним запросом.
+    Устаревший индекс отдаётся сразу и обновляется в фоне; запись (set_time)
+    всё равно сверяет строку слота с таблицей.
+
+    :param count_days: Количество дней для поиска
+    :return: Индекс расписания
+    """
+    return CACHE_SCHEDULE.get(schedule_key(count_days), refresh_schedule, count_days)
+
+def schedule_key(count_days=7) -> str:
+    """Ключ индекса расписания в CACHE_SCHEDULE (горизонт входит в ключ: меньший не отдаётся вместо большего)"""
+    return f'schedule:{count_days}'
+
+def refresh_schedule(count_days=7) -> ScheduleIndex:
+    """
+    Перечитывает листы с датами на ближайшие count_days дней, минуя кэш.
+    Изменившиеся листы подменяются в индексе целиком.
+
+    :param count_days: Количество дней для поиска
+    :return: Индекс расписания
+    """
+    # Одновременные обновления (пользователи и фоновое) ждут одну выгрузку
+    return FLIGHTS.do(('schedule', count_days), _load_schedule, count_days)
+
+def _load_schedule(count_days: int) -> ScheduleIndex:
+    """Выгружает листы с датами на count_days дней в индекс"""
+    date_today = datetime.now(tz=tz).date()
+    titles = get_catalogue().next_days(date_today, count_days)
+    schedule = _read_days(titles, lambda: CATALOGUE.next_days(date_today, count_days))
+    # Листы, загруженные по месяцам, остаются в индексе, пока есть в таблице и в горизонте записи
+    for title in SCHEDULE.update(schedule, keep=CATALOGUE.next_days(date_today, BOOKING_HORIZON_DAYS)):
+        patch_cache_days(title)
+    CACHE_SCHEDULE.put(schedule_key(count_days), SCHEDULE)
+    return SCHEDULE
+
+def _read_days(titles: list[str], select) -> dict[str, list[dict]]:
+    """
+    Выгружает листы; если лист удалили после загрузки списка листов,
+    перечитывает список и выгружает листы select() ещё раз
+    """
+    try:
+        return get_storage().read_days(titles)
+    except APIError as ex:
+        if getattr(ex.response, 'status_code', None) != 400:
+            raise
+        logger.info('Список листов устарел, перечитывается: %r', ex)
+        refresh_sheet_names()
+        return get_storage().read_days(select())
+
+def month_bounds(year: int, month: int) -> tuple[date, date] | None:
+    """
+    Даты месяца, на которые можно записаться (от сегодня до BOOKING_HORIZON_DAYS)
+
+    :return: (первая, последняя дата) или None, если весь месяц вне горизонта записи
+    """
+    today = datetime.now(tz=tz).date()
+    first = max(date(year, month, 1), today)
+    last = min(date(year, month, calendar.monthrange(year, month)[1]),
+               today + timedelta(days=BOOKING_HORIZON_DAYS))
+    return (first, last) if first <= last else None
+
+def _month_key(year: int, month: int) -> str:
+    return f'month:{year}-{month:02d}'
+
+def is_month_loaded(year: int, month: int) -> bool:
+    """Листы месяца можно отдать из индекса без загрузки"""
+    return month_bounds(year, month) is None or _month_key(year, month) in CACHE_MONTHS
+
+@resilient('get_month')
+def get_month(year: int, month: int) -> list[str]:
+    """
+    Загружает в индекс листы месяца в горизонте записи
+    (устаревшие отдаются сразу и обновляются в фоне)
+
+    :param year: Год
+    :param month: Месяц
+    :return: Листы месяца
+    """
+    if month_bounds(year, month) is None:
+        return []
+    return CACHE_MONTHS.get(_month_key(year, month), FLIGHTS.do, ('month', year, month), _load_month, year, month)
+
+def _load_month(year: int, month: int) -> list[str]:
+    """Выгружает листы месяца в индекс"""
+    def select():
+        bounds = month_bounds(year, month)
+        return [] if bounds is None else get_catalogue().between(*bounds)
+
+    titles = select()
+    schedule = _read_days(titles, select)
+    for title, records in schedule.items():
+        if SCHEDULE.update_day(title, records):
+            patch_cache_days(title)
+    return list(schedule)
+
+def prefetch_month(year: int, month: int) -> None:
+    """Загружает месяц в фоне (фоновый приоритет квоты), если его нет в кэше"""
+    if is_month_loaded(year, month):
+        return
+    get_executor().submit(_prefetch_month, year, month)
+
+def _prefetch_month(year: int, month: int) -> None:
+    try:
+        with priority(PRIORITY_BACKGROUND):
+            get_month(year, month)
+    except Exception as ex:
+        logger.warning('%s.%s - месяц не загружен заранее: %r', month, year, ex)
+
+def next_month(year: int, month: int) -> tuple[int, int]:
+    """(год, месяц) следующего месяца"""
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def horizon_months(count_days=BOOKING_HORIZON_DAYS) -> list[tuple[int, int]]:
+    """(год, месяц) месяцев от текущего до даты через count_days дней"""
+    today = datetime.now(tz=tz).date()
+    last = today + timedelta(days=count_days)
+    months = [(today.year, today.month)]
+    while months[-1] < (last.year, last.month):
+        months.append(next_month(*months[-1]))
+    return months
+
+def refresh_day(title: str) -> bool:
+    """
+    Перечитывает один лист с датой, минуя кэш
+
+    :param title: Название листа (дата)
+    :return: False, если листа нет в таблице
+    """
+    if title not in get_catalogue() and not (recheck_sheet_names() and title in CATALOGUE):
+        return False
+    return FLIGHTS.do(('day', title), _load_day, title)
+
+def _load_day(title: str) -> bool:
+    """Выгружает один лист с датой в индекс"""
+    schedule = get_storage().read_days([title])
+    if SCHEDULE.update_day(title, schedule[title]):
+        patch_cache_days(title)
+    return True
+
+@resilient('load_day')
+def load_day(title: str) -> bool:
+    """
+    Догружает в индекс лист с датой вне горизонта get_schedule
+
+    :param title: Название листа (дата)
+    :return: False, если листа нет в таблице
+    """
+    return refresh_day(title)
+
+def archive_past_sheets(archive=None, keep_days=ARCHIVE_AFTER_DAYS) -> list[str]:
+    """
+    Переносит листы дат старше keep_days дней в архивную таблицу
+
+    :param archive: Архивная таблица (по умолчанию - ARCHIVE_SPREADSHEET_KEY)
+    :param keep_days: Сколько дней листы прошедших дат остаются в рабочей таблице
+    :return: Перенесённые листы
+    """
+    if archive is None:
+        if not ARCHIVE_SPREADSHEET_KEY:
+            return []
+        archive = get_client().open_by_key(ARCHIVE_SPREADSHEET_KEY)
+    titles = get_catalogue().before(datetime.now(tz=tz).date() - timedelta(days=keep_days))
+    # Архивируется сама таблица, а не локальная копия SQLite
+    storage = SheetsStorage(get_spreadsheet())
+    for title in titles:
+        storage.archive(title, archive)
+        logger.info('%s - лист перенесён в архив', title)
+    if titles:
+        refresh_sheet_names()
+    return titles
+
+class BookingResult(Enum):
+    """Результат записи/отмены в GoogleSheets.set_time"""
+    OK = 'ok'
+    # Слот успели занять (или запись уже отменена)
+    TAKEN = 'taken'
+    # Даты/времени нет в таблице
+    NOT_FOUND = 'not_found'
+
+    def __bool__(self):
+        return self is BookingResult.OK
+
+def write_slot(title: str, slot: Slot, expected_client: str, client_record: str) -> bool:
+    """
+    Условная запись: пишет клиента, только если строка слота не изменилась
+
+    :param title: Название листа (дата)
+    :param slot: Слот из индекса расписания
+    :param expected_client: Ожидаемое значение колонки 'Клиент'
+    :param client_record: Новое значение колонки 'Клиент'
+    :return: False, если строка уже изменилась (индекс обновляется)
+    """
+    actual = get_storage().write_client(title, slot.row, [slot.time_str, slot.psychologist, expected_client],
+                                        client_record)
+    if actual is not None and actual == [slot.time_str, slot.psychologist, client_record.strip()]:
+        # В строке уже наше значение: повтор после записи, ответ на которую потерялся
+        actual = None
+    if actual is not None:
+        if actual[0] != slot.time_str or actual[1] != slot.psychologist:
+            # Строки листа сдвинули - строка принадлежит другому слоту, лист перечитывается целиком
+            refresh_day(title)
+            return False
+        SCHEDULE.set_client(title, slot, actual[2])
+        patch_cache_days(title, slot.psychologist)
+        return False
+    SCHEDULE.set_client(title, slot, client_record)
+    patch_cache_days(title, slot.psychologist)
+    return True
 
 class GoogleSheets:
-    """Взаимодействие с Google Sheets для записи к психологам"""
+    """Взаимодействие с Google Sheets для записи к психологам (сессия пользователя)"""
+    __slots__ = ('client_id', 'lst_currant_date', 'dct_currant_time', 'lst_records', 'location',
+                 'psychologist', 'date_record', 'time_record', 'last_active')
+
     def __init__(self, client_id: str):
         self.client_id = client_id
         self.lst_currant_date = None
@@ -130,6 +520,8 @@ class GoogleSheets:
         self.psychologist = None
         self.date_record = None
         self.time_record = None
+        # Время последнего обращения (monotonic), обновляется clear_dict.SESSIONS
+        self.last_active = 0.0
 
     def __str__(self):
         return f'Инфо о клиенте:\n' \
@@ -139,161 +531,127 @@ class GoogleSheets:
                f'{self.date_record=}\n' \
                f'{self.time_record=}'
 
-    @retry(wait_exponential_multiplier=3000, wait_exponential_max=9000)
-    def get_all_days(self) -> list:
-        """Все доступные дни для записи на определенную локацию"""
+    def psychologists(self) -> list | None:
+        """Психологи, среди которых ищется время (None - все психологи)"""
+        if self.psychologist is not None:
+            return [self.psychologist]
+        if self.location is not None:
+            return get_cache_locations().get(self.location, [])
+        return None
+
+    def get_all_days(self, count_days=NEAR_DAYS) -> list:
+        """Доступные дни для записи на определенную локацию на ближайшие count_days дней"""
         check = get_cache_days(self.location, self.psychologist)
-        if check:
+        if check is not None:
             return check
+        now = datetime.now(tz=tz)
+        res = get_schedule().available_dates(self.psychologists(), now,
+                                             last=now.date() + timedelta(days=count_days))
+        update_cache_days(self.location, self.psychologist, res)
+        return res
 
-        @retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
-        def actual_date(sheet_obj, count_days=7) -> bool:
-            """
-            Проверяет актуальные даты для записи на ближайшие count_days дней
-
-            :param sheet_obj: Объект листа (gspread)
-            :param count_days: Количество дней для поиска
-            :return: Название листа (дата) или False
-            """
-            if sheet_obj.title in IGNOR_WORKSHEETS:
-                return False
-            try:
-                date_sheet = datetime.strptime(sheet_obj.title.strip(), '%d.%m.%Y').date()
-            except Exception as ex:
-                print(ex, sheet_obj.title, '- Добавьте лист в IGNOR_WORKSHEETS')
-                return False
-            date_today = datetime.now(tz=tz)
-            if not date_today.date() <= date_sheet <= (date_today.date() + timedelta(days=count_days)):
-                return False
-            with lock:
-                val = sheet_obj.get_all_records()
-            for dct in val:
-                if date_today.date() == date_sheet:
-                    if (self.psychologist is not None and
-                        dct[NAME_COL_PSYCHOLOGIST].strip() == self.psychologist) or \
-                       (self.psychologist is None):
-                        for k, v in dct.items():
-                            if str(v).strip() == '' and k == 'Клиент' and \
-                               date_today.time() < datetime.strptime(dct['Время'], '%H:%M').time():
-                                return sheet_obj.title
-                    continue
-                if (self.psychologist is not None and dct[NAME_COL_PSYCHOLOGIST].strip() == self.psychologist) \
-                   or (self.psychologist is None):
-                    for k, v in dct.items():
-                        if str(v).strip() == '' and k == 'Клиент':
-                            return sheet_obj.title
-            return False
+    def get_month_days(self, year: int, month: int) -> list:
+        """
+        Доступные дни месяца (листы месяца загружаются при первом обращении,
+        следующий месяц загружается заранее в фоне)
 
-        worksheet_all = get_sheet_names()
-        with ThreadPoolExecutor(2) as executor:
-            res = executor.map(actual_date, worksheet_all)
-            res = list(filter(lambda x: type(x) is str, res))
-        update_cache_days(self.location, self.psychologist, res)
+        :param year: Год
+        :param month: Месяц
+        """
+        prefetch_month(*next_month(year, month))
+        check = get_cache_days(self.location, self.psychologist, (year, month))
+        if check is not None:
+            return check
+        bounds = month_bounds(year, month)
+        if bounds is None:
+            return []
+        get_month(year, month)
+        res = SCHEDULE.available_dates(self.psychologists(), datetime.now(tz=tz), *bounds)
+        update_cache_days(self.location, self.psychologist, res, (year, month))
         return res
 
-    @retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
+    def get_first_month_days(self) -> tuple[int, int, list]:
+        """
+        Месяц, который календарь показывает первым: текущий,
+        а если в нём нет свободных дат - следующий
+
+        :return: (год, месяц, доступные дни месяца)
+        """
+        now = datetime.now(tz=tz)
+        year, month = now.year, now.month
+        days = self.get_month_days(year, month)
+        if not days:
+            year, month = next_month(year, month)
+            days = self.get_month_days(year, month)
+        return year, month, days
+
     def get_free_time(self) -> list:
-        """Выгружает свободное время для выбранной даты"""
-        try:
-            with lock:
-                all_val = sh.worksheet(self.date_record).get_all_records()
-        except gspread.exceptions.WorksheetNotFound as not_found:
-            print(not_found, self.date_record, '- Дата занята/не найдена')
+        """Свободное время для выбранной даты"""
+        schedule = get_schedule()
+        date_record = parse_sheet_date(self.date_record)
+        if date_record is not None and date_record > datetime.now(tz=tz).date() + timedelta(days=7):
+            # Лист вне ближайших дней (get_schedule) обновляется вместе со своим месяцем
+            get_month(date_record.year, date_record.month)
+        if self.date_record not in schedule and not load_day(self.date_record):
+            logger.warning('%s - Дата занята/не найдена', self.date_record)
             return []
-        if self.date_record == datetime.now(tz=tz).strftime('%d.%m.%Y'):
-            lst = [i['Время'].strip() for i in all_val
-                   if (self.psychologist is None or
-                       i[NAME_COL_PSYCHOLOGIST].strip() == self.psychologist) and
-                   i['Клиент'].strip() == '' and
-                   datetime.now(tz=tz).time() < datetime.strptime(i['Время'], '%H:%M').time()]
-        else:
-            lst = [i['Время'].strip() for i in all_val
-                   if (self.psychologist is None or
-                       i[NAME_COL_PSYCHOLOGIST].strip() == self.psychologist) and
-                   i['Клиент'].strip() == '']
-        if len(lst) > 0:
-            lst = sorted(list(set(lst)))
-        return lst
-
-    @retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
-    def set_time(self, client_record='', search_criteria='') -> bool:
+        return schedule.free_times(self.date_record, self.psychologists(), datetime.now(tz=tz))
+
+    @resilient('set_time')
+    def set_time(self, client_record='', search_criteria='') -> BookingResult:
         """
-        Записывает или отменяет запись клиента
+        Записывает или отменяет запись клиента.
+        Строка слота берётся из индекса расписания и перед записью перечитывается.
 
         :param client_record: Данные клиента
         :param search_criteria: Критерий поиска ('', client_record)
-        :return: True при успехе, False при ошибке
+        :return: BookingResult (истинен только при успехе)
         """
-        try:
-            with lock:
-                all_val = sh.worksheet(self.date_record).get_all_records()
-        except gspread.exceptions.WorksheetNotFound as not_found:
-            print(not_found, self.date_record, '- Дата занята/не найдена')
-            return False
-        row_num = 1
-        for i in all_val:
-            row_num += 1
-            if (self.psychologist is None or
-                i[NAME_COL_PSYCHOLOGIST].strip() == self.psychologist) and \
-               i['Время'].strip() == self.time_record and \
-               i['Клиент'].strip() == search_criteria:
+        schedule = get_schedule()
+        if self.date_record not in schedule and not load_day(self.date_record):
+            logger.warning('%s - Дата занята/не найдена', self.date_record)
+            return BookingResult.NOT_FOUND
+        psychologists = self.psychologists() if search_criteria == '' else [self.psychologist]
+        if client_record:
+            # Повтор после потерянного ответа: слот уже записан на клиента - вторую запись не делаем
+            own = schedule.find_slots(self.date_record, self.time_record, psychologists, client_record)
+            if own:
                 if self.psychologist is None:
-                    self.psychologist = i[NAME_COL_PSYCHOLOGIST].strip()
-                sh.worksheet(self.date_record).update_cell(row_num, 3, f'{client_record}')
-                if (self.lst_records and search_criteria == '') or (self.lst_records and client_record == ''):
-                    record = [self.date_record, self.time_record, self.location, self.psychologist]
-                    if search_criteria == '':
-                        self.lst_records.append(record)
-                    else:
-                        self.lst_records.remove(record)
-                return True
-        return False
+                    self.psychologist = own[0].psychologist
+                return BookingResult.OK
+        for _ in range(2):
+            rebuilt = False
+            for slot in schedule.find_slots(self.date_record, self.time_record, psychologists, search_criteria):
+                if write_slot(self.date_record, slot, search_criteria, client_record):
+                    if self.psychologist is None:
+                        self.psychologist = slot.psychologist
+                    return BookingResult.OK
+                if not schedule.has_slot(self.date_record, slot):
+                    # Строки листа сдвинули и лист перечитан - слоты ищутся заново
+                    rebuilt = True
+                    break
+            if not rebuilt:
+                break
+        if schedule.find_slots(self.date_record, self.time_record, psychologists, None):
+            return BookingResult.TAKEN
+        return BookingResult.NOT_FOUND
 
-    @retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
-    def get_record(self, client_record: str, count_days=7) -> list:
+    def get_record(self, client_record: str, count_days=BOOKING_HORIZON_DAYS) -> list:
         """
         Находит все записи клиента на ближайшие count_days дней
+        по обратному индексу клиентов (индекс сверяется с таблицей при обновлении расписания).
+        Листы дальше ближайших дней загружаются по месяцам (кэш месяцев).
 
         :param client_record: Строка клиента
         :param count_days: Количество дней
         :return: Список [Дата, Время, Локация, Психолог]
         """
-        if self.lst_records:
-            return self.lst_records
-
-        @retry(wait_exponential_multiplier=3000, wait_exponential_max=3000)
-        def check_record(sheet_obj) -> None:
-            if sheet_obj.title in IGNOR_WORKSHEETS:
-                return None
-            try:
-                date_sheet = datetime.strptime(sheet_obj.title, '%d.%m.%Y')
-            except Exception as ex:
-                print(ex, sheet_obj.title, '- Добавьте лист в IGNOR_WORKSHEETS')
-                return None
-            date_today = datetime.now(tz=tz)
-            if date_today.date() == date_sheet.date():
-                with lock:
-                    all_val = sheet_obj.get_all_records()
-                for dct in all_val:
-                    if dct['Клиент'] == client_record:
-                        try:
-                            record_time = datetime.strptime(dct['Время'], '%H:%M').time()
-                            if date_today.time() < record_time:
-                                print("Запись найдена:", [sheet_obj.title.strip(), dct['Время'].strip(),
-                                                         self.location, dct[NAME_COL_PSYCHOLOGIST].strip()])
-                                lst_records.append([sheet_obj.title.strip(), dct['Время'].strip(),
-                                                   self.location, dct[NAME_COL_PSYCHOLOGIST].strip()])
-                        except Exception as e:
-                            print(f"Ошибка при разборе времени: {e}, значение: {dct['Время']}")
-            elif date_today.date() < date_sheet.date() <= (date_today + timedelta(days=count_days)).date():
-                with lock:
-                    all_val = sheet_obj.get_all_records()
-                lst_records.extend([sheet_obj.title.strip(), dct['Время'].strip(),
-                                   self.location, dct[NAME_COL_PSYCHOLOGIST].strip()]
-                                  for dct in all_val if dct['Клиент'] == client_record)
-
-        lst_records = []
-        with ThreadPoolExecutor(2) as executor:
-            executor.map(check_record, sh.worksheets())
-        self.lst_records = lst_records
-        return lst_records
\ No newline at end of file
+        now = datetime.now(tz=tz)
+        last_day = now.date() + timedelta(days=count_days)
+        schedule = get_schedule()
+        for year, month in horizon_months(count_days):
+            get_month(year, month)
+        self.lst_records = [[title, slot.time_str, location_of(slot.psychologist, self.location), slot.psychologist]
+                            for title, slot in schedule.bookings(client_record, now)
+                            if parse_sheet_date(title) <= last_day]
+        return self.lst_records
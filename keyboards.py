@@ -3,6 +3,8 @@
 """
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from callback_router import CANCEL_RECORD, MENU, MY_RECORD, RECORD
+
 
 def create_markup_menu():
     """
@@ -12,9 +14,9 @@ def create_markup_menu():
     """
     menu_buttons = ['Запись✅', 'Отмена записи❌', 'Мои записи📝']
     markup = InlineKeyboardMarkup(row_width=2)
-    markup.add(InlineKeyboardButton(text=menu_buttons[0], callback_data='RECORD'))
-    markup.add(InlineKeyboardButton(text=menu_buttons[1], callback_data='CANCEL_RECORD'))
-    markup.add(InlineKeyboardButton(text=menu_buttons[2], callback_data='MY_RECORD'))
+    markup.add(InlineKeyboardButton(text=menu_buttons[0], callback_data=RECORD.new()))
+    markup.add(InlineKeyboardButton(text=menu_buttons[1], callback_data=CANCEL_RECORD.new()))
+    markup.add(InlineKeyboardButton(text=menu_buttons[2], callback_data=MY_RECORD.new()))
 
     return markup
 
@@ -33,5 +35,5 @@ def button_to_menu(return_callback: str | None, return_text='Назад', menu_t
     """
     if return_callback:
         return [InlineKeyboardButton(text=return_text, callback_data=return_callback),
-                InlineKeyboardButton(text=menu_text, callback_data='MENU')]
-    return [InlineKeyboardButton(text=menu_text, callback_data='MENU')]
+                InlineKeyboardButton(text=menu_text, callback_data=MENU.new())]
+    return [InlineKeyboardButton(text=menu_text, callback_data=MENU.new())]
@@ -1,53 +1,67 @@
 """
 Взаимодействие с Telegram для записи к психологам
 """
+import asyncio
+import logging
+import sys
 from datetime import datetime
 from telebot import types, TeleBot
 from telebot.types import CallbackQuery, ReplyKeyboardRemove, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from config import TOKEN
 import telebot_calendar
-from google_sheet import GoogleSheets, get_cache_locations
+import google_sheet
+from google_sheet import GoogleSheets, BookingResult, get_cache_locations
+from sheet_loader import parse_sheet_date
 from keyboards import create_markup_menu, button_to_menu
+import callback_router as cb
+from callback_router import CallbackRouter
 import clear_dict
+from clients import PHONES, chat_id_of, get_client_id
+from prefetcher import PREFETCHER
+from resilience import HANDLER_DEADLINE, SheetsUnavailable, deadline
+from send_queue import QUEUE, OutboundBot
+import metrics
+
+logger = logging.getLogger(__name__)
 
 bot = TeleBot(TOKEN)
+# Ответы обработчиков отправляются через очередь с ограничением скорости
+outbox = OutboundBot(bot, QUEUE)
+metrics.gauge('telegram_send_pending', 'Messages waiting in the Telegram send queue', lambda: QUEUE.pending)
+router = CallbackRouter()
 
-CLIENT_PHONE = {467168798: '+79522600066', 288041146: '+79215528067'}  # Заменить на базу данных
+# Сообщение клиенту, если запись из SQLite не попала в таблицу (STORAGE_ENGINE = 'sqlite')
+SYNC_CONFLICT_TEXT = ('К сожалению, запись на {date} в {time} не сохранилась: это время уже занято.\n'
+                      'Пожалуйста, выберите другое время 🙏')
 
-def get_client_id(client_id, client_username) -> str:
-    """Создаёт строку записи пользователя"""
-    id_client = f"id: {str(client_id)}\n@{str(client_username)}\n"
-    if CLIENT_PHONE.get(client_id, None) is not None:
-        if CLIENT_PHONE[client_id] != '':
-            id_client += 'tel: ' + CLIENT_PHONE[client_id]
-        else:
-            id_client += 'tel: None'
-    return id_client
+def notify_sync_conflict(title: str, time_str: str, psychologist: str, client_record: str) -> None:
+    """Сообщает клиенту, что подтверждённая запись не попала в таблицу"""
+    chat_id = chat_id_of(client_record)
+    if chat_id is not None:
+        outbox.send_message(chat_id, SYNC_CONFLICT_TEXT.format(date=title, time=time_str),
+                            reply_markup=create_markup_menu())
+
+google_sheet.on_sync_conflict(notify_sync_conflict)
 
 def create_client(chat_id) -> GoogleSheets:
     """Создаёт объект GoogleSheet по chat_id"""
-    if clear_dict.CLIENT_DICT.get(chat_id):
-        return clear_dict.CLIENT_DICT[chat_id]
-    client = GoogleSheets(chat_id)
-    clear_dict.CLIENT_DICT[chat_id] = client
-    clear_dict.TIMER_DICT[chat_id] = datetime.now()
-    return client
+    return clear_dict.SESSIONS.get_or_create(chat_id, GoogleSheets)
 
 @bot.message_handler(commands=['start'])
 def check_phone_number(message):
     """Запрашивает номер телефона у пользователя"""
-    if CLIENT_PHONE.get(message.chat.id, None) is None:
+    if PHONES.get(message.chat.id) is None:
         markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
         button_phone = types.KeyboardButton(text="Отправить телефон 📞", request_contact=True)
         markup.add(button_phone)
-        bot.send_message(message.chat.id, 'Для записи к психологу требуется номер телефона.',
+        outbox.send_message(message.chat.id, 'Для записи к психологу требуется номер телефона.',
                          reply_markup=markup)
 
         @bot.message_handler(content_types=['contact'])
         def contact(message_contact):
             if message_contact.contact is not None:
-                CLIENT_PHONE[message_contact.chat.id] = message_contact.contact.phone_number
-                bot.send_message(message_contact.chat.id, 'Спасибо за доверие!',
+                PHONES.set(message_contact.chat.id, message_contact.contact.phone_number)
+                outbox.send_message(message_contact.chat.id, 'Спасибо за доверие!',
                                  reply_markup=ReplyKeyboardRemove())
                 menu(message_contact)
     else:
@@ -56,17 +70,33 @@ def check_phone_number(message):
 @bot.message_handler(content_types=['text'])
 def any_word_before_number(message_any):
     """Обработчик текстовых сообщений"""
-    bot.send_message(message_any.chat.id,
+    outbox.send_message(message_any.chat.id,
                      text='Пользоваться ботом возможно только при наличии номера телефона!\n'
                           'Взаимодействие с ботом происходит кнопками.')
 
 def menu(message):
     """Главное меню"""
     clear_dict.clear_unused_info(message.chat.id)
-    bot.send_message(message.chat.id, "Выберите пункт меню:",
+    outbox.send_message(message.chat.id, "Выберите пункт меню:",
                      reply_markup=create_markup_menu())
 
-@bot.callback_query_handler(lambda call: call.data == 'CANCEL_RECORD')
+@bot.callback_query_handler(func=lambda call: True)
+def dispatch_callback(call):
+    """Передаёт callback-запрос обработчику по префиксу (запросы к таблице ограничены дедлайном)"""
+    try:
+        with deadline(HANDLER_DEADLINE):
+            router.dispatch(call)
+    except SheetsUnavailable as ex:
+        logger.warning('%s - таблица недоступна: %r', call.message.chat.id, ex)
+        outbox.send_message(call.message.chat.id, 'Расписание временно недоступно, попробуйте позже 🙏')
+
+@router.fallback
+def stale_button(call):
+    """Кнопка старого формата или неизвестные данные: ответ на нажатие и главное меню"""
+    outbox.answer_callback_query(call.id, 'Кнопка устарела')
+    go_to_menu(call)
+
+@router.route(cb.CANCEL_RECORD)
 def cancel_record(call):
     """Выбор записи для отмены"""
     client = create_client(call.message.chat.id)
@@ -75,51 +105,51 @@ def cancel_record(call):
     if len(records) != 0:
         markup = InlineKeyboardMarkup(row_width=1)
         markup.add(*[InlineKeyboardButton(text=' - '.join(x[:3]),
-                                         callback_data=f'CANCEL {ind}')
+                                         callback_data=cb.CANCEL.new(ind))
                     for ind, x in enumerate(records)])
         markup.add(*button_to_menu(return_callback=None, menu_text='В главное меню'))
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text='Какую запись вы хотите отменить?🙈',
                               reply_markup=markup)
     else:
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text='Отменять пока нечего 🤷')
         check_phone_number(call.message)
 
-@bot.callback_query_handler(lambda call: call.data.startswith('CANCEL'))
-def approve_cancel(call):
+@router.route(cb.CANCEL)
+def approve_cancel(call, index: int):
     """Подтверждение отмены записи"""
     markup = InlineKeyboardMarkup(row_width=2)
-    markup.add(*[InlineKeyboardButton(text='Подтверждаю', callback_data='APPROVE' + call.data),
-                 InlineKeyboardButton(text='В главное меню', callback_data='MENU')])
-    bot.edit_message_text(chat_id=call.message.chat.id,
+    markup.add(*[InlineKeyboardButton(text='Подтверждаю', callback_data=cb.APPROVE_CANCEL.new(index)),
+                 InlineKeyboardButton(text='В главное меню', callback_data=cb.MENU.new())])
+    outbox.edit_message_text(chat_id=call.message.chat.id,
                           message_id=call.message.message_id,
                           text='Точно отменить?',
                           reply_markup=markup)
 
-@bot.callback_query_handler(lambda call: call.data.startswith('APPROVE'))
-def set_cancel(call):
+@router.route(cb.APPROVE_CANCEL)
+def set_cancel(call, index: int):
     """Отмена записи"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
-        client_info = client.lst_records[int(call.data.split()[1])]
+        client_info = client.lst_records[index]
         client.date_record, client.time_record, client.location, client.psychologist = client_info
         client_id = get_client_id(call.message.chat.id, call.from_user.username)
         if client.set_time('', client_id):
-            bot.edit_message_text(chat_id=call.message.chat.id,
+            outbox.edit_message_text(chat_id=call.message.chat.id,
                                   message_id=call.message.message_id,
                                   text='Запись отменена!')
         else:
-            bot.edit_message_text(chat_id=call.message.chat.id,
+            outbox.edit_message_text(chat_id=call.message.chat.id,
                                   message_id=call.message.message_id,
                                   text='Не смог отменить запись.')
         check_phone_number(call.message)
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(lambda call: call.data == 'MY_RECORD')
+@router.route(cb.MY_RECORD)
 def show_record(call):
     """Показывает все записи клиента"""
     client = create_client(call.message.chat.id)
@@ -132,122 +162,121 @@ def show_record(call):
             rec += '🪷' + ' - '.join(i) + '\n'
     else:
         rec = 'Актуальных записей не найдено 🔍'
-    bot.edit_message_text(chat_id=call.message.chat.id,
+    outbox.edit_message_text(chat_id=call.message.chat.id,
                           message_id=call.message.message_id,
                           text=rec)
     check_phone_number(call.message)
 
-@bot.callback_query_handler(lambda call: call.data == 'RECORD')
+@router.route(cb.RECORD)
 def choice_location(call):
     """Выбор локации для записи"""
     create_client(call.message.chat.id)
     all_loc = get_cache_locations()
     markup = InlineKeyboardMarkup(row_width=3)
-    markup.add(*[InlineKeyboardButton(text=x, callback_data='LOCATION' + x)
+    markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.LOCATION.new(x))
                 for x in all_loc.keys()])
     markup.add(*button_to_menu(None))
-    bot.edit_message_text(chat_id=call.message.chat.id,
+    outbox.edit_message_text(chat_id=call.message.chat.id,
                           message_id=call.message.message_id,
                           text="Выберите локацию:",
                           reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('LOCATION'))
-def choice_psychologist(call):
+@router.route(cb.LOCATION)
+def choice_psychologist(call, location: str):
     """Выбор психолога"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
-        client.location = call.data[len('LOCATION'):]
+        client.location = location
         dct = get_cache_locations()
         markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(*[InlineKeyboardButton(text=x, callback_data='PSYCHOLOGIST' + x)
+        markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.PSYCHOLOGIST.new(x))
                     for x in dct[client.location]])
-        markup.add(InlineKeyboardButton(text='Любой психолог', callback_data='PSYCHOLOGIST' + 'ЛЮБОЙ'))
-        markup.add(*button_to_menu('RECORD'))
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        markup.add(InlineKeyboardButton(text='Любой психолог', callback_data=cb.PSYCHOLOGIST.new('ЛЮБОЙ')))
+        markup.add(*button_to_menu(cb.RECORD.new()))
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text="Выберите психолога:",
                               reply_markup=markup)
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('PSYCHOLOGIST'))
-def choice_date(call):
+@router.route(cb.PSYCHOLOGIST)
+def choice_date(call, psychologist: str):
     """Выбор даты"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
-        if call.data[len('PSYCHOLOGIST'):] != 'ЛЮБОЙ':
-            client.psychologist = call.data[len('PSYCHOLOGIST'):]
+        if psychologist != 'ЛЮБОЙ':
+            client.psychologist = psychologist
         else:
             client.psychologist = None
-        lst = client.get_all_days()
-        lst = list(map(lambda x: datetime.strptime(x, '%d.%m.%Y').date(), lst))
+        year, month, lst = client.get_first_month_days()
+        lst = [parse_sheet_date(x) for x in lst]
         if len(lst) == 0:
             location = client.location if client.location else 'ЛЮБОЙ'
             markup = InlineKeyboardMarkup(row_width=2)
-            markup.add(*button_to_menu('LOCATION' + location))
-            bot.edit_message_text(chat_id=call.message.chat.id,
+            markup.add(*button_to_menu(cb.LOCATION.new(location)))
+            outbox.edit_message_text(chat_id=call.message.chat.id,
                                   message_id=call.message.message_id,
                                   text="Для выбранного психолога нет доступных дат!\n"
                                        "Попробуйте другого психолога😉",
                                   reply_markup=markup)
         else:
             client.lst_currant_date = lst
-            clear_dict.CALENDAR_DICT[call.message.chat.id] = str(call.message.chat.id)
-            bot.edit_message_text(chat_id=call.from_user.id,
+            outbox.edit_message_text(chat_id=call.from_user.id,
                                   message_id=call.message.message_id,
                                   text='Выберите доступную дату:\n ✅ - есть свободное время',
                                   reply_markup=telebot_calendar.create_calendar(
-                                      name='CALENDAR' + clear_dict.CALENDAR_DICT[call.message.chat.id],
-                                      lst_current_date=lst))
+                                      name=cb.CALENDAR.prefix,
+                                      lst_current_date=lst, year=year, month=month))
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('CALENDAR'))
-def choice_time(call: CallbackQuery):
+@router.route(cb.CALENDAR)
+def choice_time(call: CallbackQuery, action: str, year: int, month: int, day: str):
     """Выбор времени"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
         lst = client.lst_currant_date
-        name, action, year, month, day = call.data.split(':')
+        target = telebot_calendar.navigation_month(action, year, month)
+        if target is not None:
+            # Доступные дни месяца загружаются при переходе к нему
+            lst = [parse_sheet_date(x) for x in client.get_month_days(*target)]
+            client.lst_currant_date = lst
         result = telebot_calendar.calendar_query_handler(
-            bot=bot, call=call, name=name, action=action, year=year, month=month, day=day,
+            bot=outbox, call=call, name=cb.CALENDAR.prefix, action=action, year=year, month=month, day=day,
             lst_currant_date=lst)
         if action == "DAY":
-            client.date_record = datetime(int(year), int(month), int(day)).strftime('%d.%m.%Y')
+            client.date_record = datetime(year, month, int(day)).strftime('%d.%m.%Y')
             lst_times = client.get_free_time()
             client.dct_currant_time = lst_times
             markup = InlineKeyboardMarkup(row_width=3)
-            markup.add(*[InlineKeyboardButton(text=x, callback_data='TIME' + x)
+            markup.add(*[InlineKeyboardButton(text=x, callback_data=cb.TIME.new(x))
                         for x in lst_times])
-            psychologist = 'PSYCHOLOGIST' + (client.psychologist if client.psychologist else 'ЛЮБОЙ')
+            psychologist = cb.PSYCHOLOGIST.new(client.psychologist if client.psychologist else 'ЛЮБОЙ')
             markup.add(*button_to_menu(psychologist))
             text = "Выберите время:" if len(lst_times) != 0 else "Для выбранной даты нет доступного времени!\n" \
                                                                 "Попробуйте другую дату😉"
-            bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
-            bot.send_message(chat_id=call.from_user.id, text=text, reply_markup=markup)
+            outbox.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+            outbox.send_message(chat_id=call.from_user.id, text=text, reply_markup=markup)
         elif action == "MENU":
             go_to_menu(call)
         elif action == "RETURN":
-            call.data = 'LOCATION' + client.location
-            choice_psychologist(call)
+            choice_psychologist(call, client.location)
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(lambda call: call.data.startswith('TIME'))
-def approve_record(call):
+@router.route(cb.TIME)
+def approve_record(call, time: str):
     """Подтверждение записи"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
-        client.time_record = call.data[len('TIME'):]
-        id_calendar = clear_dict.CALENDAR_DICT[call.from_user.id]
-        date_string = client.date_record
-        date_object = datetime.strptime(date_string, '%d.%m.%Y')
-        formatted_date = date_object.strftime('%Y:') + str(date_object.month) + ':' + str(date_object.day)
-        name_calendar = 'CALENDAR' + id_calendar + ':DAY:' + formatted_date
+        client.time_record = time
+        date_object = datetime.strptime(client.date_record, '%d.%m.%Y')
+        name_calendar = cb.CALENDAR.new('DAY', date_object.year, date_object.month, date_object.day)
         markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(InlineKeyboardButton(text='Подтверждаю', callback_data='APP_REC'))
+        markup.add(InlineKeyboardButton(text='Подтверждаю', callback_data=cb.APPROVE_RECORD.new()))
         markup.add(*button_to_menu(name_calendar))
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text=f'Проверьте данные записи:\n\n'
                                    f'📍 Локация: {client.location}\n'
@@ -258,14 +287,15 @@ def approve_record(call):
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('APP_REC'))
+@router.route(cb.APPROVE_RECORD)
 def set_time(call):
     """Установка времени записи"""
-    client = clear_dict.CLIENT_DICT.get(call.from_user.id)
+    client = clear_dict.SESSIONS.get(call.from_user.id)
     if client:
         id_client = get_client_id(call.message.chat.id, call.from_user.username)
-        if client.set_time(id_client):
-            bot.edit_message_text(chat_id=call.from_user.id,
+        result = client.set_time(id_client)
+        if result:
+            outbox.edit_message_text(chat_id=call.from_user.id,
                                   message_id=call.message.message_id,
                                   text=f'Успешно записал вас!\n\n'
                                        f'📍 Локация: {client.location}\n'
@@ -273,15 +303,35 @@ def set_time(call):
                                        f'📅 Дата: {client.date_record}\n'
                                        f'🕓 Время: {client.time_record}')
             check_phone_number(call.message)
+        elif result is BookingResult.TAKEN:
+            outbox.send_message(call.message.chat.id, 'Время кто-то забронировал...\nПопробуйте другое!')
         else:
-            bot.send_message(call.message.chat.id, 'Время кто-то забронировал...\nПопробуйте другое!')
+            outbox.send_message(call.message.chat.id, 'Выбранное время не найдено в расписании.\nПопробуйте другое!')
     else:
         go_to_menu(call)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'MENU')
+@router.route(cb.MENU)
 def go_to_menu(call):
     """Возвращает в главное меню"""
-    bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    outbox.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
     check_phone_number(call.message)
 
-bot.infinity_polling()
\ No newline at end of file
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # Метрики: http://127.0.0.1:METRICS_PORT/metrics и/или файл METRICS_DUMP_PATH
+    metrics.start()
+    # Таблица открывается при первом запросе, фоновые задачи не задерживают запуск
+    clear_dict.start_sweeper()
+    if '--async' in sys.argv[1:]:
+        # Асинхронный режим: AsyncTeleBot и неблокирующий доступ к Google Sheets
+        import async_main
+        asyncio.run(async_main.polling())
+    else:
+        # Расписание на ближайшие дни обновляется в фоне, обработчики отвечают из памяти
+        PREFETCHER.start()
+        if '--webhook' in sys.argv[1:]:
+            # Приём обновлений через webhook с обработкой чатов в параллельных потоках
+            import webhook
+            webhook.run(bot)
+        else:
+            bot.infinity_polling()
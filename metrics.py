@@ -0,0 +1,285 @@
+"""
+Метрики бота в формате Prometheus
+
+Счётчики и гистограммы задержек с метками; значения отдаются текстом
+по HTTP (METRICS_PORT) и/или периодически записываются в файл (METRICS_DUMP_PATH).
+Наблюдение - один захват блокировки и bisect по границам корзин.
+"""
+import logging
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-эндпоинта /metrics (0 - не запускать)
+METRICS_PORT = 9100
+METRICS_HOST = '127.0.0.1'
+# Файл для периодической выгрузки метрик ('' - не выгружать) и период в секундах
+METRICS_DUMP_PATH = ''
+METRICS_DUMP_PERIOD = 60
+# Границы корзин гистограмм задержек в секундах
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """
+    Счётчик с метками
+
+    :param name: Имя метрики
+    :param documentation: Описание
+    :param labels: Имена меток
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Увеличивает счётчик с метками labels"""
+        key = tuple(labels[x] for x in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Текущее значение"""
+        return self._values.get(tuple(labels[x] for x in self.labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in items]
+
+
+class Histogram:
+    """
+    Гистограмма с метками
+
+    :param name: Имя метрики
+    :param documentation: Описание
+    :param labels: Имена меток
+    :param buckets: Верхние границы корзин
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счётчики корзин (последняя - +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """Учитывает одно значение"""
+        key = tuple(labels[x] for x in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """Количество наблюдений"""
+        state = self._values.get(tuple(labels[x] for x in self.labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{float(bound)!r}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    Показатель, вычисляемый при выгрузке
+
+    :param name: Имя метрики
+    :param documentation: Описание
+    :param func: Функция без аргументов, возвращающая число (None - нет значения)
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def samples(self) -> list[str]:
+        try:
+            value = self.func()
+        except Exception:
+            logger.exception('Ошибка вычисления метрики %s', self.name)
+            return []
+        return [] if value is None else [f'{self.name} {value}']
+
+
+class Registry:
+    """Набор метрик для выгрузки"""
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        """Добавляет метрику (повторная регистрация имени возвращает существующую)"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labels=()) -> Counter:
+    """Счётчик в REGISTRY"""
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def histogram(name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    """Гистограмма в REGISTRY"""
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+def gauge(name: str, documentation: str, func) -> Gauge:
+    """Вычисляемый показатель в REGISTRY"""
+    return REGISTRY.register(Gauge(name, documentation, func))
+
+
+# Общие метрики
+SHEETS_SECONDS = histogram('sheets_request_seconds', 'Google Sheets API request latency', ('method',))
+SHEETS_ERRORS = counter('sheets_request_errors_total', 'Google Sheets API request errors', ('method',))
+SHEETS_QUOTA_WAIT = histogram('sheets_quota_wait_seconds', 'Time spent waiting for a quota token', ('kind',))
+CACHE_REQUESTS = counter('cache_requests_total', 'Cache lookups', ('cache', 'result'))
+HANDLER_SECONDS = histogram('handler_seconds', 'Telegram handler latency', ('route',))
+HANDLER_ERRORS = counter('handler_errors_total', 'Telegram handler errors', ('route',))
+RETRIES = counter('retries_total', 'Retried calls', ('function',))
+RETRY_BUDGET_EXHAUSTED = counter('retry_budget_exhausted_total', 'Retries skipped because the retry budget was empty',
+                                 ('function',))
+DEADLINE_EXCEEDED = counter('deadline_exceeded_total', 'Calls stopped by the request deadline', ('function',))
+CIRCUIT_REJECTED = counter('circuit_rejected_total', 'Requests rejected by an open circuit breaker', ('circuit',))
+STALE_SERVED = counter('stale_served_total', 'Calls answered from stale data', ('function',))
+ERRORS = counter('errors_total', 'Logged errors', ('source',))
+
+
+class ErrorCounter(logging.Handler):
+    """Обработчик логов, считающий ошибки по имени логгера"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        ERRORS.inc(source=record.name)
+
+
+def cache_lookup(cache: str, hit: bool, stale: bool = False) -> None:
+    """Учитывает попадание/промах кэша (stale - отдано устаревшее значение)"""
+    CACHE_REQUESTS.inc(cache=cache, result='stale' if stale else 'hit' if hit else 'miss')
+
+
+def serve(port=METRICS_PORT, host=METRICS_HOST) -> ThreadingHTTPServer:
+    """
+    Запускает HTTP-эндпоинт /metrics в фоновом потоке
+
+    :param port: Порт
+    :param host: Адрес
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def dump(path=METRICS_DUMP_PATH) -> None:
+    """Записывает метрики в файл (через временный файл, атомарно)"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as file:
+        file.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+
+def start(port=METRICS_PORT, dump_path=METRICS_DUMP_PATH, period=METRICS_DUMP_PERIOD) -> None:
+    """
+    Запускает выгрузку метрик по настройкам
+
+    :param port: Порт HTTP-эндпоинта (0 - не запускать)
+    :param dump_path: Файл периодической выгрузки ('' - не выгружать)
+    :param period: Период выгрузки в секундах
+    """
+    root = logging.getLogger()
+    if not any(isinstance(x, ErrorCounter) for x in root.handlers):
+        root.addHandler(ErrorCounter())
+    if port:
+        serve(port)
+    if dump_path:
+        def run():
+            while True:
+                sleep(period)
+                try:
+                    dump(dump_path)
+                except OSError:
+                    logger.exception('Ошибка выгрузки метрик в %s', dump_path)
+        Thread(target=run, name='metrics-dump', daemon=True).start()
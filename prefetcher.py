@@ -0,0 +1,133 @@
+"""
+Фоновое обновление расписания на ближайшие дни
+
+Листы с датами перечитываются по расписанию, лист текущего дня - чаще остальных.
+Обновлённые листы подменяются в индексе целиком, поэтому обработчики
+(выбор даты и времени) отвечают из памяти и не ждут Google Sheets.
+"""
+import logging
+from datetime import datetime
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+import google_sheet
+from sheet_loader import DATE_FORMAT
+import metrics
+from resilience import SheetsUnavailable
+from sheets_quota import PRIORITY_BACKGROUND, priority
+
+logger = logging.getLogger(__name__)
+
+# Количество дней, которые поддерживаются загруженными
+PREFETCH_DAYS = 7
+# Период обновления всех листов в секундах (меньше google_sheet.CACHE_SCHEDULE_TTL)
+PREFETCH_PERIOD = 45
+# Период обновления листа текущего дня в секундах
+PREFETCH_TODAY_PERIOD = 15
+# Период переноса листов прошедших дат в архив в секундах (если задан google_sheet.ARCHIVE_SPREADSHEET_KEY)
+ARCHIVE_PERIOD = 24 * 60 * 60
+
+
+class SchedulePrefetcher:
+    """
+    Фоновое обновление индекса расписания
+
+    :param count_days: Количество дней, которые поддерживаются загруженными
+    :param period: Период обновления всех листов в секундах
+    :param today_period: Период обновления листа текущего дня в секундах
+    """
+    def __init__(self, count_days=PREFETCH_DAYS, period=PREFETCH_PERIOD, today_period=PREFETCH_TODAY_PERIOD):
+        self.count_days = count_days
+        self.period = period
+        self.today_period = today_period
+        # Время окончания (monotonic) и длительность последних обновлений
+        self.last_refresh = None
+        self.last_duration = None
+        self.last_today_refresh = None
+        self.last_today_duration = None
+        self.last_archive = None
+        self.errors = 0
+        self._thread = None
+        self._lock = Lock()
+
+    def refresh_all(self) -> None:
+        """
+        Перечитывает локации (если кэш истёк), список листов (не чаще
+        google_sheet.SHEET_NAMES_RECHECK_PERIOD), все листы на count_days дней,
+        листы текущего и следующего месяца (если их кэш истёк)
+        """
+        with self._lock:
+            start = monotonic()
+            google_sheet.get_cache_locations()
+            google_sheet.recheck_sheet_names()
+            google_sheet.refresh_schedule(self.count_days)
+            now = datetime.now(tz=google_sheet.tz)
+            google_sheet.get_month(now.year, now.month)
+            google_sheet.get_month(*google_sheet.next_month(now.year, now.month))
+            self.last_refresh = monotonic()
+            self.last_duration = self.last_refresh - start
+        if google_sheet.ARCHIVE_SPREADSHEET_KEY and (
+                self.last_archive is None or monotonic() - self.last_archive >= ARCHIVE_PERIOD):
+            self.last_archive = monotonic()
+            google_sheet.archive_past_sheets()
+
+    def refresh_today(self) -> None:
+        """Перечитывает лист текущего дня"""
+        with self._lock:
+            start = monotonic()
+            google_sheet.refresh_day(datetime.now(tz=google_sheet.tz).strftime(DATE_FORMAT))
+            self.last_today_refresh = monotonic()
+            self.last_today_duration = self.last_today_refresh - start
+
+    def refresh_age(self) -> float | None:
+        """Секунды с последнего обновления всех листов (None - ещё не обновлялись)"""
+        if self.last_refresh is None:
+            return None
+        return monotonic() - self.last_refresh
+
+    def stats(self) -> dict:
+        """Возраст и длительность последних обновлений в секундах, количество ошибок"""
+        today_age = None if self.last_today_refresh is None else monotonic() - self.last_today_refresh
+        return {'refresh_age': self.refresh_age(), 'refresh_duration': self.last_duration,
+                'today_age': today_age, 'today_duration': self.last_today_duration,
+                'errors': self.errors}
+
+    @priority(PRIORITY_BACKGROUND)
+    def run(self) -> None:
+        """Цикл обновления: все листы раз в period, текущий день раз в today_period (фоновый приоритет квоты)"""
+        if self.last_refresh is None:
+            next_all = next_today = monotonic()
+        else:
+            # Расписание уже прогрето (warm_up) - следующее обновление по расписанию
+            next_all = self.last_refresh + self.period
+            next_today = self.last_refresh + self.today_period
+        while True:
+            sleep(max(0.0, min(next_all, next_today) - monotonic()))
+            now = monotonic()
+            try:
+                if now >= next_all:
+                    next_all = now + self.period
+                    # Полное обновление включает и текущий день
+                    next_today = now + self.today_period
+                    self.refresh_all()
+                elif now >= next_today:
+                    next_today = now + self.today_period
+                    self.refresh_today()
+            except SheetsUnavailable as ex:
+                self.errors += 1
+                logger.warning('Таблица недоступна, расписание не обновлено: %r', ex)
+            except Exception:
+                self.errors += 1
+                logger.exception('Ошибка фонового обновления расписания')
+
+    def start(self) -> None:
+        """Запускает обновление в фоновом потоке"""
+        if self._thread is None:
+            self._thread = Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+
+PREFETCHER = SchedulePrefetcher()
+metrics.gauge('schedule_refresh_age_seconds', 'Seconds since the last full schedule refresh', PREFETCHER.refresh_age)
+metrics.gauge('schedule_refresh_duration_seconds', 'Duration of the last full schedule refresh',
+              lambda: PREFETCHER.last_duration)
@@ -0,0 +1,287 @@
+"""
+Повторы запросов к Google Sheets с дедлайном, бюджетом повторов и автоматическим выключателем
+
+Обработчик задаёт дедлайн запроса (deadline()), он ограничивает ожидание квоты и паузы
+между повторами. Паузы растут экспоненциально со случайным разбросом, повторы расходуют
+общий бюджет (доля от числа вызовов), чтобы при сбое не умножать нагрузку. После серии
+ошибок выключатель размыкается: запросы сразу завершаются ошибкой, а вызовы отдают
+последние загруженные данные, пока пробный запрос не пройдёт успешно.
+"""
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from time import monotonic, sleep
+
+import requests
+from gspread.exceptions import APIError
+
+import metrics
+from metrics import CIRCUIT_REJECTED, DEADLINE_EXCEEDED, RETRIES, RETRY_BUDGET_EXHAUSTED, STALE_SERVED
+
+logger = logging.getLogger(__name__)
+
+# Дедлайн обработки одного обновления Telegram в секундах
+HANDLER_DEADLINE = 20
+# Количество попыток вызова и паузы между ними в секундах (экспонента со случайным разбросом)
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+# Бюджет повторов: доля от числа вызовов и минимум повторов в секунду
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 1
+# Выключатель: ошибок подряд до размыкания и пауза до пробного запроса в секундах
+CIRCUIT_FAILURES = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Коды ответа API, после которых запрос имеет смысл повторить
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+_deadline: ContextVar[float | None] = ContextVar('sheets_deadline', default=None)
+# Вызов уже выполняется под политикой повторов (вложенные вызовы не повторяются сами)
+_active: ContextVar[bool] = ContextVar('sheets_retry_active', default=False)
+
+
+class SheetsUnavailable(Exception):
+    """Google Sheets недоступна, а последних данных для ответа нет"""
+
+
+class CircuitOpen(SheetsUnavailable):
+    """Выключатель разомкнут: запрос не отправлялся"""
+
+
+class DeadlineExceeded(SheetsUnavailable):
+    """Дедлайн запроса истёк"""
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Дедлайн запросов к Google Sheets внутри блока (вложенный дедлайн не продлевает внешний)"""
+    current = _deadline.get()
+    value = monotonic() + seconds
+    token = _deadline.set(value if current is None else min(current, value))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Секунды до дедлайна (None - дедлайн не задан)"""
+    value = _deadline.get()
+    return None if value is None else value - monotonic()
+
+
+def is_transient(ex: Exception) -> bool:
+    """Ошибка сети или временная ошибка API, которую имеет смысл повторить"""
+    if isinstance(ex, APIError):
+        return getattr(ex.response, 'status_code', None) in RETRY_STATUS_CODES
+    return isinstance(ex, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый вызов пополняет его на ratio, повтор расходует единицу
+
+    :param ratio: Доля повторов от числа вызовов
+    :param min_per_second: Повторов в секунду, доступных без вызовов
+    :param capacity: Максимум накопленных повторов
+    """
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND, capacity=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now: float, amount=0.0) -> None:
+        self._balance = min(self.capacity, self._balance + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        """Учитывает вызов"""
+        with self._lock:
+            self._refill(monotonic(), self.ratio)
+
+    def withdraw(self) -> bool:
+        """Забирает повтор из бюджета (False - бюджет исчерпан)"""
+        with self._lock:
+            self._refill(monotonic())
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель: после failures ошибок подряд запросы отклоняются
+    reset_timeout секунд, затем пропускается один пробный запрос
+
+    :param name: Имя (метка метрик)
+    :param failures: Ошибок подряд до размыкания
+    :param reset_timeout: Пауза до пробного запроса в секундах
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failures=CIRCUIT_FAILURES, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._count = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = Lock()
+        self.opened = 0
+
+    def before(self) -> None:
+        """Проверяет, можно ли отправить запрос (иначе CircuitOpen)"""
+        with self._lock:
+            if self.state == self.OPEN and monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        CIRCUIT_REJECTED.inc(circuit=self.name)
+        raise CircuitOpen(f'{self.name}: circuit is open')
+
+    def success(self) -> None:
+        """Учитывает успешный запрос"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('%s - запросы снова проходят, выключатель замкнут', self.name)
+            self.state = self.CLOSED
+            self._count = 0
+            self._probing = False
+
+    def failure(self) -> None:
+        """Учитывает ошибку запроса"""
+        with self._lock:
+            self._count += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._count >= self.failures):
+                if self.state == self.CLOSED:
+                    logger.error('%s - %s ошибок подряд, выключатель разомкнут на %s c',
+                                 self.name, self._count, self.reset_timeout)
+                self.state = self.OPEN
+                self._opened_at = monotonic()
+                self._probing = False
+                self.opened += 1
+
+    def stats(self) -> dict:
+        """Состояние, ошибок подряд и количество размыканий"""
+        with self._lock:
+            return {'state': self.state, 'failures': self._count, 'opened': self.opened}
+
+
+class RetryPolicy:
+    """
+    Политика повторов вызова
+
+    :param attempts: Количество попыток
+    :param base_delay: Пауза перед первым повтором в секундах
+    :param max_delay: Максимальная пауза в секундах
+    :param budget: Бюджет повторов
+    :param retry_on: Условие повтора по исключению
+    """
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 budget: RetryBudget | None = None, retry_on=is_transient):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.retry_on = retry_on
+
+    def delay(self, attempt: int) -> float:
+        """Пауза перед повтором attempt (с единицы): случайная в [0, base_delay * 2 ** (attempt - 1)]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, name: str, fn, *args, **kwargs):
+        """
+        Вызывает fn(*args, **kwargs), повторяя временные ошибки до дедлайна.
+        Вложенные вызовы под политикой выполняются один раз - повторяет внешний.
+
+        :param name: Имя вызова (метка метрик)
+        :param fn: Функция
+        :return: Результат fn
+        """
+        if _active.get():
+            return fn(*args, **kwargs)
+        token = _active.set(True)
+        try:
+            self.budget.deposit()
+            attempt = 0
+            while True:
+                left = remaining()
+                if left is not None and left <= 0:
+                    DEADLINE_EXCEEDED.inc(function=name)
+                    raise DeadlineExceeded(f'{name}: deadline exceeded')
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as ex:
+                    attempt += 1
+                    if isinstance(ex, CircuitOpen) or not self.retry_on(ex) or attempt >= self.attempts:
+                        raise
+                    pause = self.delay(attempt)
+                    left = remaining()
+                    if left is not None and pause >= left:
+                        DEADLINE_EXCEEDED.inc(function=name)
+                        raise
+                    if not self.budget.withdraw():
+                        RETRY_BUDGET_EXHAUSTED.inc(function=name)
+                        raise
+                    RETRIES.inc(function=name)
+                    logger.warning('%s - ошибка, повтор через %.2f c: %r', name, pause, ex)
+                sleep(pause)
+        finally:
+            _active.reset(token)
+
+
+# Выключатель всех запросов к Google Sheets и общая политика повторов
+BREAKER = CircuitBreaker('sheets')
+POLICY = RetryPolicy()
+metrics.gauge('sheets_circuit_open', 'Sheets circuit breaker state (0 closed, 1 half-open, 2 open)',
+              lambda: (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN).index(BREAKER.state))
+
+
+def resilient(name: str, stale=None, policy: RetryPolicy | None = None):
+    """
+    Декоратор вызова Google Sheets с повторами по политике.
+    Если повторы не помогли, вызов отдаёт последние данные stale(*args, **kwargs),
+    а без них завершается SheetsUnavailable.
+
+    :param name: Имя вызова (метка метрик)
+    :param stale: Функция последних загруженных данных (None - данных нет)
+    :param policy: Политика повторов (по умолчанию POLICY)
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active.get():
+                # Повторы и последние данные - на уровне внешнего вызова
+                return fn(*args, **kwargs)
+            try:
+                return (policy or POLICY).call(name, fn, *args, **kwargs)
+            except Exception as ex:
+                if not isinstance(ex, SheetsUnavailable) and not is_transient(ex):
+                    raise
+                value = None if stale is None else stale(*args, **kwargs)
+                if value is None:
+                    if isinstance(ex, SheetsUnavailable):
+                        raise
+                    raise SheetsUnavailable(f'{name}: {ex!r}') from ex
+                STALE_SERVED.inc(function=name)
+                # При разомкнутом выключателе это ожидаемо и не засоряет лог
+                logger.log(logging.DEBUG if isinstance(ex, CircuitOpen) else logging.WARNING,
+                           '%s - таблица недоступна, ответ из последних данных: %r', name, ex)
+                return value
+        return wrapper
+    return decorator
@@ -0,0 +1,317 @@
+"""
+Индекс расписания в памяти: разобранные слоты листов с датами
+"""
+import logging
+import sys
+from datetime import date, datetime, time
+from functools import lru_cache
+from threading import Lock
+
+from sheet_loader import parse_sheet_date
+
+logger = logging.getLogger(__name__)
+
+# Названия колонок листа с датой
+NAME_COL_TIME = 'Время'
+NAME_COL_PSYCHOLOGIST = 'Психолог'
+NAME_COL_CLIENT = 'Клиент'
+
+
+@lru_cache(maxsize=256)
+def parse_time(value: str) -> time | None:
+    """
+    Разбирает время 'ЧЧ:ММ' (результат кэшируется - различных значений немного)
+
+    :param value: Строка времени
+    :return: Время или None, если строка не является временем
+    """
+    try:
+        return datetime.strptime(value.strip(), '%H:%M').time()
+    except ValueError:
+        return None
+
+
+class Slot:
+    """Слот записи на листе с датой"""
+    __slots__ = ('time', 'time_str', 'psychologist', 'client', 'row')
+
+    def __init__(self, time_value: time, time_str: str, psychologist: str, client: str, row: int):
+        self.time = time_value
+        self.time_str = time_str
+        self.psychologist = psychologist
+        self.client = client
+        self.row = row
+
+    @property
+    def free(self) -> bool:
+        """Слот свободен"""
+        return self.client == ''
+
+    def __repr__(self):
+        return f'Slot({self.time_str!r}, {self.psychologist!r}, {self.client!r}, row={self.row})'
+
+
+class DaySchedule:
+    """Слоты одного листа с датой, сгруппированные по психологам"""
+    __slots__ = ('title', 'date', 'records', 'by_psychologist')
+
+    def __init__(self, title: str, date_sheet: date, records: list[dict]):
+        self.title = title
+        self.date = date_sheet
+        # Записи храним для дешёвой проверки изменений листа (set_client обновляет их вместе со слотом)
+        self.records = list(records)
+        self.by_psychologist: dict[str, list[Slot]] = {}
+        for row, record in enumerate(records, start=2):
+            time_str = str(record.get(NAME_COL_TIME, '')).strip()
+            time_value = parse_time(time_str)
+            if time_value is None:
+                if time_str:
+                    logger.warning('%s %s %s - Неверный формат времени', time_str, title, row)
+                continue
+            psychologist = sys.intern(str(record.get(NAME_COL_PSYCHOLOGIST, '')).strip())
+            client = str(record.get(NAME_COL_CLIENT, '')).strip()
+            self.by_psychologist.setdefault(psychologist, []).append(
+                Slot(time_value, time_str, psychologist, client, row))
+        for slots in self.by_psychologist.values():
+            slots.sort(key=lambda x: x.time)
+
+    def slots(self, psychologists=None):
+        """
+        Слоты выбранных психологов
+
+        :param psychologists: Имена психологов или None - все психологи
+        """
+        if psychologists is None:
+            psychologists = self.by_psychologist.keys()
+        for psychologist in psychologists:
+            yield from self.by_psychologist.get(psychologist, ())
+
+    def free_psychologists(self) -> set[str]:
+        """Психологи, у которых есть свободные слоты"""
+        return {name for name, slots in self.by_psychologist.items() if any(x.free for x in slots)}
+
+
+class ScheduleIndex:
+    """
+    Индекс слотов по (дата, психолог) с обновлением по отдельным листам
+
+    Локация задаётся списком её психологов (лист 'Психологи').
+    """
+    def __init__(self):
+        self._days: dict[str, DaySchedule] = {}
+        # психолог -> даты листов, на которых у него есть свободные слоты
+        self._free_dates: dict[str, set[str]] = {}
+        # клиент -> занятые им слоты (обратный индекс для 'Мои записи'/'Отмена записи')
+        self._by_client: dict[str, dict[Slot, DaySchedule]] = {}
+        self._lock = Lock()
+
+    def __contains__(self, title: str) -> bool:
+        return title in self._days
+
+    def titles(self) -> list[str]:
+        """Названия загруженных листов"""
+        return list(self._days)
+
+    def _add_booking(self, day: DaySchedule, slot: Slot) -> None:
+        """Добавляет занятый слот в индекс клиентов"""
+        if not slot.free:
+            self._by_client.setdefault(slot.client, {})[slot] = day
+
+    def _remove_booking(self, slot: Slot) -> None:
+        """Удаляет слот из индекса клиентов"""
+        bookings = self._by_client.get(slot.client)
+        if bookings is not None:
+            bookings.pop(slot, None)
+            if not bookings:
+                del self._by_client[slot.client]
+
+    def _unlink(self, day: DaySchedule) -> None:
+        """Удаляет свободные даты и записи клиентов листа из индекса"""
+        for psychologist in day.by_psychologist:
+            dates = self._free_dates.get(psychologist)
+            if dates is not None:
+                dates.discard(day.title)
+                if not dates:
+                    del self._free_dates[psychologist]
+        for slot in day.slots():
+            self._remove_booking(slot)
+
+    def _link(self, day: DaySchedule) -> None:
+        """Добавляет свободные даты и записи клиентов листа в индекс"""
+        for psychologist in day.free_psychologists():
+            self._free_dates.setdefault(psychologist, set()).add(day.title)
+        for slot in day.slots():
+            self._add_booking(day, slot)
+
+    def update_day(self, title: str, records: list[dict]) -> bool:
+        """
+        Перестраивает индекс одного листа, если его данные изменились
+
+        :param title: Название листа (дата)
+        :param records: Записи листа
+        :return: True, если лист был перестроен
+        """
+        date_sheet = parse_sheet_date(title)
+        if date_sheet is None:
+            return False
+        old = self._days.get(title)
+        if old is not None and old.records == records:
+            return False
+        # Новый лист строится вне блокировки, под ней только подменяется
+        day = DaySchedule(title, date_sheet, records)
+        with self._lock:
+            old = self._days.get(title)
+            if old is not None:
+                self._unlink(old)
+            self._days[title] = day
+            self._link(day)
+        return True
+
+    def update(self, schedule: dict[str, list[dict]], keep=()) -> list[str]:
+        """
+        Применяет выгрузку листов: меняет изменившиеся листы и удаляет отсутствующие
+
+        :param schedule: Словарь {название листа: записи}
+        :param keep: Листы, которые остаются в индексе без выгрузки (загруженные по месяцам)
+        :return: Перестроенные и удалённые листы
+        """
+        changed = [title for title, records in schedule.items() if self.update_day(title, records)]
+        keep = set(keep)
+        with self._lock:
+            removed = [x for x in self._days if x not in schedule and x not in keep]
+            for title in removed:
+                self._unlink(self._days.pop(title))
+        return changed + removed
+
+    def available_dates(self, psychologists, now: datetime, first: date | None = None,
+                        last: date | None = None) -> list[str]:
+        """
+        Даты со свободными слотами
+
+        :param psychologists: Имена психологов или None - все психологи
+        :param now: Текущее время (для отсечения прошедших слотов сегодня)
+        :param first: Первая дата (None - без ограничения)
+        :param last: Последняя дата (None - без ограничения)
+        :return: Названия листов, отсортированные по дате
+        """
+        with self._lock:
+            if psychologists is None:
+                psychologists = list(self._free_dates)
+            titles = set()
+            for psychologist in psychologists:
+                titles.update(self._free_dates.get(psychologist, ()))
+            days = [self._days[x] for x in titles]
+        today = now.date()
+        now_time = now.time()
+        result = []
+        for day in days:
+            if day.date < today or (first is not None and day.date < first) or \
+                    (last is not None and day.date > last):
+                continue
+            if day.date == today and not any(x.free and now_time < x.time for x in day.slots(psychologists)):
+                continue
+            result.append(day)
+        return [x.title for x in sorted(result, key=lambda x: x.date)]
+
+    def has_free(self, title: str, psychologists, now: datetime) -> bool:
+        """
+        Есть ли на дату свободное (ещё не прошедшее) время
+
+        :param title: Название листа (дата)
+        :param psychologists: Имена психологов или None - все психологи
+        :param now: Текущее время
+        """
+        day = self._days.get(title)
+        if day is None or day.date < now.date():
+            return False
+        if day.date == now.date():
+            now_time = now.time()
+            return any(x.free and now_time < x.time for x in day.slots(psychologists))
+        return any(x.free for x in day.slots(psychologists))
+
+    def find_slots(self, title: str, time_str: str, psychologists, client: str | None = '') -> list[Slot]:
+        """
+        Слоты на дату и время с заданным значением колонки 'Клиент'
+
+        :param title: Название листа (дата)
+        :param time_str: Время 'ЧЧ:ММ'
+        :param psychologists: Имена психологов или None - все психологи
+        :param client: Значение колонки 'Клиент' ('' - свободный слот, None - любое)
+        """
+        day = self._days.get(title)
+        if day is None:
+            return []
+        slots = [x for x in day.slots(psychologists) if x.time_str == time_str]
+        if client is None:
+            return slots
+        client = client.strip()
+        return [x for x in slots if x.client == client]
+
+    def has_slot(self, title: str, slot: Slot) -> bool:
+        """Слот из текущей версии листа (False - лист перестроен или удалён)"""
+        day = self._days.get(title)
+        return day is not None and any(x is slot for x in day.by_psychologist.get(slot.psychologist, ()))
+
+    def set_client(self, title: str, slot: Slot, client: str) -> None:
+        """
+        Меняет клиента в слоте после записи/отмены или проверки строки листа
+
+        :param title: Название листа (дата)
+        :param slot: Слот из индекса
+        :param client: Новое значение колонки 'Клиент'
+        """
+        with self._lock:
+            if not self.has_slot(title, slot):
+                # Лист уже перестроен - слот из прежней версии не меняем
+                return
+            day = self._days[title]
+            self._remove_booking(slot)
+            slot.client = client.strip()
+            self._add_booking(day, slot)
+            # Иначе возврат строки в таблице к загруженному значению не перестроит лист
+            day.records[slot.row - 2] = {**day.records[slot.row - 2], NAME_COL_CLIENT: client}
+            dates = self._free_dates.setdefault(slot.psychologist, set())
+            if any(x.free for x in day.by_psychologist.get(slot.psychologist, ())):
+                dates.add(title)
+            else:
+                dates.discard(title)
+                if not dates:
+                    del self._free_dates[slot.psychologist]
+
+    def free_times(self, title: str, psychologists, now: datetime) -> list[str]:
+        """
+        Свободное время на дату
+
+        :param title: Название листа (дата)
+        :param psychologists: Имена психологов или None - все психологи
+        :param now: Текущее время (для отсечения прошедших слотов сегодня)
+        :return: Отсортированный список времени 'ЧЧ:ММ' без повторов
+        """
+        day = self._days.get(title)
+        if day is None:
+            return []
+        slots = [x for x in day.slots(psychologists) if x.free]
+        if day.date == now.date():
+            now_time = now.time()
+            slots = [x for x in slots if now_time < x.time]
+        times = {}
+        for slot in sorted(slots, key=lambda x: x.time):
+            times.setdefault(slot.time_str, None)
+        return list(times)
+
+    def bookings(self, client: str, now: datetime) -> list[tuple[str, Slot]]:
+        """
+        Предстоящие записи клиента
+
+        :param client: Строка клиента (значение колонки 'Клиент')
+        :param now: Текущее время (прошедшие записи не возвращаются)
+        :return: Список (название листа, слот) по возрастанию даты и времени
+        """
+        with self._lock:
+            items = list(self._by_client.get(client.strip(), {}).items())
+        today = now.date()
+        now_time = now.time()
+        items = [(day, slot) for slot, day in items
+                 if day.date > today or (day.date == today and now_time < slot.time)]
+        items.sort(key=lambda x: (x[0].date, x[1].time))
+        return [(day.title, slot) for day, slot in items]
@@ -0,0 +1,257 @@
+"""
+Очередь исходящих сообщений Telegram
+
+Обработчики ставят ответы в очередь и сразу возвращаются. Рабочие потоки отправляют
+их с ограничением общей скорости и скорости в каждом чате, сохраняя порядок
+сообщений внутри чата. Ответ 429 откладывает отправку в этот чат на retry_after секунд,
+остальные чаты не ждут; общая скорость снижается только после 429 вне чата.
+"""
+import asyncio
+import heapq
+import logging
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from itertools import count
+from queue import Full
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+from cachetools import TTLCache
+
+from sheets_quota import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Максимум сообщений в очереди
+SEND_QUEUE_SIZE = 1000
+# Ожидание места в очереди в секундах (затем queue.Full)
+SEND_QUEUE_TIMEOUT = 5
+# Количество потоков отправки
+SEND_WORKERS = 4
+# Ограничения Telegram: сообщений в секунду всего и в один чат, размер пачки в чат
+TELEGRAM_GLOBAL_PER_SECOND = 30
+TELEGRAM_CHAT_PER_SECOND = 1
+TELEGRAM_CHAT_BURST = 3
+
+
+def retry_after(ex: Exception) -> float | None:
+    """Секунды ожидания из ответа 429 Telegram (None - это не 429)"""
+    if getattr(ex, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(ex, 'result_json', None) or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+class SendQueue:
+    """
+    Ограниченная очередь вызовов Telegram API с упорядочиванием по чатам
+
+    :param maxsize: Максимум сообщений в очереди
+    :param workers: Количество потоков отправки
+    :param global_per_second: Сообщений в секунду всего
+    :param chat_per_second: Сообщений в секунду в один чат
+    :param chat_burst: Сообщений в чат разом
+    """
+    def __init__(self, maxsize=SEND_QUEUE_SIZE, workers=SEND_WORKERS, global_per_second=TELEGRAM_GLOBAL_PER_SECOND,
+                 chat_per_second=TELEGRAM_CHAT_PER_SECOND, chat_burst=TELEGRAM_CHAT_BURST):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.chat_per_second = chat_per_second
+        self.chat_burst = chat_burst
+        self._cond = Condition(Lock())
+        self._global = TokenBucket(global_per_second * 60, global_per_second)
+        # Корзины чатов живут, пока не наполнятся заново
+        self._chat_buckets = TTLCache(maxsize=100000, ttl=chat_burst / chat_per_second)
+        # Очереди чатов: chat_id -> deque[(fn, args, kwargs, future)]
+        self._lanes: dict[object, deque] = {}
+        # Чаты с ожидающими сообщениями, не занятые потоком: (время готовности, номер, chat_id)
+        self._ready: list[tuple[float, int, object]] = []
+        self._seq = count()
+        self._threads: list[Thread] = []
+        self.pending = 0
+        self.max_pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_per_second * 60, self.chat_burst)
+        # Обращение продлевает жизнь корзины
+        self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def submit(self, key, fn, *args, timeout=SEND_QUEUE_TIMEOUT, **kwargs) -> Future:
+        """
+        Ставит вызов fn(*args, **kwargs) в очередь чата
+
+        :param key: Чат (порядок сохраняется внутри чата); кортеж - вызов, не относящийся к чату
+        :param fn: Метод TeleBot
+        :param timeout: Ожидание места в очереди в секундах
+        :return: Future с результатом вызова
+        """
+        future = Future()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.pending < self.maxsize, timeout):
+                raise Full('Telegram send queue is full')
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+                heapq.heappush(self._ready, (monotonic(), next(self._seq), key))
+            lane.append((fn, args, kwargs, future))
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            self._cond.notify_all()
+            if not self._threads:
+                self._start()
+        return future
+
+    def _start(self) -> None:
+        """Запускает потоки отправки (под self._cond)"""
+        for i in range(self.workers):
+            thread = Thread(target=self._run, name=f'telegram-send-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        """Ждёт чат, в который можно отправить (под self._cond)"""
+        while True:
+            now = monotonic()
+            if not self._ready:
+                self._cond.wait()
+                continue
+            ready_at, _, chat_id = self._ready[0]
+            if ready_at > now:
+                self._cond.wait(ready_at - now)
+                continue
+            bucket = self._chat_bucket(chat_id)
+            wait = bucket.wait_time(now)
+            if wait > 0:
+                heapq.heapreplace(self._ready, (now + wait, next(self._seq), chat_id))
+                continue
+            if not self._global.try_take(now):
+                self._cond.wait(self._global.wait_time(now))
+                continue
+            bucket.try_take(now)
+            heapq.heappop(self._ready)
+            return chat_id
+
+    def _run(self) -> None:
+        """Цикл потока отправки: одновременно в чат отправляется одно сообщение"""
+        while True:
+            with self._cond:
+                chat_id = self._take()
+                fn, args, kwargs, future = self._lanes[chat_id][0]
+            ready_at = monotonic()
+            done = True
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as ex:
+                delay = retry_after(ex)
+                if delay is not None:
+                    done = False
+                    ready_at += delay
+                else:
+                    future.set_exception(ex)
+                    logger.error('Ошибка отправки в Telegram %s: %s', chat_id, ex)
+            with self._cond:
+                lane = self._lanes[chat_id]
+                if done:
+                    lane.popleft()
+                    self.pending -= 1
+                    if future.exception() is None:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                else:
+                    self.retried += 1
+                    if isinstance(chat_id, tuple):
+                        # 429 вне чата - ограничение всего бота
+                        self._global.drain(monotonic())
+                if lane:
+                    heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+                else:
+                    del self._lanes[chat_id]
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Метрики очереди: ожидают отправки, максимум очереди, отправлено, ошибки, повторы после 429"""
+        with self._cond:
+            return {'pending': self.pending, 'max_pending': self.max_pending, 'chats': len(self._lanes),
+                    'sent': self.sent, 'failed': self.failed, 'retried_429': self.retried}
+
+
+# Очередь процесса: ограничения Telegram действуют на весь бот (и в асинхронном режиме)
+QUEUE = SendQueue()
+
+
+class OutboundBot:
+    """
+    Методы отправки TeleBot через очередь: вызов возвращается сразу с Future
+
+    :param bot: TeleBot
+    :param queue: Очередь отправки
+    """
+    def __init__(self, bot, queue: SendQueue):
+        self.bot = bot
+        self.queue = queue
+
+    def send_message(self, chat_id, text, **kwargs) -> Future:
+        return self.queue.submit(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs) -> Future:
+        return self.queue.submit(chat_id, self.bot.edit_message_text, text, chat_id=chat_id,
+                                 message_id=message_id, **kwargs)
+
+    def delete_message(self, chat_id, message_id, **kwargs) -> Future:
+        return self.queue.submit(chat_id, self.bot.delete_message, chat_id, message_id, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs) -> Future:
+        # Ответ на нажатие не относится к чату и идёт отдельной очередью
+        return self.queue.submit(('callback', callback_query_id), self.bot.answer_callback_query,
+                                 callback_query_id, text, **kwargs)
+
+
+class AsyncOutboundBot:
+    """
+    Методы отправки AsyncTeleBot через ту же очередь (те же ограничения скорости и 429):
+    корутина ставит вызов в очередь и ждёт его результат, не блокируя цикл событий
+
+    :param bot: AsyncTeleBot
+    :param queue: Очередь отправки
+    """
+    def __init__(self, bot, queue: SendQueue):
+        self.bot = bot
+        self.queue = queue
+
+    async def _submit(self, key, method, *args, **kwargs):
+        """Ставит вызов корутины method(*args, **kwargs) в очередь и ждёт результат"""
+        loop = asyncio.get_running_loop()
+
+        def call():
+            # Поток отправки выполняет запрос в цикле событий бота и ждёт ответ
+            return asyncio.run_coroutine_threadsafe(method(*args, **kwargs), loop).result()
+
+        try:
+            future = self.queue.submit(key, call, timeout=0)
+        except Full:
+            # Ожидание места в очереди - вне цикла событий
+            future = await loop.run_in_executor(None, partial(self.queue.submit, key, call))
+        return await asyncio.wrap_future(future)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._submit(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self._submit(chat_id, self.bot.edit_message_text, text, chat_id=chat_id,
+                                  message_id=message_id, **kwargs)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        return await self._submit(chat_id, self.bot.delete_message, chat_id, message_id, **kwargs)
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        # Ответ на нажатие не относится к чату и идёт отдельной очередью
+        return await self._submit(('callback', callback_query_id), self.bot.answer_callback_query,
+                                  callback_query_id, text, **kwargs)
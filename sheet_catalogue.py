@@ -0,0 +1,94 @@
+"""
+Каталог листов с датами
+
+Названия листов разбираются один раз при изменении списка листов и хранятся
+отсортированными по дате; выбор листов на ближайшие дни - два bisect по датам.
+"""
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from threading import Lock
+
+from sheet_loader import parse_sheet_date
+
+logger = logging.getLogger(__name__)
+
+
+class SheetCatalogue:
+    """
+    Листы с датами, отсортированные по дате
+
+    :param ignore: Названия листов, которые не являются датами
+    """
+    def __init__(self, ignore=()):
+        self.ignore = frozenset(ignore)
+        # Последний переданный список (тот же объект из кэша не сравнивается заново)
+        self._last = None
+        self._source: tuple[str, ...] = ()
+        self._dates: list[date] = []
+        self._titles: list[str] = []
+        self._by_title: dict[str, date] = {}
+        self._lock = Lock()
+        self.rebuilds = 0
+
+    def update(self, titles: list[str]) -> bool:
+        """
+        Перестраивает каталог, если листы добавили, удалили или переименовали
+
+        :param titles: Названия всех листов таблицы
+        :return: True, если каталог перестроен
+        """
+        if titles is self._last:
+            return False
+        source = tuple(titles)
+        with self._lock:
+            if source == self._source:
+                self._last = titles
+                return False
+        pairs = []
+        for title in source:
+            if title in self.ignore:
+                continue
+            date_sheet = parse_sheet_date(title)
+            if date_sheet is None:
+                logger.warning('%s - Добавьте лист в IGNOR_WORKSHEETS', title)
+                continue
+            pairs.append((date_sheet, title))
+        pairs.sort()
+        with self._lock:
+            self._last = titles
+            self._source = source
+            self._dates = [x[0] for x in pairs]
+            self._titles = [x[1] for x in pairs]
+            self._by_title = {title: date_sheet for date_sheet, title in pairs}
+            self.rebuilds += 1
+        return True
+
+    def __contains__(self, title: str) -> bool:
+        return title in self._by_title
+
+    def __len__(self):
+        return len(self._titles)
+
+    def date_of(self, title: str) -> date | None:
+        """Дата листа (None - листа с такой датой нет)"""
+        return self._by_title.get(title)
+
+    def between(self, first: date, last: date) -> list[str]:
+        """
+        Листы с датами в диапазоне [first, last] по возрастанию даты
+
+        :param first: Первая дата
+        :param last: Последняя дата
+        """
+        with self._lock:
+            return self._titles[bisect_left(self._dates, first):bisect_right(self._dates, last)]
+
+    def next_days(self, date_today: date, count_days=7) -> list[str]:
+        """Листы с датами в диапазоне [date_today, date_today + count_days]"""
+        return self.between(date_today, date_today + timedelta(days=count_days))
+
+    def before(self, day: date) -> list[str]:
+        """Листы с датами раньше day"""
+        with self._lock:
+            return self._titles[:bisect_left(self._dates, day)]
@@ -0,0 +1,64 @@
+"""
+Пакетная загрузка листов с датами одним запросом values:batchGet
+"""
+from datetime import date, datetime
+
+# Формат названия листа с датой
+DATE_FORMAT = '%d.%m.%Y'
+
+
+def parse_sheet_date(title: str) -> date | None:
+    """
+    Преобразует название листа в дату
+
+    :param title: Название листа
+    :return: Дата или None, если лист не является датой
+    """
+    try:
+        return datetime.strptime(title.strip(), DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def sheet_range(title: str) -> str:
+    """Диапазон A1, покрывающий весь лист"""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def row_range(title: str, row: int, first_col='A', last_col='C') -> str:
+    """Диапазон A1 ячеек строки row листа title"""
+    return f'{sheet_range(title)}!{first_col}{row}:{last_col}{row}'
+
+
+def values_to_records(values: list[list]) -> list[dict]:
+    """
+    Преобразует значения листа в записи, как gspread get_all_records()
+
+    :param values: Строки листа, первая строка - заголовки
+    :return: Список словарей {заголовок: значение}
+    """
+    if not values:
+        return []
+    header = [str(x) for x in values[0]]
+    width = len(header)
+    records = []
+    for row in values[1:]:
+        row = list(row[:width]) + [''] * (width - len(row))
+        records.append(dict(zip(header, row)))
+    return records
+
+
+def batch_get_records(spreadsheet, titles: list[str]) -> dict[str, list[dict]]:
+    """
+    Выгружает несколько листов одним запросом values:batchGet
+
+    :param spreadsheet: Таблица (gspread.Spreadsheet)
+    :param titles: Названия листов
+    :return: Словарь {название листа: записи}
+    """
+    if not titles:
+        return {}
+    response = spreadsheet.values_batch_get([sheet_range(x) for x in titles])
+    value_ranges = response.get('valueRanges', [])
+    return {title: values_to_records(value_range.get('values', []))
+            for title, value_range in zip(titles, value_ranges)}
@@ -0,0 +1,245 @@
+"""
+Конкурентный доступ к Google Sheets: блокировки по листам и общий пул потоков
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import ExitStack, contextmanager
+from threading import Condition, Lock
+
+from metrics import DEADLINE_EXCEEDED
+from resilience import BREAKER, DeadlineExceeded, remaining
+from sheets_quota import QUOTA
+
+# Количество потоков общего пула запросов к Google Sheets
+SHEETS_WORKERS = 8
+
+
+class RWLock:
+    """
+    Блокировка чтения/записи листа.
+    Чтения идут параллельно, записи - по одной в порядке поступления,
+    ожидающая запись не пропускает вперёд новые чтения.
+    """
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        # Номера записей: выданные и тот, чья очередь
+        self._issued = 0
+        self._serving = 0
+        self.waiting = 0
+
+    @contextmanager
+    def read(self):
+        """Захват на чтение"""
+        with self._cond:
+            self.waiting += 1
+            self._cond.wait_for(lambda: not self._writer and self._serving == self._issued)
+            self.waiting -= 1
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Захват на запись (записи выполняются в порядке очереди)"""
+        with self._cond:
+            ticket = self._issued
+            self._issued += 1
+            self.waiting += 1
+            self._cond.wait_for(lambda: self._serving == ticket and not self._writer and self._readers == 0)
+            self.waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._serving += 1
+                self._cond.notify_all()
+
+
+class WorksheetLocks:
+    """Блокировки чтения/записи, создаваемые по названию листа"""
+    def __init__(self):
+        self._locks: dict[str, RWLock] = {}
+        self._lock = Lock()
+
+    def get(self, title: str) -> RWLock:
+        """Блокировка листа title"""
+        with self._lock:
+            if title not in self._locks:
+                self._locks[title] = RWLock()
+            return self._locks[title]
+
+    def read(self, title: str):
+        """Захват листа на чтение"""
+        return self.get(title).read()
+
+    def write(self, title: str):
+        """Захват листа на запись"""
+        return self.get(title).write()
+
+    @contextmanager
+    def read_many(self, titles):
+        """Захват нескольких листов на чтение (в порядке сортировки названий)"""
+        with ExitStack() as stack:
+            for title in sorted(set(titles)):
+                stack.enter_context(self.read(title))
+            yield
+
+    def waiting(self) -> int:
+        """Количество потоков, ожидающих блокировки листов"""
+        with self._lock:
+            return sum(x.waiting for x in self._locks.values())
+
+
+class SheetsExecutor:
+    """
+    Долгоживущий пул потоков для запросов к Google Sheets со счётчиками очереди
+
+    :param max_workers: Количество потоков
+    """
+    def __init__(self, max_workers=SHEETS_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='sheets')
+        self._lock = Lock()
+        self.queued = 0
+        self.active = 0
+        self.max_queued = 0
+        self.completed = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Ставит вызов fn(*args, **kwargs) в очередь пула"""
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        return self._executor.submit(run)
+
+    def map(self, fn, iterable) -> list:
+        """Параллельный map с ожиданием всех результатов"""
+        futures = [self.submit(fn, x) for x in iterable]
+        return [x.result() for x in futures]
+
+    def shutdown(self, wait=True) -> None:
+        """Останавливает пул"""
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        """Метрики очереди пула"""
+        with self._lock:
+            return {'workers': self.max_workers, 'queued': self.queued, 'active': self.active,
+                    'max_queued': self.max_queued, 'completed': self.completed}
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов: первый вызов с ключом
+    выполняет запрос, остальные ждут и получают его результат (или исключение).
+    Ожидание ограничено дедлайном запроса (resilience.deadline).
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: dict[object, Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) или ждёт уже выполняющийся вызов с тем же ключом
+
+        :param key: Ключ запроса (например, лист и диапазон)
+        :param fn: Функция запроса
+        :return: Результат fn
+        :raises DeadlineExceeded: Дедлайн истёк, пока ждали чужой вызов
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            try:
+                return call.result(timeout=remaining())
+            except FutureTimeout:
+                if call.done():
+                    # Таймаут самого запроса, а не ожидания
+                    raise
+                DEADLINE_EXCEEDED.inc(function='single_flight')
+                raise DeadlineExceeded(f'{key!r}: deadline exceeded') from None
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as ex:
+            call.set_exception(ex)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.executed += 1
+
+    def stats(self) -> dict:
+        """Выполненные запросы, объединённые с ними вызовы и запросы в работе"""
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+
+# Блокировки листов таблицы
+LOCKS = WorksheetLocks()
+# Объединение одинаковых одновременных чтений
+FLIGHTS = SingleFlight()
+_executor: SheetsExecutor | None = None
+_executor_lock = Lock()
+
+
+def get_executor() -> SheetsExecutor:
+    """Общий пул запросов к Google Sheets (создаётся при первом обращении)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = SheetsExecutor(SHEETS_WORKERS)
+        return _executor
+
+
+def configure(max_workers: int) -> None:
+    """
+    Меняет размер общего пула. Текущий пул дорабатывает поставленные задачи.
+
+    :param max_workers: Количество потоков
+    """
+    global _executor, SHEETS_WORKERS
+    with _executor_lock:
+        SHEETS_WORKERS = max_workers
+        old, _executor = _executor, SheetsExecutor(max_workers)
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def stats() -> dict:
+    """Метрики пула, ожидания блокировок листов, расхода квот, объединения запросов и выключателя"""
+    result = get_executor().stats()
+    result['lock_waiting'] = LOCKS.waiting()
+    result['quota'] = QUOTA.stats()
+    result['single_flight'] = FLIGHTS.stats()
+    result['circuit'] = BREAKER.stats()
+    return result
@@ -0,0 +1,176 @@
+"""
+Планировщик запросов к Google Sheets с учётом квот
+
+Каждый запрос берёт токен из корзины своего вида (чтение/запись), пополняемой
+со скоростью квоты. При нехватке токенов запросы ждут в очереди по приоритету:
+записи и отмены обслуживаются раньше чтений, фоновые чтения - последними.
+"""
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from threading import Condition, Lock
+from time import monotonic
+
+# Квоты Google Sheets API на пользователя (сервисный аккаунт) в минуту
+READ_QUOTA_PER_MINUTE = 60
+WRITE_QUOTA_PER_MINUTE = 60
+# Доля квоты, которую разрешено израсходовать разом (размер корзины)
+QUOTA_BURST = 0.25
+
+READ = 'read'
+WRITE = 'write'
+
+# Приоритеты (меньше - раньше)
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_BACKGROUND = 2
+
+_priority: ContextVar[int] = ContextVar('sheets_priority', default=PRIORITY_READ)
+
+
+class QuotaTimeout(TimeoutError):
+    """Токен квоты не получен за отведённое время"""
+
+
+class TokenBucket:
+    """
+    Корзина токенов (вызывается под блокировкой планировщика)
+
+    :param per_minute: Скорость пополнения (токенов в минуту)
+    :param capacity: Размер корзины
+    """
+    def __init__(self, per_minute: float, capacity: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self._updated = monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, now: float) -> bool:
+        """Забирает токен, если он есть"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: float) -> float:
+        """Секунды до появления токена"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def drain(self, now: float) -> None:
+        """Обнуляет корзину (после ответа 429)"""
+        self._refill(now)
+        self.tokens = 0.0
+
+
+class QuotaScheduler:
+    """
+    Очереди запросов с приоритетом перед корзинами квот
+
+    :param read_per_minute: Квота чтений в минуту
+    :param write_per_minute: Квота записей в минуту
+    :param burst: Доля квоты, доступная разом
+    """
+    def __init__(self, read_per_minute=READ_QUOTA_PER_MINUTE, write_per_minute=WRITE_QUOTA_PER_MINUTE,
+                 burst=QUOTA_BURST):
+        self._cond = Condition(Lock())
+        self._buckets = {READ: TokenBucket(read_per_minute, read_per_minute * burst),
+                         WRITE: TokenBucket(write_per_minute, write_per_minute * burst)}
+        self._queues: dict[str, list[tuple[int, int]]] = {READ: [], WRITE: []}
+        self._seq = count()
+        self._metrics = {kind: {'granted': 0, 'throttled': 0, 'timeouts': 0, 'rejected_429': 0,
+                                'wait_total': 0.0, 'wait_max': 0.0}
+                         for kind in self._buckets}
+
+    def acquire(self, kind: str, priority: int | None = None, timeout: float | None = None) -> float:
+        """
+        Ждёт токен квоты kind в порядке приоритета
+
+        :param kind: READ или WRITE
+        :param priority: Приоритет (по умолчанию - текущий, см. priority())
+        :param timeout: Максимальное ожидание в секундах
+        :return: Время ожидания в секундах
+        """
+        if priority is None:
+            priority = _priority.get()
+        queue = self._queues[kind]
+        start = monotonic()
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    now = monotonic()
+                    bucket = self._buckets[kind]
+                    if queue[0] == entry and bucket.try_take(now):
+                        break
+                    wait = bucket.wait_time(now) if queue[0] == entry else None
+                    if timeout is not None:
+                        left = start + timeout - now
+                        if left <= 0:
+                            self._metrics[kind]['timeouts'] += 1
+                            raise QuotaTimeout(f'Sheets {kind} quota: no token in {timeout} s')
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(wait)
+            finally:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+            waited = monotonic() - start
+            metrics = self._metrics[kind]
+            metrics['granted'] += 1
+            if waited > 0.001:
+                metrics['throttled'] += 1
+            metrics['wait_total'] += waited
+            metrics['wait_max'] = max(metrics['wait_max'], waited)
+        return waited
+
+    def configure(self, read_per_minute=READ_QUOTA_PER_MINUTE, write_per_minute=WRITE_QUOTA_PER_MINUTE,
+                  burst=QUOTA_BURST) -> None:
+        """
+        Меняет квоты (корзины создаются заново полными)
+
+        :param read_per_minute: Квота чтений в минуту
+        :param write_per_minute: Квота записей в минуту
+        :param burst: Доля квоты, доступная разом
+        """
+        with self._cond:
+            self._buckets = {READ: TokenBucket(read_per_minute, read_per_minute * burst),
+                             WRITE: TokenBucket(write_per_minute, write_per_minute * burst)}
+            self._cond.notify_all()
+
+    def penalize(self, kind: str) -> None:
+        """Обнуляет корзину kind после ответа 429 от API"""
+        with self._cond:
+            self._buckets[kind].drain(monotonic())
+            self._metrics[kind]['rejected_429'] += 1
+
+    def stats(self) -> dict:
+        """Метрики квот: выданные токены, ожидание, очередь и остаток корзины"""
+        with self._cond:
+            now = monotonic()
+            result = {}
+            for kind, bucket in self._buckets.items():
+                bucket._refill(now)
+                result[kind] = dict(self._metrics[kind], queued=len(self._queues[kind]),
+                                    tokens=round(bucket.tokens, 2), per_minute=bucket.rate * 60)
+            return result
+
+
+@contextmanager
+def priority(value: int):
+    """Приоритет запросов к Google Sheets внутри блока (например, PRIORITY_BACKGROUND)"""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+QUOTA = QuotaScheduler()
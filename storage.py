@@ -0,0 +1,437 @@
+"""
+Хранилища расписания: Google Sheets и локальная SQLite-копия с синхронизацией
+"""
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from time import sleep, time
+
+from gspread.exceptions import APIError
+
+from metrics import SHEETS_ERRORS, SHEETS_QUOTA_WAIT, SHEETS_SECONDS
+from resilience import BREAKER, is_transient, remaining
+from sheet_loader import batch_get_records, parse_sheet_date, row_range
+from sheets_pool import LOCKS
+from sheets_quota import PRIORITY_BACKGROUND, PRIORITY_WRITE, QUOTA, READ, WRITE, priority
+
+logger = logging.getLogger(__name__)
+
+# Колонки листа с датой (очередность важна!)
+DAY_COLUMNS = ('Время', 'Психолог', 'Клиент')
+
+
+class ScheduleStorage(ABC):
+    """Интерфейс хранилища расписания, через которое работает GoogleSheets"""
+
+    @abstractmethod
+    def titles(self) -> list[str]:
+        """Названия всех листов"""
+
+    @abstractmethod
+    def read_locations(self, sheet: str) -> list[dict]:
+        """
+        Записи листа с локациями и психологами
+
+        :param sheet: Название листа
+        """
+
+    @abstractmethod
+    def read_days(self, titles: list[str]) -> dict[str, list[dict]]:
+        """
+        Записи листов с датами (позиция записи = номер строки - 2)
+
+        :param titles: Названия листов
+        :return: Словарь {название листа: записи}
+        """
+
+    @abstractmethod
+    def write_client(self, title: str, row: int, expected: list[str], client: str) -> list[str] | None:
+        """
+        Условная запись клиента в строку листа с датой
+
+        :param title: Название листа (дата)
+        :param row: Номер строки
+        :param expected: Ожидаемые значения строки [Время, Психолог, Клиент]
+        :param client: Новое значение колонки 'Клиент'
+        :return: None при успехе, иначе фактические значения строки
+        """
+
+
+def _normalize_row(row: list) -> list[str]:
+    """Значения строки [Время, Психолог, Клиент] без пробелов по краям"""
+    row = [str(x).strip() for x in row[:len(DAY_COLUMNS)]]
+    return row + [''] * (len(DAY_COLUMNS) - len(row))
+
+
+class SheetsStorage(ScheduleStorage):
+    """
+    Хранилище в Google Sheets
+
+    :param spreadsheet: Таблица (gspread.Spreadsheet)
+    """
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    @staticmethod
+    def _request(kind: str, fn, *args, **kwargs):
+        """
+        Запрос к API после получения токена квоты kind (ожидание ограничено дедлайном)
+        через выключатель BREAKER
+        """
+        SHEETS_QUOTA_WAIT.observe(QUOTA.acquire(kind, timeout=remaining()), kind=kind)
+        BREAKER.before()
+        method = fn.__name__
+        try:
+            with SHEETS_SECONDS.time(method=method):
+                result = fn(*args, **kwargs)
+        except Exception as ex:
+            SHEETS_ERRORS.inc(method=method)
+            if getattr(getattr(ex, 'response', None), 'status_code', None) == 429:
+                QUOTA.penalize(kind)
+            if is_transient(ex):
+                BREAKER.failure()
+            else:
+                # Ответ получен - таблица доступна
+                BREAKER.success()
+            raise
+        BREAKER.success()
+        return result
+
+    def titles(self) -> list[str]:
+        return [x.title for x in self._request(READ, self.spreadsheet.worksheets)]
+
+    def read_locations(self, sheet: str) -> list[dict]:
+        with LOCKS.read(sheet):
+            return self._request(READ, batch_get_records, self.spreadsheet, [sheet])[sheet]
+
+    def read_days(self, titles: list[str]) -> dict[str, list[dict]]:
+        if not titles:
+            return {}
+        with LOCKS.read_many(titles):
+            return self._request(READ, batch_get_records, self.spreadsheet, titles)
+
+    def write_client(self, title: str, row: int, expected: list[str], client: str) -> list[str] | None:
+        # Запись и проверочное чтение обслуживаются раньше чтений расписания
+        with LOCKS.write(title), priority(PRIORITY_WRITE):
+            values = self._request(READ, self.spreadsheet.values_get, row_range(title, row)).get('values', [[]])
+            actual = _normalize_row(values[0] if values else [])
+            if actual != _normalize_row(expected):
+                return actual
+            self._request(WRITE, self.spreadsheet.values_update, row_range(title, row, 'C', 'C'),
+                          params={'valueInputOption': 'RAW'},
+                          body={'values': [[client]]})
+        return None
+
+    def archive(self, title: str, archive) -> None:
+        """
+        Переносит лист в архивную таблицу: копия под тем же названием, затем удаление
+
+        :param title: Название листа
+        :param archive: Архивная таблица (gspread.Spreadsheet)
+        """
+        with LOCKS.write(title), priority(PRIORITY_BACKGROUND):
+            worksheet = self._request(READ, self.spreadsheet.worksheet, title)
+            copy = self._request(WRITE, worksheet.copy_to, archive.id)
+            # Копия называется 'Copy of ...' - возвращаем исходное название
+            self._request(WRITE, archive.batch_update, {'requests': [{'updateSheetProperties': {
+                'properties': {'sheetId': copy['sheetId'], 'title': title}, 'fields': 'title'}}]})
+            self._request(WRITE, self.spreadsheet.del_worksheet, worksheet)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    title TEXT PRIMARY KEY,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS locations (
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    psychologist TEXT NOT NULL,
+    PRIMARY KEY (sheet, row)
+);
+CREATE TABLE IF NOT EXISTS slots (
+    title TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    psychologist TEXT NOT NULL,
+    client TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (title, row)
+);
+-- Психолог не может быть записан дважды на одно время одной даты
+CREATE UNIQUE INDEX IF NOT EXISTS slots_booked ON slots (title, time, psychologist) WHERE client != '';
+CREATE INDEX IF NOT EXISTS slots_client ON slots (client) WHERE client != '';
+-- Записи/отмены, ещё не отправленные в Google Sheets
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    psychologist TEXT NOT NULL,
+    old_client TEXT NOT NULL,
+    client TEXT NOT NULL
+);
+-- Записи, которые не удалось перенести в Google Sheets (строку изменили в таблице)
+CREATE TABLE IF NOT EXISTS sync_conflicts (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    psychologist TEXT NOT NULL,
+    client TEXT NOT NULL,
+    actual TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(ScheduleStorage):
+    """
+    Локальное хранилище SQLite. Запись клиента - транзакция с условием на строку
+    и уникальным индексом занятых слотов; изменения копятся в outbox для синхронизации.
+
+    :param path: Путь к файлу базы
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._lock = Lock()
+
+    def titles(self) -> list[str]:
+        with self._lock:
+            return [x[0] for x in self._conn.execute('SELECT title FROM sheets ORDER BY rowid')]
+
+    def read_locations(self, sheet: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute('SELECT location, psychologist FROM locations WHERE sheet = ? ORDER BY row',
+                                      (sheet,)).fetchall()
+        return [{'Локация': location, 'Психолог': psychologist} for location, psychologist in rows]
+
+    def read_days(self, titles: list[str]) -> dict[str, list[dict]]:
+        result = {}
+        with self._lock:
+            for title in titles:
+                rows = self._conn.execute('SELECT row, time, psychologist, client FROM slots '
+                                          'WHERE title = ? ORDER BY row', (title,)).fetchall()
+                records = []
+                for row, *values in rows:
+                    # Пропуски в нумерации - пустые строки листа
+                    records.extend(dict.fromkeys(DAY_COLUMNS, '') for _ in range(row - 2 - len(records)))
+                    records.append(dict(zip(DAY_COLUMNS, values)))
+                result[title] = records
+        return result
+
+    def write_client(self, title: str, row: int, expected: list[str], client: str) -> list[str] | None:
+        time_str, psychologist, old_client = _normalize_row(expected)
+        with self._lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                updated = self._conn.execute(
+                    'UPDATE slots SET client = ? WHERE title = ? AND row = ? '
+                    'AND time = ? AND psychologist = ? AND client = ?',
+                    (client.strip(), title, row, time_str, psychologist, old_client)).rowcount
+                if updated:
+                    self._conn.execute('INSERT INTO outbox (title, row, time, psychologist, old_client, client) '
+                                       'VALUES (?, ?, ?, ?, ?, ?)',
+                                       (title, row, time_str, psychologist, old_client, client))
+                self._conn.execute('COMMIT')
+            except sqlite3.IntegrityError:
+                # Психолог уже записан на это время в другой строке
+                self._conn.execute('ROLLBACK')
+                other = self._conn.execute("SELECT client FROM slots WHERE title = ? AND time = ? "
+                                           "AND psychologist = ? AND client != ''",
+                                           (title, time_str, psychologist)).fetchone()
+                return [time_str, psychologist, other[0] if other else '']
+            if updated:
+                return None
+            actual = self._conn.execute('SELECT time, psychologist, client FROM slots WHERE title = ? AND row = ?',
+                                        (title, row)).fetchone()
+        return list(actual) if actual else ['', '', '']
+
+    def pending(self) -> list[tuple]:
+        """Неотправленные изменения: (id, title, row, time, psychologist, old_client, client)"""
+        with self._lock:
+            return self._conn.execute('SELECT id, title, row, time, psychologist, old_client, client '
+                                      'FROM outbox ORDER BY id').fetchall()
+
+    def ack(self, outbox_id: int) -> None:
+        """Удаляет отправленное изменение из outbox"""
+        with self._lock:
+            self._conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+
+    def reject(self, outbox_id: int, actual: list[str]) -> None:
+        """
+        Переносит изменение из outbox в sync_conflicts (таблица не приняла его)
+
+        :param outbox_id: id изменения
+        :param actual: Фактические значения строки в таблице
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('INSERT INTO sync_conflicts (id, title, row, time, psychologist, client, actual) '
+                               'SELECT id, title, row, time, psychologist, client, ? FROM outbox WHERE id = ?',
+                               (' | '.join(actual), outbox_id))
+            self._conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+            self._conn.execute('COMMIT')
+
+    def rejected(self) -> list[tuple]:
+        """Изменения, не принятые таблицей: (id, title, row, time, psychologist, client, actual)"""
+        with self._lock:
+            return self._conn.execute('SELECT id, title, row, time, psychologist, client, actual '
+                                      'FROM sync_conflicts ORDER BY id').fetchall()
+
+    def replace_titles(self, titles: list[str]) -> None:
+        """Заменяет список листов"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM sheets')
+            self._conn.executemany('INSERT INTO sheets (title, date) VALUES (?, ?)',
+                                   [(x, str(parse_sheet_date(x) or '')) for x in titles])
+            self._conn.execute('COMMIT')
+
+    def replace_locations(self, sheet: str, records: list[dict]) -> None:
+        """Заменяет записи листа с локациями"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM locations WHERE sheet = ?', (sheet,))
+            self._conn.executemany('INSERT INTO locations (sheet, row, location, psychologist) VALUES (?, ?, ?, ?)',
+                                   [(sheet, row, str(x.get('Локация', '')).strip(),
+                                     str(x.get('Психолог', '')).strip())
+                                    for row, x in enumerate(records, start=2)])
+            self._conn.execute('COMMIT')
+
+    def replace_days(self, schedule: dict[str, list[dict]]) -> None:
+        """
+        Заменяет листы с датами данными из таблицы; листы, которых нет в выгрузке
+        (удалённые или прошедшие), удаляются.
+        Строки с неотправленными изменениями сохраняют локальное значение клиента.
+
+        :param schedule: Словарь {название листа: записи}
+        """
+        with self._lock:
+            pending = {(title, row): client for title, row, client in
+                       self._conn.execute('SELECT title, row, client FROM outbox ORDER BY id')}
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                stored = [x[0] for x in self._conn.execute('SELECT DISTINCT title FROM slots')]
+                self._conn.executemany('DELETE FROM slots WHERE title = ?',
+                                       [(x,) for x in stored if x not in schedule])
+                for title, records in schedule.items():
+                    self._conn.execute('DELETE FROM slots WHERE title = ?', (title,))
+                    rows = []
+                    booked = set()
+                    for row, record in enumerate(records, start=2):
+                        time_str, psychologist, client = _normalize_row([record.get(x, '') for x in DAY_COLUMNS])
+                        client = pending.get((title, row), client).strip()
+                        if client and (time_str, psychologist) in booked:
+                            logger.error('%s %s - Двойная запись в таблице, строка пропущена', title, row)
+                            continue
+                        if client:
+                            booked.add((time_str, psychologist))
+                        rows.append((title, row, time_str, psychologist, client))
+                    self._conn.executemany('INSERT INTO slots (title, row, time, psychologist, client) '
+                                           'VALUES (?, ?, ?, ?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+
+
+class StorageSync:
+    """
+    Синхронизация SQLite с Google Sheets: отправка outbox и загрузка правок администраторов
+
+    :param local: Локальное хранилище
+    :param remote: Хранилище в Google Sheets
+    :param locations_sheet: Лист с локациями и психологами
+    :param ignore: Листы, которые не являются датами
+    :param period: Период синхронизации в секундах
+    :param on_conflict: Уведомление о записи клиента, которую таблица не приняла:
+        on_conflict(title, time, psychologist, client)
+    :param tz: Временная зона расписания (None - локальное время сервера)
+    """
+    def __init__(self, local: SQLiteStorage, remote: SheetsStorage, locations_sheet: str,
+                 ignore=(), period=60, on_conflict=None, tz=None):
+        self.local = local
+        self.tz = tz
+        self.on_conflict = on_conflict
+        self.remote = remote
+        self.locations_sheet = locations_sheet
+        self.ignore = ignore
+        self.period = period
+        self.last_sync = None
+        self.conflicts = 0
+        self._thread = None
+        self._lock = Lock()
+
+    def push(self) -> int:
+        """
+        Отправляет записи/отмены в Google Sheets
+
+        :return: Количество отправленных изменений
+        """
+        sent = 0
+        for outbox_id, title, row, time_str, psychologist, old_client, client in self.local.pending():
+            try:
+                actual = self.remote.write_client(title, row, [time_str, psychologist, old_client], client)
+            except APIError as ex:
+                if getattr(ex.response, 'status_code', None) != 400:
+                    raise
+                # Лист удалили из таблицы
+                actual = ['', '', '']
+            if actual is not None and actual != _normalize_row([time_str, psychologist, client]):
+                # Строку изменил администратор - побеждает таблица, локальная копия перезагрузится,
+                # а изменение сохраняется в sync_conflicts
+                self.conflicts += 1
+                self.local.reject(outbox_id, actual)
+                logger.error('%s %s %s - Конфликт синхронизации, запись %r не попала в таблицу',
+                             title, row, actual, client)
+                if client.strip() and self.on_conflict is not None:
+                    self._notify(title, time_str, psychologist, client)
+                continue
+            self.local.ack(outbox_id)
+            sent += 1
+        return sent
+
+    def _notify(self, title: str, time_str: str, psychologist: str, client: str) -> None:
+        """Сообщает о записи, которую таблица не приняла (ошибка уведомления не останавливает синхронизацию)"""
+        try:
+            self.on_conflict(title, time_str, psychologist, client)
+        except Exception:
+            logger.exception('%s %s - Не удалось сообщить клиенту о конфликте записи', title, time_str)
+
+    @priority(PRIORITY_BACKGROUND)
+    def pull(self) -> None:
+        """Загружает листы из Google Sheets в SQLite"""
+        titles = self.remote.titles()
+        self.local.replace_titles(titles)
+        self.local.replace_locations(self.locations_sheet, self.remote.read_locations(self.locations_sheet))
+        yesterday = datetime.now(tz=self.tz).date() - timedelta(days=1)
+        days = [x for x in titles
+                if x not in self.ignore and (parse_sheet_date(x) or yesterday) > yesterday]
+        self.local.replace_days(self.remote.read_days(days))
+
+    def sync_once(self) -> None:
+        """Один цикл синхронизации: сначала outbox, затем загрузка таблицы"""
+        with self._lock:
+            self.push()
+            self.pull()
+            self.last_sync = time()
+
+    def run(self) -> None:
+        """Цикл синхронизации"""
+        while True:
+            sleep(self.period)
+            try:
+                self.sync_once()
+            except Exception:
+                logger.exception('Ошибка синхронизации SQLite с Google Sheets')
+
+    def start(self) -> None:
+        """Запускает синхронизацию в фоновом потоке"""
+        if self._thread is None:
+            self._thread = Thread(target=self.run, daemon=True)
+            self._thread.start()
@@ -0,0 +1,110 @@
+"""
+Кэш загрузок из Google Sheets с отдачей устаревших значений (stale-while-revalidate)
+
+Значение свежо ttl секунд, затем ещё grace секунд отдаётся без ожидания, а первое
+обращение к устаревшему значению ставит одно фоновое обновление в пул запросов.
+Пользователь ждёт загрузку, только если значения нет или оно старше ttl + grace.
+"""
+import logging
+from threading import Lock
+from time import monotonic
+
+from metrics import cache_lookup
+from sheets_pool import get_executor
+from sheets_quota import PRIORITY_BACKGROUND, priority
+
+logger = logging.getLogger(__name__)
+
+
+class RevalidatingCache:
+    """
+    Значения по именам
+
+    :param ttl: Время свежести значения в секундах
+    :param grace: Сколько секунд после ttl значение ещё отдаётся, пока идёт обновление
+    :param name: Имя кэша - метка метрики cache_requests_total (имена значений в метки
+        не попадают: они бывают динамическими, например месяц)
+    """
+    def __init__(self, ttl: float, grace: float, name: str):
+        self.ttl = ttl
+        self.name = name
+        self.grace = grace
+        # Имя -> (значение, время сохранения)
+        self._entries: dict[str, tuple[object, float]] = {}
+        self._refreshing: set[str] = set()
+        self._lock = Lock()
+        self.revalidated = 0
+        self.revalidate_errors = 0
+
+    def __contains__(self, key: str) -> bool:
+        """Значение можно отдать без ожидания (свежее или в пределах grace)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and monotonic() - entry[1] < self.ttl + self.grace
+
+    def get(self, key: str, loader, *args):
+        """
+        Значение из кэша; устаревшее отдаётся сразу и обновляется в фоне
+
+        :param key: Имя значения
+        :param loader: Функция загрузки loader(*args)
+        :return: Значение
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = None if entry is None else now - entry[1]
+            stale = age is not None and self.ttl <= age < self.ttl + self.grace
+            if stale and key not in self._refreshing:
+                self._refreshing.add(key)
+                get_executor().submit(self._revalidate, key, loader, args)
+        if age is not None and age < self.ttl + self.grace:
+            cache_lookup(self.name, age < self.ttl, stale)
+            return entry[0]
+        cache_lookup(self.name, False)
+        value = loader(*args)
+        self.put(key, value)
+        return value
+
+    def _revalidate(self, key: str, loader, args: tuple) -> None:
+        """Фоновое обновление значения (фоновый приоритет квоты)"""
+        try:
+            with priority(PRIORITY_BACKGROUND):
+                self.put(key, loader(*args))
+            self.revalidated += 1
+        except Exception as ex:
+            self.revalidate_errors += 1
+            logger.warning('%s - ошибка фонового обновления, отдаётся прежнее значение: %r', key, ex)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def age(self, key: str) -> float | None:
+        """Секунды с сохранения значения (None - значения нет)"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else monotonic() - entry[1]
+
+    def put(self, key: str, value) -> None:
+        """Сохраняет свежее значение"""
+        with self._lock:
+            self._entries[key] = (value, monotonic())
+
+    def pop(self, key: str, default=None):
+        """Удаляет значение (следующее обращение загрузит его заново)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        """Удаляет все значения"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Возраст значений в секундах, фоновые обновления и их ошибки"""
+        now = monotonic()
+        with self._lock:
+            return {'age': {key: now - entry[1] for key, entry in self._entries.items()},
+                    'refreshing': sorted(self._refreshing), 'revalidated': self.revalidated,
+                    'revalidate_errors': self.revalidate_errors}
@@ -3,6 +3,7 @@
 """
 import datetime
 import calendar
+import functools
 import typing
 
 from telebot import TeleBot
@@ -23,6 +24,8 @@ MONTHS = (
     "Декабрь",
 )
 DAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+# Количество готовых клавиатур календаря в кэше (LRU)
+CALENDAR_CACHE_SIZE = 512
 
 
 class CallbackData:
@@ -126,6 +129,36 @@ class CallbackData:
         return True
 
 
+def available_days_mask(lst_current_date, year: int, month: int) -> int:
+    """
+    Битовая маска доступных дней месяца (бит N - день N)
+
+    :param lst_current_date: Доступные даты в формате datetime.date
+    :param year: Год
+    :param month: Месяц
+    """
+    mask = 0
+    for date in lst_current_date or ():
+        if date.month == month and date.year == year:
+            mask |= 1 << date.day
+    return mask
+
+
+class RenderedMarkup(InlineKeyboardMarkup):
+    """
+    Готовая клавиатура с заранее сериализованным JSON.
+    Объект общий для всех пользователей из кэша и не должен изменяться.
+    """
+
+    def __init__(self, keyboard: InlineKeyboardMarkup):
+        super().__init__(row_width=keyboard.row_width)
+        self.keyboard = keyboard.keyboard
+        self._json = keyboard.to_json()
+
+    def to_json(self):
+        return self._json
+
+
 def create_calendar(lst_current_date: list[datetime.date], name: str = "calendar", year: int = None, month: int = None,
                     ) -> InlineKeyboardMarkup:
     """
@@ -135,7 +168,7 @@ def create_calendar(lst_current_date: list[datetime.date], name: str = "calendar
     :param name: Имя календаря
     :param year: Год используемый календарём, если не используете текущий год.
     :param month: Месяц используемый календарём, если не используете текущий месяц.
-    :return: Возвращает объект InlineKeyboardMarkup с календарём.
+    :return: Возвращает объект InlineKeyboardMarkup с календарём (из кэша, не изменять).
     """
 
     now_day = datetime.datetime.now()
@@ -145,6 +178,16 @@ def create_calendar(lst_current_date: list[datetime.date], name: str = "calendar
     if month is None:
         month = now_day.month
 
+    return _render_calendar(name, year, month, available_days_mask(lst_current_date, year, month))
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _render_calendar(name: str, year: int, month: int, mask: int) -> RenderedMarkup:
+    """
+    Строит календарь месяца (кэшируется по имени, месяцу и маске доступных дней)
+
+    :param mask: Битовая маска доступных дней (available_days_mask)
+    """
     calendar_callback = CallbackData(name, "action", "year", "month", "day")
     data_ignore = calendar_callback.new("IGNORE", year, month, "!")
     data_months = calendar_callback.new("MONTHS", year, month, "!")
@@ -168,7 +211,7 @@ def create_calendar(lst_current_date: list[datetime.date], name: str = "calendar
                 row.append(InlineKeyboardButton(
                     " ", callback_data=data_ignore))
             else:
-                if datetime.date(year, month, day) in lst_current_date:
+                if mask >> day & 1:
                     row.append(
                         InlineKeyboardButton(
                             str(day) + '✅',
@@ -201,14 +244,14 @@ def create_calendar(lst_current_date: list[datetime.date], name: str = "calendar
         ),
     )
 
-    return keyboard
+    return RenderedMarkup(keyboard)
 
 
 def create_months_calendar(
         name: str = "calendar", year: int = None
 ) -> InlineKeyboardMarkup:
     """
-    Создаёт календарь из месяцев
+    Создаёт календарь из месяцев (из кэша, не изменять)
 
     param name:
     param year:
@@ -218,6 +261,12 @@ def create_months_calendar(
     if year is None:
         year = datetime.datetime.now().year
 
+    return _render_months_calendar(name, year)
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _render_months_calendar(name: str, year: int) -> RenderedMarkup:
+    """Строит календарь из месяцев (кэшируется по имени и году)"""
     calendar_callback = CallbackData(name, "action", "year", "month", "day")
 
     keyboard = InlineKeyboardMarkup()
@@ -234,7 +283,55 @@ def create_months_calendar(
                     "MONTH", year, 2 * i + 2, "!"),
             ),
         )
-    return keyboard
+    return RenderedMarkup(keyboard)
+
+
+def calendar_cache_info() -> dict:
+    """Статистика кэша календарей (попадания, промахи, размер)"""
+    return {'calendar': _render_calendar.cache_info()._asdict(),
+            'months': _render_months_calendar.cache_info()._asdict()}
+
+
+def navigation_month(action: str, year: int, month: int) -> tuple[int, int] | None:
+    """
+    Месяц, который покажет календарь после навигации
+
+    :param action: Действие из callback-данных
+    :param year: Год из callback-данных
+    :param month: Месяц из callback-данных
+    :return: (год, месяц) или None, если действие не открывает календарь месяца
+    """
+    current = datetime.datetime(int(year), int(month), 1)
+    if action == "PREVIOUS-MONTH":
+        preview_month = current - datetime.timedelta(days=1)
+        return preview_month.year, preview_month.month
+    if action == "NEXT-MONTH":
+        next_month = current + datetime.timedelta(days=31)
+        return next_month.year, next_month.month
+    if action == "MONTH":
+        return current.year, current.month
+    return None
+
+
+def navigation_markup(name: str, action: str, year: int, month: int,
+                      lst_currant_date: list) -> InlineKeyboardMarkup | None:
+    """
+    Клавиатура, которую нужно показать при навигации по календарю
+
+    :param name: Имя календаря
+    :param action: Действие из callback-данных
+    :param year: Год из callback-данных
+    :param month: Месяц из callback-данных
+    :param lst_currant_date: Список доступных дат для записи в формате date
+        (для месяца navigation_month)
+    :return: InlineKeyboardMarkup или None, если действие не является навигацией
+    """
+    if action == "MONTHS":
+        return create_months_calendar(name=name, year=int(year))
+    target = navigation_month(action, year, month)
+    if target is None:
+        return None
+    return create_calendar(name=name, year=target[0], month=target[1], lst_current_date=lst_currant_date)
 
 
 def calendar_query_handler(
@@ -263,7 +360,6 @@ def calendar_query_handler(
     :return: Returns a tuple
     """
 
-    current = datetime.datetime(int(year), int(month), 1)
     if action == "IGNORE":
         bot.answer_callback_query(callback_query_id=call.id, text='Тут ничего нет')
         return False, None
@@ -272,46 +368,12 @@ def calendar_query_handler(
         return False, None
     elif action == "DAY":
         return datetime.datetime(int(year), int(month), int(day))
-    elif action == "PREVIOUS-MONTH":
-        preview_month = current - datetime.timedelta(days=1)
-        bot.edit_message_text(
-            text=call.message.text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_calendar(
-                name=name, year=int(preview_month.year), month=int(preview_month.month),
-                lst_current_date=lst_currant_date
-            ),
-        )
-        return None
-    elif action == "NEXT-MONTH":
-        next_month = current + datetime.timedelta(days=31)
-        bot.edit_message_text(
-            text=call.message.text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_calendar(
-                name=name, year=int(next_month.year), month=int(next_month.month),
-                lst_current_date=lst_currant_date
-            ),
-        )
-        return None
-    elif action == "MONTHS":
-        bot.edit_message_text(
-            text=call.message.text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_months_calendar(name=name, year=current.year),
-        )
-        return None
-    elif action == "MONTH":
+    elif action in ("PREVIOUS-MONTH", "NEXT-MONTH", "MONTHS", "MONTH"):
         bot.edit_message_text(
             text=call.message.text,
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_calendar(
-                name=name, year=int(year), month=int(month),
-                lst_current_date=lst_currant_date),
+            reply_markup=navigation_markup(name, action, year, month, lst_currant_date),
         )
         return None
     elif action == "MENU":
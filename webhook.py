@@ -0,0 +1,181 @@
+"""
+Приём обновлений Telegram через webhook
+
+Локальный HTTP-сервер принимает обновления и раскладывает их по рабочим потокам
+по chat_id: обновления одного чата обрабатываются по порядку, разных чатов - параллельно.
+Если очередь потока заполнена, сервер отвечает 503 и Telegram повторит доставку позже.
+
+Проверка локально: python main.py --webhook и POST JSON-обновления на
+http://127.0.0.1:8443/webhook
+"""
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Full, Queue
+from threading import Lock, Thread
+
+from telebot.types import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Адрес и путь локального сервера (снаружи - через обратный прокси с TLS;
+# '0.0.0.0' открывает порт на всех интерфейсах)
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/webhook'
+# Публичный адрес webhook для Telegram ('' - не регистрировать, например при локальной проверке)
+WEBHOOK_URL = ''
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token (обязателен при заданном WEBHOOK_URL;
+# '' - не проверять, только для локальной проверки)
+WEBHOOK_SECRET = ''
+# Количество потоков обработки и размер очереди каждого потока
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 100
+
+
+def update_chat_id(data: dict):
+    """
+    Чат обновления (ключ упорядочивания)
+
+    :param data: JSON обновления
+    :return: chat_id или update_id, если чата нет
+    """
+    for kind in ('message', 'edited_message', 'callback_query'):
+        item = data.get(kind)
+        if item:
+            message = item.get('message') or item
+            chat = message.get('chat') or item.get('from') or {}
+            if 'id' in chat:
+                return chat['id']
+    return data.get('update_id')
+
+
+class UpdateProcessor:
+    """
+    Пул потоков обработки обновлений с очередью на поток.
+    Чат всегда попадает в один поток, поэтому его обновления не переставляются.
+
+    :param process: Обработчик одного обновления
+    :param workers: Количество потоков
+    :param queue_size: Размер очереди потока
+    """
+    def __init__(self, process, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.process = process
+        self._queues = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads: list[Thread] = []
+        self._lock = Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Запускает потоки обработки"""
+        if not self._threads:
+            for i, queue in enumerate(self._queues):
+                thread = Thread(target=self._run, args=(queue,), name=f'webhook-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, key, update) -> bool:
+        """
+        Ставит обновление в очередь потока чата
+
+        :param key: Чат обновления
+        :param update: Обновление
+        :return: False, если очередь заполнена
+        """
+        try:
+            self._queues[hash(key) % len(self._queues)].put_nowait(update)
+        except Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def _run(self, queue: Queue) -> None:
+        """Цикл потока обработки"""
+        while True:
+            update = queue.get()
+            try:
+                self.process(update)
+                failed = False
+            except Exception:
+                failed = True
+                logger.exception('Ошибка обработки обновления')
+            with self._lock:
+                self.processed += 1
+                self.failed += failed
+
+    def stats(self) -> dict:
+        """Принятые, отклонённые (очередь заполнена), обработанные обновления и длина очередей"""
+        with self._lock:
+            return {'accepted': self.accepted, 'rejected': self.rejected, 'processed': self.processed,
+                    'failed': self.failed, 'queued': sum(x.qsize() for x in self._queues)}
+
+
+def make_handler(processor: UpdateProcessor, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    """Класс обработчика HTTP-запросов webhook"""
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                self.send_error(404)
+                return
+            if secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+                self.send_error(403)
+                return
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                update = Update.de_json(data)
+            except (ValueError, TypeError, KeyError):
+                self.send_error(400)
+                return
+            if not processor.submit(update_chat_id(data), update):
+                # Обратное давление: Telegram повторит доставку
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+def run(bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, url=WEBHOOK_URL, workers=WEBHOOK_WORKERS,
+        secret=WEBHOOK_SECRET) -> None:
+    """
+    Регистрирует webhook (если задан url) и принимает обновления
+
+    :param bot: TeleBot с зарегистрированными обработчиками
+    :param host: Адрес сервера
+    :param port: Порт сервера
+    :param url: Публичный адрес webhook
+    :param workers: Количество потоков обработки
+    :param secret: Секрет заголовка X-Telegram-Bot-Api-Secret-Token
+    """
+    if url and not secret:
+        # Без секрета любой, кто достучится до порта, может прислать поддельное обновление
+        raise ValueError('Для публичного WEBHOOK_URL задайте WEBHOOK_SECRET')
+    # Обработчики выполняются в потоке чата, а не в пуле TeleBot
+    bot.threaded = False
+    processor = UpdateProcessor(lambda update: bot.process_new_updates([update]), workers)
+    processor.start()
+    metrics.gauge('webhook_queued_updates', 'Updates waiting for a webhook worker',
+                  lambda: processor.stats()['queued'])
+    metrics.gauge('webhook_rejected_updates', 'Updates rejected because a worker queue was full',
+                  lambda: processor.rejected)
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url, secret_token=secret, max_connections=workers)
+    server = ThreadingHTTPServer((host, port), make_handler(processor, secret=secret))
+    server.serve_forever()